@@ -1,5 +1,9 @@
+import base64
+import binascii
 import logging
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Dict, List, Optional
 
 from fastapi import (
     APIRouter,
@@ -11,17 +15,24 @@ from fastapi import (
     HTTPException,
     Path,
     Query,
+    Request,
+    Response,
     UploadFile,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from pydantic import UUID4, BaseModel, HttpUrl
+from starlette.concurrency import run_in_threadpool
 
+from app.api.responses import EncodedJSONResponse
+from app.config import config
 from app.datamodel.attachment import AttachmentReference
 from app.datamodel.dpp import DigitalProductPassport
+from app.datamodel.encoding import encode_json
 from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
 from app.datastores.data.basedatastore import (
-    BaseDataStore,
-    BaseStoreStatistics,
+    AsyncBaseDataStore,
+    AsyncBaseStoreStatistics,
+    CreationHistogramIntervals,
     DPPResponseContentFormats,
     DPPResponseFormats,
     EventFilterFormats,
@@ -31,6 +42,11 @@ from app.main import get_datastores
 
 logger = logging.getLogger("dpp-api")
 
+# Thumbnails are never requested larger than the largest rendition.
+MAX_THUMBNAIL_HEIGHT = max(
+    (config["attachment"].get("renditions", None) or {}).get("heights", [100, 300, 800])
+)
+
 
 # Define a common response structure
 class ErrorResponseModel(BaseModel):
@@ -56,25 +72,53 @@ dpp_app = APIRouter(
 
 
 @dpp_app.get("/latest")
-async def get_latest_dpp(datastores=Depends(get_datastores)):
+async def get_latest_dpp(
+    n: Optional[int] = Query(None, ge=1, le=100), datastores=Depends(get_datastores)
+):
     """
     UI-specific. Get the latest generated DPP.
+    With n, get the n latest generated DPPs (compact), newest first.
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    latest_added_dpp_id = data_store.get_latest_added_dpp_document_id()
-    return JSONResponse({"result": latest_added_dpp_id})
+    if n is None:
+        latest_added_dpp_id = await data_store.get_latest_added_dpp_document_id()
+        return EncodedJSONResponse({"result": latest_added_dpp_id})
+    latest_added_dpps = [
+        await data_store.get_dpp_document(
+            dpp_id, content_format=DPPResponseContentFormats.COMPACT.value
+        )
+        for dpp_id in await data_store.get_latest_added_dpp_document_ids(n)
+    ]
+    return EncodedJSONResponse({"result": latest_added_dpps})
 
 
 @dpp_app.get("/random")
-async def get_random_dpp(datastores=Depends(get_datastores)):
+async def get_random_dpp(
+    count: Optional[int] = Query(None, ge=1, le=10000),
+    passport_type: List[str] = Query([]),
+    tag: List[str] = Query([]),
+    datastores=Depends(get_datastores),
+):
     """
     UI-specific. Get a random DPP.
+    With count, get up to count distinct random DPP IDs instead.
+    Both can be restricted to passport types and/or tags (all tags need to be present).
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    random_dpp_id = data_store.get_random_dpp_document_id()
-    return JSONResponse({"result": random_dpp_id})
+    if count is None and not passport_type and not tag:
+        random_dpp_id = await data_store.get_random_dpp_document_id()
+        return EncodedJSONResponse({"result": random_dpp_id})
+    filter_conditions = FilterConditions(passport_type=passport_type, tags=tag)
+    random_dpp_ids = await data_store.sample_dpp_document_ids(
+        count or 1, filter_conditions
+    )
+    if count is None:
+        return EncodedJSONResponse(
+            {"result": random_dpp_ids[0] if random_dpp_ids else None}
+        )
+    return EncodedJSONResponse({"result": random_dpp_ids})
 
 
 @dpp_app.get("/metadata")
@@ -82,19 +126,152 @@ async def get_metadata(datastores=Depends(get_datastores)):
     """
     Get metadata.
     """
-    data_store_statistics: BaseStoreStatistics = datastores[3]
-    return JSONResponse(data_store_statistics.to_dict())
+    data_store_statistics: AsyncBaseStoreStatistics = datastores[3]
+    return EncodedJSONResponse(await data_store_statistics.to_dict())
+
+
+@dpp_app.get("/metadata/created")
+async def get_metadata_created(
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    interval: Optional[CreationHistogramIntervals] = Query(None),
+    datastores=Depends(get_datastores),
+):
+    """
+    Get the number of passports created in a time range (default: the last 30 days).
+    With an interval (day/week/month), a histogram of counts per interval is returned instead.
+    """
+    data_store_statistics: AsyncBaseStoreStatistics = datastores[3]
+    if end is None:
+        end = datetime.now(timezone.utc)
+    if start is None:
+        start = end - timedelta(days=30)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if interval is None:
+        count = await data_store_statistics.passports_created_in_time_range(start, end)
+        return EncodedJSONResponse(
+            {"start": start.isoformat(), "end": end.isoformat(), "count": count}
+        )
+    try:
+        histogram = await data_store_statistics.passports_created_histogram(
+            start, end, interval.value
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return EncodedJSONResponse(histogram)
+
+
+@dpp_app.get("/metadata/cache")
+async def get_metadata_cache(datastores=Depends(get_datastores)):
+    """
+    Get hit/miss metrics of the DPP response cache.
+    """
+    data_store: AsyncBaseDataStore = datastores[0]
+    return EncodedJSONResponse(await data_store.get_response_cache_metrics())
+
+
+@dpp_app.get("/metadata/attachments")
+async def get_metadata_attachments(datastores=Depends(get_datastores)):
+    """
+    Get the number and size of attachments, and the bytes saved by storing identical
+    files once.
+    """
+    attachment_store: BaseAttachmentStore = datastores[1]
+    return EncodedJSONResponse(attachment_store.get_attachment_storage_metrics())
+
+
+@dpp_app.get("/metadata/cache/thumbnails")
+async def get_metadata_thumbnail_cache(datastores=Depends(get_datastores)):
+    """
+    Get hit/miss metrics of the attachment thumbnail cache.
+    """
+    attachment_store: BaseAttachmentStore = datastores[1]
+    return EncodedJSONResponse(attachment_store.get_thumbnail_cache_metrics())
+
+
+# Search cursors are opaque to clients, but simply wrap the last returned DPP ID.
+def encode_search_cursor(document_id: str) -> str:
+    return base64.urlsafe_b64encode(document_id.encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+
+# Up to limit search results (all without a limit), starting with the already fetched first one.
+async def take_search_results(
+    first_result: Dict[str, str] | None,
+    results: AsyncIterator[Dict[str, str]],
+    limit: int | None,
+) -> AsyncIterator[Dict[str, str]]:
+    if first_result is None:
+        return
+    yield first_result
+    taken = 1
+    while limit is None or taken < limit:
+        result = await anext(results, None)
+        if result is None:
+            return
+        yield result
+        taken += 1
 
 
 @dpp_app.post("/search")
 async def search_backend(
-    filter_conditions: FilterConditions, datastores=Depends(get_datastores)
+    filter_conditions: FilterConditions,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    datastores=Depends(get_datastores),
 ):
     """
     Search backend with filter conditions.
-    """
-    data_store: BaseDataStore = datastores[0]
-    return JSONResponse(data_store.search_for_dpp(filter_conditions))
+    - Without limit, cursor or stream, all results are returned as a list.
+    - With limit and/or cursor, a page is returned as {"results": [...], "next_cursor": ...}.
+      Pass next_cursor back as cursor to get the next page, it is null on the last page.
+    - With stream, results are streamed as newline-delimited JSON (limit and cursor apply).
+    """
+    data_store: AsyncBaseDataStore = datastores[0]
+    if limit is None and cursor is None and not stream:
+        return EncodedJSONResponse(await data_store.search_for_dpp(filter_conditions))
+
+    after_document_id = decode_search_cursor(cursor) if cursor is not None else None
+    results = data_store.search_for_dpp_iterator(
+        filter_conditions, after_document_id=after_document_id
+    )
+    try:
+        # Fetch the first result already, so an unknown cursor is reported as such.
+        first_result = await anext(results, None)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+    if stream:
+        return StreamingResponse(
+            (
+                encode_json(result) + b"\n"
+                async for result in take_search_results(first_result, results, limit)
+            ),
+            media_type="application/x-ndjson",
+        )
+
+    # Read one result beyond the page, to know if another page exists.
+    page = [
+        result
+        async for result in take_search_results(
+            first_result, results, limit + 1 if limit is not None else None
+        )
+    ]
+    next_cursor = None
+    if limit is not None and len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_search_cursor(page[-1]["value"])
+    return EncodedJSONResponse({"results": page, "next_cursor": next_cursor})
 
 
 @dpp_app.post("/{document_id}")
@@ -110,40 +287,94 @@ async def post_dpp(
     May work with DPPs with no existing connections.
     """
     logger.debug("Publishing DPP with ID -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    data_store.add_dpp_document(document_id, dpp_document=document)
-    return JSONResponse({"result": "added successfully"})
+    await data_store.add_dpp_document(document_id, dpp_document=document)
+    return EncodedJSONResponse({"result": "added successfully"})
+
+
+# Validators for conditional GETs of a DPP representation. They are derived from the DPP
+# version, so unchanged DPPs can be answered with a 304 without building the body.
+# The modification time in the ETag keeps it unique across restarts, as versions restart at 0.
+async def dpp_validators(
+    data_store: AsyncBaseDataStore, document_id: str, representation: str
+) -> Dict[str, str] | None:
+    last_modified = await data_store.get_dpp_last_modified(document_id)
+    if last_modified is None:
+        return None
+    version = await data_store.get_dpp_version(document_id)
+    modified_stamp = int(last_modified.timestamp() * 1_000_000)
+    return {
+        "ETag": f'"{version}-{modified_stamp:x}-{representation}"',
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+    }
+
+
+# If-None-Match takes precedence over If-Modified-Since (RFC 9110, section 13.2.2).
+def is_not_modified(request: Request, validators: Dict[str, str]) -> bool:
+    if_none_match = request.headers.get("if-none-match", None)
+    if if_none_match is not None:
+        for entity_tag in if_none_match.split(","):
+            entity_tag = entity_tag.strip()
+            if entity_tag == "*" or entity_tag.removeprefix("W/") == validators["ETag"]:
+                return True
+        return False
+    if_modified_since = request.headers.get("if-modified-since", None)
+    if if_modified_since is not None:
+        try:
+            modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if modified_since.tzinfo is None:
+            modified_since = modified_since.replace(tzinfo=timezone.utc)
+        return parsedate_to_datetime(validators["Last-Modified"]) <= modified_since
+    return False
 
 
 # Get a basic DPP without signature
 @dpp_app.get("/{document_id}")
-async def get_dpp_basic(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_basic(
+    document_id: str, request: Request, datastores=Depends(get_datastores)
+):
     """
     Get basic DPP details without signature.
+    Supports conditional requests with If-None-Match and If-Modified-Since.
     """
     logger.debug("Retrieving DPP with ID -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    result = data_store.get_dpp_document(document_id)
-    return JSONResponse(result)
+    validators = await dpp_validators(
+        data_store, document_id, DPPResponseContentFormats.BASE.value
+    )
+    if validators is not None and is_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
+    result = await data_store.get_encoded_dpp_document(document_id)
+    return EncodedJSONResponse(result, headers=validators)
 
 
 # Get a compact DPP without signature
 @dpp_app.get("/{document_id}/compact")
-async def get_dpp_compact(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_compact(
+    document_id: str, request: Request, datastores=Depends(get_datastores)
+):
     """
     Get basic DPP details without signature.
+    Supports conditional requests with If-None-Match and If-Modified-Since.
     """
     logger.debug("Retrieving DPP with ID -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
+    validators = await dpp_validators(
+        data_store, document_id, DPPResponseContentFormats.COMPACT.value
+    )
+    if validators is not None and is_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
     try:
-        result = data_store.get_dpp_document(
+        result = await data_store.get_encoded_dpp_document(
             document_id,
             content_format=DPPResponseContentFormats.COMPACT.value,
         )
-        return JSONResponse(result)
+        return EncodedJSONResponse(result, headers=validators)
     except Exception as e:
         logger.error(
             f"Unexpected error retrieving DPP document with ID {document_id}: {str(e)}"
@@ -152,18 +383,26 @@ async def get_dpp_compact(document_id: str, datastores=Depends(get_datastores)):
 
 
 @dpp_app.get("/{document_id}/full")
-async def get_dpp_full(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_full(
+    document_id: str, request: Request, datastores=Depends(get_datastores)
+):
     """
     Get full DPP details including all attachments.
+    Supports conditional requests with If-None-Match and If-Modified-Since.
     """
     logger.debug("Retrieving full DPP with ID -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
+    validators = await dpp_validators(
+        data_store, document_id, DPPResponseContentFormats.FULL.value
+    )
+    if validators is not None and is_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
     try:
-        result = data_store.get_dpp_document(
+        result = await data_store.get_encoded_dpp_document(
             document_id, content_format=DPPResponseContentFormats.FULL.value
         )
-        return JSONResponse(result)
+        return EncodedJSONResponse(result, headers=validators)
     except Exception as e:
         logger.error(
             f"Unexpected error retrieving DPP document with ID {document_id}: {str(e)}"
@@ -172,16 +411,22 @@ async def get_dpp_full(document_id: str, datastores=Depends(get_datastores)):
 
 
 @dpp_app.get("/{document_id}/attributes")
-async def get_dpp_attributes(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_attributes(
+    document_id: str, request: Request, datastores=Depends(get_datastores)
+):
     """
     Get DPP attribute information.
+    Supports conditional requests with If-None-Match and If-Modified-Since.
     """
     logger.debug("Retrieving attributes of DPP -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
+    validators = await dpp_validators(data_store, document_id, "attributes")
+    if validators is not None and is_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
     try:
-        result = data_store.get_dpp_object(document_id).attributes
-        return JSONResponse(result)
+        result = (await data_store.get_dpp_object(document_id)).attributes
+        return EncodedJSONResponse(result, headers=validators)
     except Exception as e:
         logger.error(
             f"Unexpected error retrieving DPP document with ID {document_id}: {str(e)}"
@@ -191,16 +436,20 @@ async def get_dpp_attributes(document_id: str, datastores=Depends(get_datastores
 
 @dpp_app.get("/{document_id}/general")
 async def get_dpp_general_information(
-    document_id: str, datastores=Depends(get_datastores)
+    document_id: str, request: Request, datastores=Depends(get_datastores)
 ):
     """
     Get basic DPP details.
+    Supports conditional requests with If-None-Match and If-Modified-Since.
     """
     logger.debug("Retrieving attributes of DPP -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
+    validators = await dpp_validators(data_store, document_id, "general")
+    if validators is not None and is_not_modified(request, validators):
+        return Response(status_code=304, headers=validators)
     try:
-        dpp_object = data_store.get_dpp_object(document_id)
+        dpp_object = await data_store.get_dpp_object(document_id)
         output_content = {
             "id": dpp_object.id,
             "title": dpp_object.title,
@@ -218,7 +467,7 @@ async def get_dpp_general_information(
             "parent": dpp_object.parent,  # Reference to parent
         }
         # print(data_store.get_dpp_object(document_id).attributes)
-        return JSONResponse(output_content)
+        return EncodedJSONResponse(output_content, headers=validators)
     except Exception as e:
         logger.error(
             f"Unexpected error retrieving DPP document with ID {document_id}: {str(e)}"
@@ -232,23 +481,29 @@ async def get_dpp_credentials(document_id: str, datastores=Depends(get_datastore
     Get DPP credential information.
     """
     logger.debug("Retrieving attributes of DPP -> " + document_id)
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    print(data_store.get_dpp_object(document_id).credentials)
-    return JSONResponse(data_store.get_dpp_object(document_id).attributes)
+    dpp_object = await data_store.get_dpp_object(document_id)
+    return EncodedJSONResponse(dpp_object.attributes)
 
 
 @dpp_app.get("/{document_id}/events")
-async def get_dpp_all_events(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_all_events(
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
+):
     """
     Get ownership events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_events(
-        document_id, event_type=EventFilterFormats.ALL.value
+    events = await data_store.get_dpp_events(
+        document_id, event_type=EventFilterFormats.ALL.value, since=since, until=until
     )
-    return JSONResponse(events)
+    return EncodedJSONResponse(events)
 
 
 @dpp_app.post("/{document_id}/events/activity")
@@ -258,10 +513,10 @@ async def add_dpp_activity_event(
     """
     Add an activity event to a DPP.
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    data_store.add_dpp_event(document_id, event)
-    return JSONResponse({"document_id": document_id, "event": event})
+    await data_store.add_dpp_event(document_id, event)
+    return EncodedJSONResponse({"document_id": document_id, "event": event})
 
 
 @dpp_app.post("/{document_id}/events/ownership")
@@ -271,79 +526,109 @@ async def add_dpp_ownership_event(
     """
     Add an ownership event to a DPP.
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    data_store.add_dpp_event(
+    await data_store.add_dpp_event(
         document_id, event, event_type=EventFilterFormats.OWNERSHIP.value
     )
-    return JSONResponse({"document_id": document_id, "event": event})
+    return EncodedJSONResponse({"document_id": document_id, "event": event})
 
 
 @dpp_app.get("/{document_id}/events/activity")
-async def get_dpp_activity_events(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_activity_events(
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
+):
     """
     Get activity events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_events(document_id)
-    return JSONResponse(events)
+    events = await data_store.get_dpp_events(document_id, since=since, until=until)
+    return EncodedJSONResponse(events)
 
 
 @dpp_app.get("/{document_id}/events/ownership")
 async def get_dpp_ownership_events(
-    document_id: str, datastores=Depends(get_datastores)
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
 ):
     """
     Get ownership events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_events(
-        document_id, event_type=EventFilterFormats.OWNERSHIP.value
+    events = await data_store.get_dpp_events(
+        document_id,
+        event_type=EventFilterFormats.OWNERSHIP.value,
+        since=since,
+        until=until,
     )
-    return JSONResponse(events)
+    return EncodedJSONResponse(events)
 
 
 @dpp_app.get("/{document_id}/events/full")
-async def get_dpp_full_events(document_id: str, datastores=Depends(get_datastores)):
+async def get_dpp_full_events(
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
+):
     """
     Get complete activity events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_full_events(
-        document_id, event_type=EventFilterFormats.ALL.value
+    events = await data_store.get_dpp_full_events(
+        document_id, event_type=EventFilterFormats.ALL.value, since=since, until=until
     )
-    return JSONResponse(events)
+    return EncodedJSONResponse(events)
 
 
 @dpp_app.get("/{document_id}/events/activity/full")
 async def get_dpp_full_activity_events(
-    document_id: str, datastores=Depends(get_datastores)
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
 ):
     """
     Get complete activity events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_full_events(document_id)
-    return JSONResponse(events)
+    events = await data_store.get_dpp_full_events(document_id, since=since, until=until)
+    return EncodedJSONResponse(events)
 
 
 @dpp_app.get("/{document_id}/events/ownership/full")
 async def get_dpp_full_ownership_events(
-    document_id: str, datastores=Depends(get_datastores)
+    document_id: str,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    datastores=Depends(get_datastores),
 ):
     """
     Get complete ownership events of a DPP sorted.
+    Optionally only events within [since, until].
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    events = data_store.get_dpp_full_events(
-        document_id, event_type=EventFilterFormats.OWNERSHIP.value
+    events = await data_store.get_dpp_full_events(
+        document_id,
+        event_type=EventFilterFormats.OWNERSHIP.value,
+        since=since,
+        until=until,
     )
-    return JSONResponse(events)
+    return EncodedJSONResponse(events)
 
 
 # WIP: Attachment endpoints
@@ -356,18 +641,64 @@ async def get_dpp_full_ownership_events(
 
 @dpp_app.get("/{document_id}/attachments/{attachment_id}")
 async def get_dpp_attachment(
-    document_id: str, attachment_id: str, datastores=Depends(get_datastores)
+    document_id: str,
+    attachment_id: str,
+    request: Request,
+    datastores=Depends(get_datastores),
 ):
+    """
+    Download an attachment.
+    Supports conditional requests with If-None-Match and If-Modified-Since, and resuming
+    downloads with Range and If-Range.
+    """
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    return attachment_store.retrieve_attachment(attachment_id)
+    await data_store.catch_up()
+    try:
+        # Files used in place are hashed on their first download, off the event loop.
+        response = await run_in_threadpool(
+            attachment_store.retrieve_attachment, attachment_id
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    validators = {
+        "ETag": response.headers["etag"],
+        "Last-Modified": response.headers["last-modified"],
+    }
+    if is_not_modified(request, validators):
+        headers = {**validators, "Cache-Control": response.headers["cache-control"]}
+        return Response(status_code=304, headers=headers)
+    return response
 
 
 @dpp_app.get("/{document_id}/attachments/{attachment_id}/thumbnail")
 async def get_dpp_attachment_thumbnail(
-    document_id: str, attachment_id: str, datastores=Depends(get_datastores)
+    document_id: str,
+    attachment_id: str,
+    request: Request,
+    height: int = Query(100, gt=0, le=MAX_THUMBNAIL_HEIGHT),
+    datastores=Depends(get_datastores),
 ):
+    """
+    Get a thumbnail of an image attachment, close to the requested height.
+    WebP is served to clients accepting it, JPEG otherwise.
+    """
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    return attachment_store.retrieve_attachment_thumbnail(attachment_id, (None, 100))
+    await data_store.catch_up()
+    image_formats = ["jpeg"]
+    if "image/webp" in request.headers.get("accept", ""):
+        image_formats.insert(0, "webp")
+    # Thumbnails that are not rendered yet are resized here, off the event loop.
+    try:
+        return await run_in_threadpool(
+            attachment_store.retrieve_attachment_thumbnail,
+            attachment_id,
+            (None, height),
+            image_formats,
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 
 @dpp_app.get("/{document_id}/attachments")
@@ -378,15 +709,16 @@ async def get_dpp_attachments(
     """
     Add attachments to a DPP.
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
-    dpp: DigitalProductPassport = data_store.get_dpp_object(document_id)
+    dpp: DigitalProductPassport = await data_store.get_dpp_object(document_id)
     attachment_references = [
         attachment_store.attachments_index[id].to_public_dict()
         for id in dpp.attachments
+        if id in attachment_store.attachments_index
     ]
     # Your implementation here
-    return JSONResponse(attachment_references)
+    return EncodedJSONResponse(attachment_references)
 
 
 @dpp_app.post("/{document_id}/attachments")
@@ -404,48 +736,76 @@ async def add_dpp_attachment(
     """
     Add attachments to a DPP.
     """
-    data_store: BaseDataStore = datastores[0]
+    data_store: AsyncBaseDataStore = datastores[0]
     attachment_store: BaseAttachmentStore = datastores[1]
     partial_attachment_reference = AttachmentReference(
         attachment_type=attachment_type,  # type: ignore
         path=None,
         source=source,  # type: ignore
+        source_id=document_id,
         template_id=template_id,
         template_version=template_version,
         description=description,
         is_default=is_default,
     )
-    completed_attachment_reference = attachment_store.add_attachment(
-        file, attachment_reference=partial_attachment_reference
+    completed_attachment_reference = await attachment_store.add_attachment(
+        file, partial_attachment_reference
     )
-    # Your implementation here
-    return JSONResponse(completed_attachment_reference.to_public_dict())
+    # The DPP lists the attachment, and gets a new version.
+    await data_store.register_attachment_change(
+        completed_attachment_reference.attachment_id,
+        completed_attachment_reference,
+        document_id,
+    )
+    return EncodedJSONResponse(completed_attachment_reference.to_public_dict())
 
 
-@dpp_app.put("/{uuid}/attachments/{attachment_id}")
+@dpp_app.put("/{document_id}/attachments/{attachment_id}")
 async def update_attachment(
-    uuid: UUID4,
-    attachment_id: UUID4,
-    # attachment: UpdateFileAttachmentModel
+    document_id: str,
+    attachment_id: str,
+    file: UploadFile = File(...),
+    datastores=Depends(get_datastores),
 ):
     """
     Update a file attachment for a DPP instance
     """
-    raise HTTPException(status_code=500, detail="Not implemented!")
-    # return {
-    #     "uuid": uuid,
-    #     "attachment_id": attachment_id,
-    #     "updated_attachment": attachment,
-    # }
+    data_store: AsyncBaseDataStore = datastores[0]
+    attachment_store: BaseAttachmentStore = datastores[1]
+    await data_store.catch_up()
+    try:
+        attachment_reference = await attachment_store.update_attachment(
+            file, attachment_id
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # The DPPs listing the attachment get a new version.
+    await data_store.register_attachment_change(attachment_id, attachment_reference)
+    return EncodedJSONResponse(attachment_reference.to_public_dict())
 
 
-@dpp_app.delete("/{uuid}/attachments/{attachment_id}")
-async def delete_attachment(uuid: UUID4, attachment_id: UUID4):
+@dpp_app.delete("/{document_id}/attachments/{attachment_id}")
+async def delete_attachment(
+    document_id: str,
+    attachment_id: str,
+    datastores=Depends(get_datastores),
+):
     """
     Delete a file attachment from a DPP instance
     """
-    raise HTTPException(status_code=500, detail="Not implemented!")
-    # return {"uuid": uuid, "attachment_id": attachment_id, "deleted": True}
+    data_store: AsyncBaseDataStore = datastores[0]
+    attachment_store: BaseAttachmentStore = datastores[1]
+    await data_store.catch_up()
+    if attachment_id not in attachment_store.attachments_index:
+        raise HTTPException(status_code=404, detail="Attachment missing.")
+    try:
+        attachment_store.delete_attachment(attachment_id)
+    except FileNotFoundError:
+        # The reference is removed, even when its file was not available.
+        pass
+    # The DPPs listing the attachment no longer do, and get a new version.
+    await data_store.register_attachment_change(attachment_id, None)
+    return {"document_id": document_id, "attachment_id": attachment_id, "deleted": True}
 
 
 # Instantiate a DPP from a template
@@ -0,0 +1,22 @@
+from typing import Any
+
+from fastapi.responses import FileResponse, JSONResponse
+
+from app.datamodel.encoding import encode_json
+
+
+# JSON response rendered with the configured encoder (see app.datamodel.encoding).
+# Content that is already encoded, such as cached DPP documents, is sent as-is.
+class EncodedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return encode_json(content)
+
+
+# File response for attachments. Starlette answers Range and If-Range requests (206 Partial
+# Content), comparing If-Range to the ETag, which the attachment store derives from the content
+# hash. Servers supporting the http.response.pathsend extension get the path of whole files
+# (by Starlette), others get the file in large chunks.
+class AttachmentFileResponse(FileResponse):
+    chunk_size = 1024 * 1024
@@ -1,3 +1,4 @@
+import os
 from dataclasses import asdict, dataclass
 from enum import Enum
 from typing import Optional
@@ -32,6 +33,17 @@ class AttachmentReference:
     attachment_id: Optional[str] = None
     file_size: Optional[int] = None
     file_name: Optional[str] = None
+    # SHA-256 digest of the content, hex-encoded. Not known for files imported in place.
+    content_hash: Optional[str] = None
+
+    # Files imported in place are indexed without their size, which is read on first access.
+    def get_file_size(self) -> Optional[int]:
+        if self.file_size is None and self.path is not None:
+            try:
+                self.file_size = os.path.getsize(self.path)
+            except OSError:
+                pass
+        return self.file_size
 
     def to_dict(self):
         return asdict(self)
@@ -43,7 +55,7 @@ class AttachmentReference:
             "attachment_id": self.attachment_id,
             "description": self.description,
             "file_name": self.file_name,
-            "file_size": self.file_size,
+            "file_size": self.get_file_size(),
         }
         if self.source == AttachmentSourceType.TEMPLATE.value:
             output["template_id"] = self.template_id
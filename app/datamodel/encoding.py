@@ -0,0 +1,67 @@
+import json
+import logging
+from typing import Any, Callable, Dict
+
+from app.config import config
+
+logger = logging.getLogger("encoding")
+
+# JSON encoding of API responses. The encoder is selected with system.json_encoder in the
+# config: "auto" (default) uses orjson when it is installed, and the stdlib json module
+# otherwise. Output is compact UTF-8, like the default JSONResponse rendering.
+# Decoding (of imported data) always prefers orjson, as both parse to the same objects.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json_stdlib(content: Any) -> bytes:
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def encode_json_orjson(content: Any) -> bytes:
+    try:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # orjson is stricter than json, for example on integers beyond 64 bits.
+        return encode_json_stdlib(content)
+
+
+JSON_ENCODERS: Dict[str, Callable[[Any], bytes]] = {"json": encode_json_stdlib}
+if orjson is not None:
+    JSON_ENCODERS["orjson"] = encode_json_orjson
+
+
+def select_json_encoder(name: str = "auto") -> Callable[[Any], bytes]:
+    if name == "auto":
+        name = "orjson" if "orjson" in JSON_ENCODERS else "json"
+    if name not in JSON_ENCODERS:
+        raise Exception(
+            "JSON encoder not available -> "
+            + name
+            + ", choose from "
+            + ", ".join(JSON_ENCODERS)
+        )
+    logger.debug("Using JSON encoder -> " + name)
+    return JSON_ENCODERS[name]
+
+
+encode_json = select_json_encoder(config.get("system", {}).get("json_encoder", "auto"))
+
+
+def decode_json(content: bytes | str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except ValueError:
+            # Let json decide, it is more lenient (NaN, integers beyond 64 bits).
+            pass
+    return json.loads(content)
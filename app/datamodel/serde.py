@@ -194,6 +194,8 @@ def import_dpp_into_storage(
                         "Input activity event different from existing added event with the same ID ->"
                         + event_id
                     )
+                # Reference the existing event from this passport as well.
+                data_store.add_dpp_event(passport_id, existing_event, "activity")
         except Exception as e:
             print(e)
             logger.error("Cannot find ID for activity event in " + passport_id)
@@ -220,6 +222,8 @@ def import_dpp_into_storage(
                         "Input ownership event different from existing added event with the same ID ->"
                         + event_id
                     )
+                # Reference the existing event from this passport as well.
+                data_store.add_dpp_event(passport_id, existing_event, "ownership")
         except:
             logger.error("Cannot find ID for ownership event in " + passport_id)
 
@@ -237,16 +241,14 @@ def import_dpp_into_storage(
         + passport_id
     )
 
-    # Add references to DPP object
-    passport_obj.events = {
-        "activity": activity_event_ids_to_store,
-        "ownership": ownership_event_ids_to_store,
-    }
-    logger.debug(
-        format_multiline_log(
-            json.dumps(data_store.get_dpp_database_metadata(), indent=4)
+    # References were added to the DPP object by add_dpp_event, in timestamp order.
+    # Only build the metadata dump when it is logged, it is costly for bulk imports.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            format_multiline_log(
+                json.dumps(data_store.get_dpp_database_metadata(), indent=4)
+            )
         )
-    )
     # logger.debug(
     #     format_multiline_log(
     #         json.dumps(
@@ -325,10 +327,12 @@ def prepare_dpp_response_content(
 
         # Retrieve attachments
         for attachment_id in dpp_object.attachments:
-            attachment_object: AttachmentReference = attachment_store.attachments_index[
-                attachment_id
-            ]
-            output_content["attachments"].append(attachment_object.to_public_dict())
+            attachment_object: AttachmentReference | None = (
+                attachment_store.attachments_index.get(attachment_id, None)
+            )
+            # Skip an attachment deleted while the response is prepared.
+            if attachment_object is not None:
+                output_content["attachments"].append(attachment_object.to_public_dict())
         output_content["events"] = {"activity": [], "ownership": []}
 
         # Retrieve activity and ownership events
@@ -346,10 +350,12 @@ def prepare_dpp_response_content(
 
         # Retrieve attachments
         for attachment_id in dpp_object.attachments:
-            attachment_object: AttachmentReference = attachment_store.attachments_index[
-                attachment_id
-            ]
-            output_content["attachments"].append(attachment_object.to_public_dict())
+            attachment_object: AttachmentReference | None = (
+                attachment_store.attachments_index.get(attachment_id, None)
+            )
+            # Skip an attachment deleted while the response is prepared.
+            if attachment_object is not None:
+                output_content["attachments"].append(attachment_object.to_public_dict())
         output_content["events"] = {"activity": [], "ownership": []}
 
         # Retrieve activity and ownership events
@@ -376,10 +382,12 @@ def prepare_dpp_response_content(
 
         # Retrieve attachments
         for attachment_id in dpp_object.attachments:
-            attachment_object: AttachmentReference = attachment_store.attachments_index[
-                attachment_id
-            ]
-            output_content["attachments"].append(attachment_object.to_public_dict())
+            attachment_object: AttachmentReference | None = (
+                attachment_store.attachments_index.get(attachment_id, None)
+            )
+            # Skip an attachment deleted while the response is prepared.
+            if attachment_object is not None:
+                output_content["attachments"].append(attachment_object.to_public_dict())
         output_content["events"] = {"activity": [], "ownership": []}
 
         # Retrieve activity and ownership events
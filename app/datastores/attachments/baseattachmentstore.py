@@ -2,7 +2,7 @@ import random
 import string
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import UploadFile
 from fastapi.responses import FileResponse
@@ -39,8 +39,9 @@ class BaseAttachmentStore(ABC):
         return "".join(random.choices(ID_ALPHABET, k=8))
 
     # No path, attachment reference will be
+    # Uploads are written off the event loop, so adding and updating are awaited.
     @abstractmethod
-    def add_attachment(
+    async def add_attachment(
         self, file: UploadFile, attachment_reference: AttachmentReference
     ) -> AttachmentReference:
         pass
@@ -50,17 +51,24 @@ class BaseAttachmentStore(ABC):
         pass
 
     # For specific images that may need backend reshaping
+    # image_formats lists the formats accepted by the client, in order of preference.
     @abstractmethod
     def retrieve_attachment_thumbnail(
         self,
         attachment_id: str,
         dimensions: Tuple[Optional[int], Optional[int]] = (None, None),
+        image_formats: Optional[List[str]] = None,
     ) -> FileResponse:
         pass
 
+    # Hit/miss metrics of the thumbnail cache.
+    @abstractmethod
+    def get_thumbnail_cache_metrics(self) -> Dict:
+        pass
+
     # Receive attachment ID, replace attachment that already existed.
     @abstractmethod
-    def update_attachment(
+    async def update_attachment(
         self, file: UploadFile, attachment_id: str
     ) -> AttachmentReference:
         pass
@@ -68,3 +76,29 @@ class BaseAttachmentStore(ABC):
     @abstractmethod
     def delete_attachment(self, attachment_id: str):
         pass
+
+    # Replace the index, as restored from a snapshot.
+    def restore_attachments_index(
+        self, attachments_index: Dict[str, AttachmentReference]
+    ) -> None:
+        self.attachments_index = attachments_index
+
+    # Apply a change to a single attachment that was made elsewhere: before a restart, or by
+    # another worker (see the write-ahead log). The files were written or removed with the
+    # change already. None removes the attachment from the index.
+    def restore_attachment(
+        self, attachment_id: str, attachment_reference: Optional[AttachmentReference]
+    ) -> None:
+        if attachment_reference is None:
+            self.attachments_index.pop(attachment_id, None)
+        else:
+            self.attachments_index[attachment_id] = attachment_reference
+
+    # Stop background work, as on shutdown.
+    def close(self) -> None:
+        pass
+
+    # Number and size of the attachments, and of the files storing them.
+    @abstractmethod
+    def get_attachment_storage_metrics(self) -> Dict:
+        pass
@@ -1,3 +1,4 @@
+import hashlib
 import io
 import json
 import logging
@@ -6,21 +7,37 @@ import random
 import shutil
 import string
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
 
 from fastapi import HTTPException, UploadFile
 from fastapi.responses import FileResponse
 from PIL import Image
+from starlette.concurrency import run_in_threadpool
 
+from app.api.responses import AttachmentFileResponse
 from app.config import format_multiline_log
-from app.datamodel.attachment import AttachmentReference, AttachmentSourceType
+from app.datamodel.attachment import (
+    AttachmentReference,
+    AttachmentSourceType,
+    AttachmentType,
+)
 from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.attachments.renditions import RenditionPipeline
+from app.datastores.attachments.thumbnailcache import ThumbnailCache
 
 logger = logging.getLogger("fs-file-store")
 
 
 class FileSystemAttachmentStore(BaseAttachmentStore):
+    # Resized images carry no format of their own, so thumbnails are JPEG.
+    THUMBNAIL_FORMAT = "jpeg"
+    # Size of the chunks copied from an upload to its file.
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+
     def __init__(self, attachment_config, reset=False) -> None:
         super().__init__()
         self.FILE_DIRECTORY = Path(os.path.join(os.getcwd(), attachment_config["path"]))
@@ -35,15 +52,54 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
             os.path.join(self.FILE_DIRECTORY, "templates")
         )
         self.DPP_TEMPLATES_FILE_DIRECTORY.mkdir(exist_ok=True)
+        # Content-addressed files, shared by all attachments with the same content.
+        # Structure-> blobs/<first 2 hex digits of the SHA-256 digest>/<digest>
+        # The number of attachments referring to every blob is derived from the index, a blob
+        # is removed together with its last attachment.
+        self.BLOB_FILE_DIRECTORY = Path(os.path.join(self.FILE_DIRECTORY, "blobs"))
+        self.BLOB_FILE_DIRECTORY.mkdir(exist_ok=True)
+        self.blob_references: Dict[str, int] = {}
+        self.blob_sizes: Dict[str, int] = {}
+        # Also held when a reference in the index is replaced or removed.
+        self.blobs_lock = threading.Lock()
+        # Thumbnails of images, rendered in the background after they are stored.
+        rendition_config = attachment_config.get("renditions", None) or {}
+        self.renditions = RenditionPipeline(
+            os.path.join(self.FILE_DIRECTORY, "renditions"),
+            rendition_config.get("heights", [100, 300, 800]),
+            rendition_config.get("formats", ["webp", "jpeg"]),
+            rendition_config.get("workers", 1),
+        )
+        # Attachments are revalidated with their ETag after this time.
+        self.cache_control = attachment_config.get(
+            "cache_control", "public, max-age=3600"
+        )
+        # Rendered thumbnails can be kept outside of the attachment files (thumbnails.path),
+        # which are replaced when the preseeded data is imported. By default, they are kept
+        # next to the files.
+        thumbnail_config = attachment_config.get("thumbnails", None) or {}
+        self.thumbnail_cache = ThumbnailCache(
+            os.path.join(
+                os.getcwd(),
+                thumbnail_config.get(
+                    "path", os.path.join(self.FILE_DIRECTORY, "thumbnails")
+                ),
+            ),
+            thumbnail_config.get("max_bytes", 100 * 1024 * 1024),
+        )
+        if reset:
+            self.thumbnail_cache.clear()
 
     def generate_path(self, partial_attachment_ref: AttachmentReference):
-        if partial_attachment_ref.source == AttachmentSourceType.INSTANCE:
+        # The API passes the source as its value, like the imported manifests.
+        source = AttachmentSourceType(partial_attachment_ref.source)
+        if source == AttachmentSourceType.INSTANCE:
             assert partial_attachment_ref.source_id is not None
             file_path = os.path.join(
                 self.DPP_FILE_DIRECTORY, partial_attachment_ref.source_id
             )
             return file_path
-        elif partial_attachment_ref.source == AttachmentSourceType.TEMPLATE:
+        elif source == AttachmentSourceType.TEMPLATE:
             # Published versions are intended to be immutable.
             version = "vLatest"
             assert partial_attachment_ref.template_id is not None
@@ -63,26 +119,24 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
     # - description - if provided
     # - is_default - if image, and if provided.
 
-    def add_attachment(
+    async def add_attachment(
         self, file: UploadFile, partial_attachment_ref: AttachmentReference
     ) -> AttachmentReference:
         unique_file_id = self.generate_unique_id_for_uploaded_attachment()
-
-        file_path = Path(self.generate_path(partial_attachment_ref))
+        # Validates the source of the attachment.
+        self.generate_path(partial_attachment_ref)
 
         try:
-            # Ensure the directory exists
-            file_path.mkdir(parents=True, exist_ok=True)
-
-            # Save the file
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            # Save the file, off the event loop
+            file_path, content_hash, file_size = await run_in_threadpool(
+                self.write_upload, file.file
+            )
 
             # Populate and return the AttachmentReference
             completed_attachment_reference = AttachmentReference(
                 # Assuming you have a way to determine or receive this
                 attachment_type=partial_attachment_ref.attachment_type,
-                path=file_path.as_posix(),
+                path=file_path,
                 source=partial_attachment_ref.source,
                 source_id=partial_attachment_ref.source_id,
                 template_id=partial_attachment_ref.template_id,
@@ -90,40 +144,249 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
                 description=partial_attachment_ref.description,
                 is_default=partial_attachment_ref.is_default,
                 attachment_id=unique_file_id,
-                file_size=file.size,
+                file_size=file_size,
                 file_name=file.filename,
+                content_hash=content_hash,
             )
             self.attachments_index[unique_file_id] = completed_attachment_reference
+            self.submit_renditions(completed_attachment_reference)
             return completed_attachment_reference
-        except:
-            raise Exception("Error uploading attachment.")
+        except Exception as e:
+            raise Exception(f"Error uploading attachment: {e}")
         finally:
-            file.file.close()
+            await file.close()
+
+    # Copy an upload to a temporary file, computing its SHA-256 digest and size on the way,
+    # and add it as a blob once complete. Readers never see a partial file. Blocking, runs on a
+    # worker thread. Returns the path of the blob, its digest and size.
+    def write_upload(self, source: BinaryIO) -> Tuple[str, str, int]:
+        self.BLOB_FILE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        file_size = 0
+        # A single buffer for all chunks, hashed and written without copies.
+        buffer = memoryview(bytearray(self.UPLOAD_CHUNK_SIZE))
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=self.BLOB_FILE_DIRECTORY, prefix=".upload-", delete=False
+        ) as f:
+            try:
+                while True:
+                    read = source.readinto(buffer)
+                    if not read:
+                        break
+                    digest.update(buffer[:read])
+                    f.write(buffer[:read])
+                    file_size += read
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        content_hash = digest.hexdigest()
+        return self.add_blob(f.name, content_hash, file_size), content_hash, file_size
+
+    def hash_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        buffer = memoryview(bytearray(self.UPLOAD_CHUNK_SIZE))
+        with open(path, "rb") as f:
+            while read := f.readinto(buffer):
+                digest.update(buffer[:read])
+        return digest.hexdigest()
+
+    # Paths of the files in the given folders, listed with one scandir per folder. The file
+    # type comes with the listing, so files are not stat'ed on their own.
+    def scan_files(
+        self, directories: Set[str], workers: Optional[int] = None
+    ) -> Set[str]:
+        def scan(directory: str) -> List[str]:
+            try:
+                with os.scandir(directory) as entries:
+                    return [entry.path for entry in entries if entry.is_file()]
+            except (FileNotFoundError, NotADirectoryError):
+                return []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return {
+                path
+                for paths in executor.map(scan, sorted(directories))
+                for path in paths
+            }
+
+    def get_blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.BLOB_FILE_DIRECTORY, content_hash[:2], content_hash)
+
+    # Move a complete file into the blob with its content, unless that blob exists already,
+    # and count one more reference to it.
+    def add_blob(self, path: str, content_hash: str, file_size: int) -> str:
+        blob_path = self.get_blob_path(content_hash)
+        with self.blobs_lock:
+            if self.blob_references.get(content_hash, 0) and os.path.isfile(blob_path):
+                os.unlink(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+            self.add_blob_reference(content_hash, file_size)
+        return Path(blob_path).as_posix()
+
+    # Callers hold blobs_lock.
+    def add_blob_reference(self, content_hash: str, file_size: int) -> None:
+        self.blob_references[content_hash] = (
+            self.blob_references.get(content_hash, 0) + 1
+        )
+        self.blob_sizes[content_hash] = file_size
+
+    # Count one reference less to a blob, and remove it after the last one.
+    def release_blob(self, content_hash: str) -> None:
+        with self.blobs_lock:
+            references = self.blob_references.get(content_hash, 0) - 1
+            if references > 0:
+                self.blob_references[content_hash] = references
+                return
+            self.blob_references.pop(content_hash, None)
+            self.blob_sizes.pop(content_hash, None)
+            Path(self.get_blob_path(content_hash)).unlink(missing_ok=True)
+            self.renditions.remove(content_hash)
+
+    def submit_renditions(self, attachment_reference: AttachmentReference) -> None:
+        attachment_type = getattr(
+            attachment_reference.attachment_type,
+            "value",
+            attachment_reference.attachment_type,
+        )
+        if (
+            attachment_type == AttachmentType.IMAGE.value
+            and attachment_reference.content_hash is not None
+            and attachment_reference.path is not None
+        ):
+            self.renditions.submit(
+                attachment_reference.content_hash, attachment_reference.path
+            )
+
+    # Whether the file of an attachment is a blob, which are the only files counted in
+    # blob_references. Files used in place keep their own path, also once they are hashed.
+    def is_blob(self, attachment_reference: AttachmentReference) -> bool:
+        return (
+            attachment_reference.content_hash is not None
+            and attachment_reference.path
+            == Path(self.get_blob_path(attachment_reference.content_hash)).as_posix()
+        )
+
+    # Release the file of an attachment that is deleted or replaced.
+    def release_file(self, attachment_reference: AttachmentReference) -> None:
+        if self.is_blob(attachment_reference):
+            self.release_blob(attachment_reference.content_hash)
+        elif attachment_reference.path is not None and self.is_stored_file(
+            attachment_reference.path
+        ):
+            Path(attachment_reference.path).unlink(missing_ok=True)
+
+    # Files used in place through symlinks belong to the preseeded data, not to the store.
+    def is_stored_file(self, path: str) -> bool:
+        return os.path.realpath(path).startswith(
+            os.path.join(os.path.realpath(self.FILE_DIRECTORY), "")
+        )
+
+    def restore_attachments_index(
+        self, attachments_index: Dict[str, AttachmentReference]
+    ) -> None:
+        super().restore_attachments_index(attachments_index)
+        with self.blobs_lock:
+            self.blob_references = {}
+            self.blob_sizes = {}
+            for attachment_reference in attachments_index.values():
+                if self.is_blob(attachment_reference):
+                    self.add_blob_reference(
+                        attachment_reference.content_hash,
+                        attachment_reference.file_size or 0,
+                    )
+
+    # Only the blob references are counted, the blobs themselves belong to the change.
+    def restore_attachment(
+        self, attachment_id: str, attachment_reference: Optional[AttachmentReference]
+    ) -> None:
+        previous_reference = self.attachments_index.get(attachment_id, None)
+        if previous_reference == attachment_reference:
+            return
+        with self.blobs_lock:
+            if previous_reference is not None and self.is_blob(previous_reference):
+                content_hash = previous_reference.content_hash
+                references = self.blob_references.get(content_hash, 0) - 1
+                if references > 0:
+                    self.blob_references[content_hash] = references
+                else:
+                    self.blob_references.pop(content_hash, None)
+                    self.blob_sizes.pop(content_hash, None)
+            if attachment_reference is not None and self.is_blob(attachment_reference):
+                self.add_blob_reference(
+                    attachment_reference.content_hash,
+                    attachment_reference.file_size or 0,
+                )
+            super().restore_attachment(attachment_id, attachment_reference)
+        self.thumbnail_cache.invalidate(attachment_id)
+
+    def get_attachment_storage_metrics(self) -> Dict:
+        with self.blobs_lock:
+            attachment_bytes = sum(
+                attachment_reference.get_file_size() or 0
+                for attachment_reference in self.attachments_index.values()
+            )
+            stored_bytes = sum(self.blob_sizes.values()) + sum(
+                attachment_reference.get_file_size() or 0
+                for attachment_reference in self.attachments_index.values()
+                if not self.is_blob(attachment_reference)
+            )
+            return {
+                "attachments": len(self.attachments_index),
+                "blobs": len(self.blob_references),
+                "attachment_bytes": attachment_bytes,
+                "stored_bytes": stored_bytes,
+                "bytes_saved": attachment_bytes - stored_bytes,
+            }
 
     # Special function only for filesystemattachmentstore.
     # Receives a partial manifest with some data, and recreates paths
     # by running through index and identifying files.
-    # Assumes that the files are present.
-    def import_attachments(self, attachment_manifest: Dict) -> None:
-        for attachment_id in attachment_manifest.keys():
-            attachment_information = attachment_manifest[attachment_id]
-
+    # The folders of the manifest are listed in bulk (across a pool of workers), instead of
+    # checking every file on its own. Files used in place (linked to the preseeded data) are
+    # indexed as they are: not moved into blobs, so not deduplicated, and hashed on first
+    # access (see get_hashed_reference).
+    def import_attachments(
+        self,
+        attachment_manifest: Dict,
+        in_place: bool = False,
+        workers: Optional[int] = None,
+    ) -> None:
+        manifest_paths: Dict[str, str] = {}
+        for attachment_id, attachment_information in attachment_manifest.items():
             if attachment_information["source"] == AttachmentSourceType.INSTANCE.value:
-                container_id = attachment_information["source_id"]
-                path = os.path.join(
+                manifest_paths[attachment_id] = os.path.join(
                     self.DPP_FILE_DIRECTORY,
                     attachment_information["source_id"],
                     attachment_information["file_name"],
                 )
             else:
-                container_id = attachment_information["template_id"]
-                path = os.path.join(
+                manifest_paths[attachment_id] = os.path.join(
                     self.DPP_TEMPLATES_FILE_DIRECTORY,
                     attachment_information["template_id"],
                     attachment_information["template_version"],
                     attachment_information["file_name"],
                 )
-            if not os.path.isfile(path):
+        existing_files = self.scan_files(
+            {os.path.dirname(path) for path in manifest_paths.values()}, workers
+        )
+
+        # Several entries may refer to the same file, which is moved into its blob on the first.
+        imported_files: Dict[str, Tuple[str, str, int]] = {}
+        for attachment_id, path in manifest_paths.items():
+            attachment_information = attachment_manifest[attachment_id]
+
+            if path not in existing_files:
+                if (
+                    attachment_information["source"]
+                    == AttachmentSourceType.INSTANCE.value
+                ):
+                    container_id = attachment_information["source_id"]
+                else:
+                    container_id = attachment_information["template_id"]
                 logger.error(
                     "Unable to find "
                     + attachment_id
@@ -133,31 +396,53 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
                     + path
                 )
                 logger.error(" for " + container_id)
+                continue
+
+            if in_place:
+                file_path = Path(path).as_posix()
+                content_hash: Optional[str] = None
+                file_size: Optional[int] = None
+            elif path not in imported_files:
+                # The imported copy is moved into its blob, or dropped for a known content.
+                content_hash = self.hash_file(path)
+                file_size = os.path.getsize(path)
+                file_path = self.add_blob(path, content_hash, file_size)
+                imported_files[path] = (file_path, content_hash, file_size)
             else:
+                file_path, content_hash, file_size = imported_files[path]
+                with self.blobs_lock:
+                    self.add_blob_reference(content_hash, file_size)
 
-                completed_attachment_reference = AttachmentReference(
-                    attachment_type=attachment_information["type"],
-                    path=Path(path).as_posix(),
-                    source=attachment_information["source"],
-                    source_id=(attachment_information.get("source_id", None)),
-                    template_id=(attachment_information.get("template_id", None)),
-                    template_version=(
-                        attachment_information.get("template_version", None)
-                    ),
-                    description=(
-                        attachment_information.get("description", "Default description")
-                    ),
-                    is_default=(attachment_information.get("is_default", None)),
-                    attachment_id=attachment_id,
-                    file_name=attachment_information["file_name"],
-                    file_size=os.path.getsize(path),
-                )
-                # Add to dict
-                self.attachments_index[attachment_id] = completed_attachment_reference
+            completed_attachment_reference = AttachmentReference(
+                attachment_type=attachment_information["type"],
+                path=file_path,
+                source=attachment_information["source"],
+                source_id=(attachment_information.get("source_id", None)),
+                template_id=(attachment_information.get("template_id", None)),
+                template_version=(attachment_information.get("template_version", None)),
+                description=(
+                    attachment_information.get("description", "Default description")
+                ),
+                is_default=(attachment_information.get("is_default", None)),
+                attachment_id=attachment_id,
+                file_name=attachment_information["file_name"],
+                file_size=file_size,
+                content_hash=content_hash,
+            )
+            # Add to dict
+            self.attachments_index[attachment_id] = completed_attachment_reference
+            self.submit_renditions(completed_attachment_reference)
 
         logger.info(
             "Imported " + str(len(self.attachments_index.keys())) + " attachments!"
         )
+        if not in_place:
+            storage_metrics = self.get_attachment_storage_metrics()
+            logger.info(
+                f"Stored {storage_metrics['attachments']} attachments as"
+                f" {storage_metrics['blobs']} blobs, saving"
+                f" {storage_metrics['bytes_saved']} bytes"
+            )
         # logger.info(
         #     format_multiline_log(
         #         json.dumps(
@@ -167,16 +452,60 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
         #     )
         # )
 
+    # Files used in place are hashed on their first download or thumbnail instead of at startup,
+    # after which they get an ETag and renditions. The hashed reference replaces the indexed one
+    # (under blobs_lock, like all replacements), unless that changed meanwhile.
+    def get_hashed_reference(self, attachment_id: str) -> AttachmentReference:
+        attachment_reference = self.attachments_index.get(attachment_id, None)
+        if attachment_reference is None:
+            raise FileNotFoundError("Attachment missing.")
+        file_path = attachment_reference.path
+        if file_path is None:
+            raise FileNotFoundError("Attachment found, but not available in store.")
+        if attachment_reference.content_hash is not None:
+            return attachment_reference
+        try:
+            file_size = os.path.getsize(file_path)
+            content_hash = self.hash_file(file_path)
+        except FileNotFoundError:
+            raise FileNotFoundError("Attachment found, but not available in store.")
+        hashed_attachment_reference = replace(
+            attachment_reference, file_size=file_size, content_hash=content_hash
+        )
+        with self.blobs_lock:
+            changed = (
+                self.attachments_index.get(attachment_id, None)
+                is not attachment_reference
+            )
+            if not changed:
+                self.attachments_index[attachment_id] = hashed_attachment_reference
+        if changed:
+            return self.get_hashed_reference(attachment_id)
+        self.submit_renditions(hashed_attachment_reference)
+        return hashed_attachment_reference
+
     def retrieve_attachment(self, attachment_id: str) -> FileResponse:
         # First check if it exists in attachment index
         if attachment_id not in self.attachments_index:
             raise FileNotFoundError("Attachment missing.")
         else:
-            attachment_reference = self.attachments_index[attachment_id]
+            attachment_reference = self.get_hashed_reference(attachment_id)
             file_path = attachment_reference.path
-            if file_path is None:
+            assert file_path is not None
+            try:
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
                 raise FileNotFoundError("Attachment found, but not available in store.")
-            return FileResponse(file_path, filename=attachment_reference.file_name)
+            headers = {"Cache-Control": self.cache_control}
+            # A strong ETag: equal for equal content, also across restarts and workers.
+            if attachment_reference.content_hash is not None:
+                headers["ETag"] = f'"{attachment_reference.content_hash}"'
+            return AttachmentFileResponse(
+                file_path,
+                headers=headers,
+                filename=attachment_reference.file_name,
+                stat_result=stat_result,
+            )
 
     # def retrieve_attachment_thumbnail(self, attachment_id: str, dimensions: Tuple[int, int]) -> FileResponse:
     #     # First check if it exists in attachment index
@@ -188,67 +517,107 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
         self,
         attachment_id: str,
         dimensions: Tuple[Optional[int], Optional[int]] = (None, None),
+        image_formats: Optional[List[str]] = None,
     ) -> FileResponse:
         # First check if it exists in attachment index
         if attachment_id not in self.attachments_index:
             raise FileNotFoundError("Attachment missing.")
 
-        attachment_reference = self.attachments_index[attachment_id]
+        attachment_reference = self.get_hashed_reference(attachment_id)
         file_path = attachment_reference.path
-        if file_path is None:
+        assert file_path is not None
+
+        # Thumbnails of a given height are served from the closest precomputed rendition.
+        width, height = dimensions
+        if (
+            width is None
+            and height is not None
+            and attachment_reference.content_hash is not None
+        ):
+            rendition = self.renditions.get_rendition(
+                attachment_reference.content_hash, height, image_formats or []
+            )
+            if rendition is not None:
+                rendition_path, image_format = rendition
+                try:
+                    return FileResponse(
+                        rendition_path,
+                        headers={"Cache-Control": self.cache_control, "Vary": "Accept"},
+                        media_type=f"image/{image_format}",
+                        filename=f"thumbnail_{attachment_reference.file_name}",
+                        stat_result=os.stat(rendition_path),
+                    )
+                except FileNotFoundError:
+                    self.renditions.remove(attachment_reference.content_hash)
+
+        # Otherwise, rendered on demand. Thumbnails of a changed original get a different key.
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
             raise FileNotFoundError("Attachment found, but not available in store.")
+        key = (stat.st_mtime_ns, stat.st_size, dimensions, self.THUMBNAIL_FORMAT)
 
         try:
-            with Image.open(file_path) as img:
-                original_width, original_height = img.size
-
-                # Extract dimensions
-                width, height = dimensions
-
-                # Calculate new dimensions maintaining aspect ratio
-                if width is None and height is None:
-                    # If no dimensions are provided, return the original image
-                    width, height = original_width, original_height
-                elif width is None and height is not None:
-                    # Scale based on the provided height
-                    aspect_ratio = original_width / original_height
-                    width = int(height * aspect_ratio)
-                elif height is None and width is not None:
-                    # Scale based on the provided width
-                    aspect_ratio = original_height / original_width
-                    height = int(width * aspect_ratio)
-                else:
-                    # Scale based on both provided dimensions, maintaining aspect ratio
-                    img.thumbnail((width, height))
-                    width, height = img.size
-
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-
-                # Determine the format from the original image
-                image_format = img.format or "jpeg"
-
-                # Convert RGBA to RGB if saving as JPEG
-                if image_format.lower() == "jpeg" and img.mode == "RGBA":
-                    img = img.convert("RGB")
-
-                # Save the resized image to a temporary file
-                with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=f".{image_format.lower()}"
-                ) as tmp:
-                    img.save(tmp, format=image_format)
-                    tmp_path = tmp.name
-
-                media_type = f"image/{image_format.lower()}"
-                return FileResponse(
-                    tmp_path,
-                    media_type=media_type,
-                    filename=f"thumbnail_{attachment_reference.file_name}",
-                )
-
+            thumbnail_path = self.thumbnail_cache.get(
+                attachment_id,
+                key,
+                self.THUMBNAIL_FORMAT,
+                lambda path: self.render_thumbnail(file_path, dimensions, path),
+            )
         except Exception as e:
             raise Exception(f"Error generating thumbnail: {e}")
+        return FileResponse(
+            thumbnail_path,
+            media_type=f"image/{self.THUMBNAIL_FORMAT}",
+            filename=f"thumbnail_{attachment_reference.file_name}",
+        )
+
+    def render_thumbnail(
+        self,
+        file_path: str,
+        dimensions: Tuple[Optional[int], Optional[int]],
+        thumbnail_path: str,
+    ) -> None:
+        with Image.open(file_path) as img:
+            original_width, original_height = img.size
+
+            # Extract dimensions
+            width, height = dimensions
+
+            # Calculate new dimensions maintaining aspect ratio
+            if width is None and height is None:
+                # If no dimensions are provided, return the original image
+                width, height = original_width, original_height
+            elif width is None and height is not None:
+                # Scale based on the provided height, never upscaled
+                height = min(height, original_height)
+                aspect_ratio = original_width / original_height
+                width = int(height * aspect_ratio)
+            elif height is None and width is not None:
+                # Scale based on the provided width, never upscaled
+                width = min(width, original_width)
+                aspect_ratio = original_height / original_width
+                height = int(width * aspect_ratio)
+            else:
+                # Scale based on both provided dimensions, maintaining aspect ratio
+                img.thumbnail((width, height))
+                width, height = img.size
+
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
 
-    def update_attachment(
+            # JPEG has no alpha channel or palette
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            img.save(thumbnail_path, format=self.THUMBNAIL_FORMAT)
+
+    def get_thumbnail_cache_metrics(self) -> Dict:
+        return self.thumbnail_cache.to_dict()
+
+    def close(self) -> None:
+        self.renditions.close()
+
+    async def update_attachment(
         self, file: UploadFile, attachment_id: str
     ) -> AttachmentReference:
         # First check if it exists in attachment index
@@ -258,32 +627,44 @@ class FileSystemAttachmentStore(BaseAttachmentStore):
         attachment_reference = self.attachments_index[attachment_id]
         if attachment_reference.path is None:
             raise FileNotFoundError("Attachment found, but not available in store.")
-        file_path = Path(attachment_reference.path)
 
         try:
-            # Save the new file, replacing the old one
-            with file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            # Save the new file, then release the old one. The updated reference replaces the
+            # old one at once, so readers never see a mix of both.
+            file_path, content_hash, file_size = await run_in_threadpool(
+                self.write_upload, file.file
+            )
+            updated_attachment_reference = replace(
+                attachment_reference,
+                path=file_path,
+                file_size=file_size,
+                file_name=file.filename,
+                content_hash=content_hash,
+            )
+            with self.blobs_lock:
+                self.attachments_index[attachment_id] = updated_attachment_reference
+            self.release_file(attachment_reference)
 
-            # Update metadata if needed
-            attachment_reference.file_size = file.size
-            attachment_reference.file_name = file.filename
+            self.thumbnail_cache.invalidate(attachment_id)
+            self.submit_renditions(updated_attachment_reference)
 
             # Return the updated attachment reference
-            return attachment_reference
+            return updated_attachment_reference
         except Exception as e:
             raise Exception(f"Error updating attachment: {e}")
         finally:
-            file.file.close()
+            await file.close()
 
     def delete_attachment(self, attachment_id: str):
         # First check if it exists in attachment index
         if attachment_id not in self.attachments_index:
             raise FileNotFoundError("Attachment missing.")
         else:
-            attachment_reference = self.attachments_index.pop(attachment_id)
+            with self.blobs_lock:
+                attachment_reference = self.attachments_index.pop(attachment_id)
+            self.thumbnail_cache.invalidate(attachment_id)
             if attachment_reference.path is None:
                 raise FileNotFoundError("Attachment found, but not available in store.")
-            file_path = Path(attachment_reference.path)
-            file_path.unlink(missing_ok=True)
+            # Shared content stays until its last attachment is deleted.
+            self.release_file(attachment_reference)
             return {"status": "deleted"}
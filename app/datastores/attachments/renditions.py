@@ -0,0 +1,163 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger("renditions")
+
+# Precomputed renditions of image attachments, rendered in the background when an image is
+# added, updated or imported, so thumbnails are served from disk instead of resized on the
+# request path. Rendering runs in a pool of processes, as Pillow would otherwise hold the GIL
+# of the server for most of the work.
+# Renditions belong to the content, not to an attachment (see the blobs of the
+# FileSystemAttachmentStore): identical images share them, and changed content gets new ones.
+# Structure-> <directory>/<first 2 hex digits of the SHA-256 digest>/<digest>/<height>.<format>
+# Until the renditions of an image are complete, thumbnails are rendered on demand instead.
+
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+
+# Runs in a worker process. Renders the image at every height (never upscaled) and format, each
+# written next to its target and renamed, so readers never see a partial rendition.
+# Returns the rendered heights, which are also listed in the "complete" marker file.
+def render_renditions(
+    source_path: str, directory: str, heights: Sequence[int], formats: Sequence[str]
+) -> List[int]:
+    os.makedirs(directory, exist_ok=True)
+    with Image.open(source_path) as image:
+        image.load()
+        original_width, original_height = image.size
+        rendered_heights = sorted({min(height, original_height) for height in heights})
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        for height in rendered_heights:
+            width = max(1, round(original_width * height / original_height))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for image_format in formats:
+                path = os.path.join(
+                    directory, f"{height}.{FORMAT_EXTENSIONS[image_format]}"
+                )
+                with tempfile.NamedTemporaryFile(
+                    "wb", dir=directory, prefix=".", delete=False
+                ) as f:
+                    try:
+                        resized.save(f, format=image_format)
+                    except BaseException:
+                        os.unlink(f.name)
+                        raise
+                os.replace(f.name, path)
+    # Marks the renditions as complete.
+    with open(os.path.join(directory, "complete"), "w") as f:
+        f.write(",".join(str(height) for height in rendered_heights))
+    return rendered_heights
+
+
+class RenditionPipeline:
+    def __init__(
+        self,
+        directory: str,
+        heights: Sequence[int] = (100, 300, 800),
+        formats: Sequence[str] = ("webp", "jpeg"),
+        workers: int = 1,
+    ) -> None:
+        for image_format in formats:
+            if image_format not in FORMAT_EXTENSIONS:
+                raise Exception("Unknown rendition format -> " + image_format)
+        self.directory = directory
+        self.heights = sorted(heights)
+        self.formats = list(formats)
+        self.workers = workers
+        # Without workers, thumbnails are only rendered on demand. The workers are forked at
+        # startup, before the server starts any threads, so they only inherit the main thread.
+        # Spawned workers would import the main module of the server again.
+        self.executor: ProcessPoolExecutor | None = None
+        if workers > 0:
+            start_method = "fork" if hasattr(os, "fork") else None
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(start_method),
+            )
+            # Forked workers are all started with the first task.
+            self.executor.submit(os.getpid)
+        self.pending: Dict[str, Future] = {}
+        # Rendered heights of complete renditions, read from their marker on first use.
+        self.rendered: Dict[str, List[int]] = {}
+        self.lock = threading.Lock()
+
+    def get_directory(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], content_hash)
+
+    def get_rendered_heights(self, content_hash: str) -> List[int] | None:
+        rendered_heights = self.rendered.get(content_hash, None)
+        if rendered_heights is None:
+            try:
+                with open(
+                    os.path.join(self.get_directory(content_hash), "complete")
+                ) as f:
+                    rendered_heights = [int(height) for height in f.read().split(",")]
+            except (FileNotFoundError, ValueError):
+                return None
+            self.rendered[content_hash] = rendered_heights
+        return rendered_heights
+
+    # Render the renditions of an image in the background, unless they exist already.
+    def submit(self, content_hash: str, source_path: str) -> None:
+        with self.lock:
+            if (
+                self.executor is None
+                or content_hash in self.pending
+                or self.get_rendered_heights(content_hash) is not None
+            ):
+                return
+            future = self.executor.submit(
+                render_renditions,
+                source_path,
+                self.get_directory(content_hash),
+                self.heights,
+                self.formats,
+            )
+            self.pending[content_hash] = future
+        future.add_done_callback(
+            lambda future: self.on_rendered(content_hash, source_path, future)
+        )
+
+    def on_rendered(self, content_hash: str, source_path: str, future: Future) -> None:
+        with self.lock:
+            self.pending.pop(content_hash, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(
+                f"Unable to render renditions of {source_path} - {future.exception()}"
+            )
+
+    # Path and format of the rendition closest to the requested height, in the first of the
+    # accepted formats that is rendered. None when none of them is rendered, or when the
+    # renditions are not complete (yet).
+    def get_rendition(
+        self, content_hash: str, height: int, accepted_formats: List[str]
+    ) -> Tuple[str, str] | None:
+        rendered_heights = self.get_rendered_heights(content_hash)
+        if not rendered_heights:
+            return None
+        image_format = next((f for f in accepted_formats if f in self.formats), None)
+        if image_format is None:
+            return None
+        closest = min(rendered_heights, key=lambda h: (abs(h - height), -h))
+        path = os.path.join(
+            self.get_directory(content_hash),
+            f"{closest}.{FORMAT_EXTENSIONS[image_format]}",
+        )
+        return path, image_format
+
+    def remove(self, content_hash: str) -> None:
+        self.rendered.pop(content_hash, None)
+        shutil.rmtree(self.get_directory(content_hash), ignore_errors=True)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+# Bounded LRU cache of rendered thumbnails on disk.
+# Structure-> <directory>/<hash of attachment ID>/<hash of key>.<extension>, where the key holds
+# the attachment ID, the modification time and size of the original file, the requested
+# dimensions and the format. A changed original therefore never matches an older thumbnail,
+# and all thumbnails of one attachment can be removed at once when it is updated or deleted.
+# The LRU order of the files is kept in memory (rebuilt from their modification times at
+# startup), and files are evicted once their total size exceeds max_bytes.
+# Lookups may come from several threads at once, thumbnails are rendered outside of the lock.
+
+
+class ThumbnailCache:
+    def __init__(self, directory: str, max_bytes: int = 100 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_entries()
+
+    def load_entries(self) -> None:
+        files = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            self.entries[path] = size
+            self.total_bytes += size
+        with self.lock:
+            self.evict()
+
+    def attachment_directory(self, attachment_id: str) -> str:
+        digest = hashlib.sha256(attachment_id.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, digest)
+
+    def path(self, attachment_id: str, key: Hashable, extension: str) -> str:
+        digest = hashlib.sha256(repr((attachment_id, key)).encode("utf-8")).hexdigest()
+        return os.path.join(
+            self.attachment_directory(attachment_id), f"{digest}.{extension}"
+        )
+
+    # Path of the cached thumbnail, rendering it with render(path) on a miss.
+    def get(
+        self,
+        attachment_id: str,
+        key: Hashable,
+        extension: str,
+        render: Callable[[str], None],
+    ) -> str:
+        path = self.path(attachment_id, key, extension)
+        with self.lock:
+            # Another worker process sharing the directory may have evicted the file.
+            if path in self.entries and os.path.isfile(path):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Render next to the target and rename, so readers never see a partial thumbnail.
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=directory, prefix=".", suffix=f".{extension}", delete=False
+        ) as f:
+            temporary_path = f.name
+        try:
+            render(temporary_path)
+            size = os.path.getsize(temporary_path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            # The new thumbnail is most recently used, and is only evicted on its own.
+            self.evict()
+        return path
+
+    def evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    # Remove all thumbnails of an attachment, after it changed or was deleted.
+    def invalidate(self, attachment_id: str) -> None:
+        directory = self.attachment_directory(attachment_id)
+        with self.lock:
+            for path in [
+                path for path in self.entries if os.path.dirname(path) == directory
+            ]:
+                self.total_bytes -= self.entries.pop(path)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def to_dict(self) -> Dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
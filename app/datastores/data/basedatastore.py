@@ -2,10 +2,11 @@ from abc import ABC, abstractmethod
 from dataclasses import field
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 
 from pydantic.dataclasses import dataclass
 
+from app.datamodel.attachment import AttachmentReference
 from app.datamodel.dpp import DigitalProductPassport
 
 
@@ -38,6 +39,12 @@ class FilterConditions:
     origin_country_codes: List[str] = field(default_factory=list)
 
 
+class CreationHistogramIntervals(Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
 class EventFilterFormats(Enum):
     ACTIVITY = "activity"
     OWNERSHIP = "ownership"
@@ -60,6 +67,33 @@ class BaseDataStore(ABC):
         # Use the deserialization function from serde
         pass
 
+    # The same DPP document, already JSON-encoded. Encoded documents may be served from a
+    # cache, which is invalidated whenever the DPP or one of its subpassports changes.
+    @abstractmethod
+    def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        pass
+
+    # Version counter of a DPP, increased on every change to the DPP or its subtree.
+    @abstractmethod
+    def get_dpp_version(self, document_id: str) -> int:
+        pass
+
+    # Time of the last change to a DPP or its subtree, None for unknown DPPs.
+    @abstractmethod
+    def get_dpp_last_modified(self, document_id: str) -> Optional[datetime]:
+        pass
+
+    # Hit/miss metrics of the encoded response cache.
+    @abstractmethod
+    def get_response_cache_metrics(self) -> Dict:
+        pass
+
     @abstractmethod
     def get_dpp_object(self, document_id: str) -> DigitalProductPassport:
         pass
@@ -74,10 +108,22 @@ class BaseDataStore(ABC):
     def get_random_dpp_document_id(self) -> str:
         pass
 
+    # Sample up to count distinct DPP document IDs, optionally matching filter conditions.
+    @abstractmethod
+    def sample_dpp_document_ids(
+        self, count: int, filter_conditions: Optional[FilterConditions] = None
+    ) -> List[str]:
+        pass
+
     @abstractmethod
     def get_latest_added_dpp_document_id(self) -> str:
         pass
 
+    # The n latest DPP document IDs by creation timestamp, newest first.
+    @abstractmethod
+    def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        pass
+
     # - Get some data statistics about the content of the database.
     @abstractmethod
     def get_dpp_database_metadata(self) -> Dict:
@@ -116,6 +162,11 @@ class BaseDataStore(ABC):
     ) -> None:
         pass
 
+    # - Parse a batch of incoming DPP instances and add them to the store, in the given order.
+    @abstractmethod
+    def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        pass
+
     # - Update DPP document
     # Ideally, this should register an update event.
     # Scenarios where this would happen
@@ -130,16 +181,27 @@ class BaseDataStore(ABC):
     ### EVENTS
 
     # - Retrieving a list of events (sorted or not) for a DPP document.
+    # Optionally restricted to events with a timestamp within [since, until].
     @abstractmethod
     def get_dpp_events(
-        self, document_id: str, sorted: bool = True, event_type: str = "activity"
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
     ) -> List[Dict]:
         pass
 
     # - Retrieving a list of events (sorted or not) for a full DPP document (including subpassports).
     @abstractmethod
     def get_dpp_full_events(
-        self, document_id: str, sorted: bool = True, event_type: str = "activity"
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
     ) -> List[Dict]:
         pass
 
@@ -250,6 +312,16 @@ class BaseDataStore(ABC):
     ) -> List[Dict[str, str]]:
         pass
 
+    # Lazily yield search results in a stable order, optionally resuming after a previously
+    # returned DPP ID. Used for paginated and streamed search responses.
+    @abstractmethod
+    def search_for_dpp_iterator(
+        self,
+        filter_conditions: FilterConditions,
+        after_document_id: Optional[str] = None,
+    ) -> Iterator[Dict[str, str]]:
+        pass
+
     # TODO: Handle credentials later, because the signature part may be a bit tricky.
     # @abstractmethod
     # def add_credentials_document(self, credential_id, credential_doc):
@@ -259,6 +331,19 @@ class BaseDataStore(ABC):
     # def get_credentials_document(self, credential_id):
     #     pass
 
+    # Register a change to an attachment, after the attachment store applied it. A new
+    # attachment is listed by its DPP (document_id), and every DPP listing the attachment gets a
+    # new version, so cached and conditional responses show the change. A deleted attachment
+    # (attachment_reference None) is no longer listed by any DPP.
+    @abstractmethod
+    def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: Optional[AttachmentReference],
+        document_id: Optional[str] = None,
+    ) -> None:
+        pass
+
     # Actually adding the attachments will be handled in a different module (with support for s3 or filesystem), but still based on document_id, or template_id.
     # Adding the attachment link is done in a DPP document update.
     # @abstractmethod
@@ -300,6 +385,16 @@ class BaseStoreStatistics(ABC):
     ) -> int:
         pass
 
+    # Number of passports created per day/week/month between start_time and end_time.
+    @abstractmethod
+    def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        pass
+
     @abstractmethod
     def passports_created_last_day(self) -> int:
         pass
@@ -327,3 +422,216 @@ class BaseStoreStatistics(ABC):
     @abstractmethod
     def to_dict(self):
         pass
+
+
+# Async variant of the BaseDataStore contract, awaited by the API routers, so store operations
+# do not block the event loop. Template operations are left out, as no store implements them.
+class AsyncBaseDataStore(ABC):
+    ### DPPs
+
+    @abstractmethod
+    async def get_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> Dict:
+        pass
+
+    @abstractmethod
+    async def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        pass
+
+    @abstractmethod
+    async def get_dpp_version(self, document_id: str) -> int:
+        pass
+
+    @abstractmethod
+    async def get_dpp_last_modified(self, document_id: str) -> Optional[datetime]:
+        pass
+
+    @abstractmethod
+    async def get_response_cache_metrics(self) -> Dict:
+        pass
+
+    @abstractmethod
+    async def get_dpp_object(self, document_id: str) -> DigitalProductPassport:
+        pass
+
+    @abstractmethod
+    async def get_random_dpp_document_id(self) -> str:
+        pass
+
+    @abstractmethod
+    async def sample_dpp_document_ids(
+        self, count: int, filter_conditions: Optional[FilterConditions] = None
+    ) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def get_latest_added_dpp_document_id(self) -> str:
+        pass
+
+    @abstractmethod
+    async def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def get_dpp_database_metadata(self) -> Dict:
+        pass
+
+    @abstractmethod
+    async def add_dpp_object(
+        self, document_id: str, dpp_object: DigitalProductPassport
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def add_dpp_document(
+        self,
+        document_id: str,
+        dpp_document: Dict,
+        template_id: Optional[str] = None,
+        template_version: Optional[str] = "latest",
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        pass
+
+    ### EVENTS
+
+    @abstractmethod
+    async def get_dpp_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def get_dpp_full_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def add_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> str | None:
+        pass
+
+    @abstractmethod
+    async def add_dpp_events(
+        self, document_id: str, event_list: List[Dict], event_type: str = "activity"
+    ) -> List[str | None]:
+        pass
+
+    @abstractmethod
+    async def update_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def delete_dpp_event(
+        self, document_id: str, event_id: str, event_type: str = "activity"
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def get_event(self, event_id: str) -> Dict | None:
+        pass
+
+    @abstractmethod
+    async def get_event_metadata(self) -> Dict:
+        pass
+
+    ### SUBPASSPORTS AND SEARCH
+
+    @abstractmethod
+    async def attach_subpassport_by_id(
+        self, document_id: str, subpassport_id: str
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def attach_subpassport(
+        self, document_id: str, subpassport_document: Dict
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def detach_subpassport_by_id(
+        self, document_id: str, subpassport_id: str
+    ) -> None:
+        pass
+
+    # Apply changes made elsewhere (by other worker processes sharing the store), before
+    # reading state that is kept outside of the store, such as the attachment index.
+    @abstractmethod
+    async def catch_up(self) -> None:
+        pass
+
+    @abstractmethod
+    async def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: Optional[AttachmentReference],
+        document_id: Optional[str] = None,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def search_for_dpp(
+        self, filter_conditions: FilterConditions
+    ) -> List[Dict[str, str]]:
+        pass
+
+    # Like BaseDataStore.search_for_dpp_iterator. An unknown after_document_id raises a
+    # KeyError when the first result is awaited.
+    @abstractmethod
+    def search_for_dpp_iterator(
+        self,
+        filter_conditions: FilterConditions,
+        after_document_id: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, str]]:
+        pass
+
+
+# Async variant of the BaseStoreStatistics contract, for the statistics served by the API.
+class AsyncBaseStoreStatistics(ABC):
+    @abstractmethod
+    async def passports_created_in_time_range(
+        self, start_time: datetime, end_time: datetime
+    ) -> int:
+        pass
+
+    @abstractmethod
+    async def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def to_dict(self):
+        pass
@@ -0,0 +1,398 @@
+import asyncio
+import threading
+from concurrent.futures import Executor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from app.datamodel.attachment import AttachmentReference
+from app.datamodel.dpp import DigitalProductPassport
+from app.datastores.data.basedatastore import (
+    AsyncBaseDataStore,
+    AsyncBaseStoreStatistics,
+    BaseDataStore,
+    BaseStoreStatistics,
+    CreationHistogramIntervals,
+    DPPResponseContentFormats,
+    DPPResponseFormats,
+    DPPResponseSignatureFormats,
+    FilterConditions,
+)
+
+# Async adapters of synchronous data stores. Every operation runs on a worker pool, so the
+# event loop keeps serving other requests while a slow search or statistics call is running.
+# Threads are used as workers, because the in-memory state cannot be shared with other
+# processes; a worker running Python code still releases the GIL to the event loop regularly.
+#
+# Stores that are not thread-safe (the InMemoryStore) are synchronized with a ReadWriteLock:
+# reads run concurrently, writes run alone. Stores that synchronize themselves (SQLite,
+# MongoDB) run without it.
+
+
+# Readers-writer lock that prefers writers, so a stream of reads cannot starve a write.
+class ReadWriteLock:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: not self.writing and not self.waiting_writers
+            )
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self.condition:
+            self.waiting_writers += 1
+            self.condition.wait_for(lambda: not self.writing and not self.readers)
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class ExecutorDataStore(AsyncBaseDataStore):
+    # Number of search results computed per worker call when iterating over search results.
+    SEARCH_BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        data_store: BaseDataStore,
+        executor: Executor,
+        lock: ReadWriteLock | None = None,
+    ) -> None:
+        self.data_store = data_store
+        self.executor = executor
+        self.lock = lock
+
+    def read_locked(self) -> ContextManager:
+        return self.lock.read() if self.lock is not None else nullcontext()
+
+    def write_locked(self) -> ContextManager:
+        return self.lock.write() if self.lock is not None else nullcontext()
+
+    # Call a function as reader of the store, on the calling thread.
+    def call_read(self, function: Callable, *args, **kwargs) -> Any:
+        with self.read_locked():
+            return function(*args, **kwargs)
+
+    # Call a function as the only writer of the store, on the calling thread. Returns its
+    # result, and the number of the last record in the write-ahead log of the store (None
+    # without a synchronous log), which the write has to wait for before it is answered.
+    def apply_write(
+        self, function: Callable, *args, **kwargs
+    ) -> Tuple[Any, Optional[int]]:
+        with self.write_locked():
+            result = function(*args, **kwargs)
+            mutation_log = getattr(self.data_store, "mutation_log", None)
+            if mutation_log is None or not mutation_log.synchronous:
+                return result, None
+            return result, mutation_log.sequence
+
+    # Call a function as the only writer of the store, on the calling thread (such as on
+    # shutdown, outside of the event loop). The store is released before waiting for the
+    # write-ahead log, so readers and other writers do not wait for the fsync.
+    def call_write(self, function: Callable, *args, **kwargs) -> Any:
+        result, log_sequence = self.apply_write(function, *args, **kwargs)
+        if log_sequence is not None:
+            self.data_store.mutation_log.wait_durable(log_sequence)
+        return result
+
+    # Run a function on the worker pool, as reader of the store.
+    async def run_read(self, function: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self.call_read, function, *args, **kwargs)
+        )
+
+    # Run a function on the worker pool, as the only writer of the store. Waiting for the
+    # write-ahead log happens on the event loop, so concurrent writes share an fsync without
+    # holding a worker.
+    async def run_write(self, function: Callable, *args, **kwargs) -> Any:
+        result, log_sequence = await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self.apply_write, function, *args, **kwargs)
+        )
+        if log_sequence is not None:
+            await self.data_store.mutation_log.wait_durable_async(log_sequence)
+        return result
+
+    # Waits for running operations to finish, as on shutdown.
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    async def get_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> Dict:
+        return await self.run_read(
+            self.data_store.get_dpp_document,
+            document_id,
+            content_format,
+            format,
+            signature_format,
+        )
+
+    async def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        return await self.run_read(
+            self.data_store.get_encoded_dpp_document,
+            document_id,
+            content_format,
+            format,
+            signature_format,
+        )
+
+    async def get_dpp_version(self, document_id: str) -> int:
+        return await self.run_read(self.data_store.get_dpp_version, document_id)
+
+    async def get_dpp_last_modified(self, document_id: str) -> Optional[datetime]:
+        return await self.run_read(self.data_store.get_dpp_last_modified, document_id)
+
+    async def get_response_cache_metrics(self) -> Dict:
+        return await self.run_read(self.data_store.get_response_cache_metrics)
+
+    async def get_dpp_object(self, document_id: str) -> DigitalProductPassport:
+        return await self.run_read(self.data_store.get_dpp_object, document_id)
+
+    async def get_random_dpp_document_id(self) -> str:
+        return await self.run_read(self.data_store.get_random_dpp_document_id)
+
+    async def sample_dpp_document_ids(
+        self, count: int, filter_conditions: Optional[FilterConditions] = None
+    ) -> List[str]:
+        return await self.run_read(
+            self.data_store.sample_dpp_document_ids, count, filter_conditions
+        )
+
+    async def get_latest_added_dpp_document_id(self) -> str:
+        return await self.run_read(self.data_store.get_latest_added_dpp_document_id)
+
+    async def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        return await self.run_read(self.data_store.get_latest_added_dpp_document_ids, n)
+
+    async def get_dpp_database_metadata(self) -> Dict:
+        return await self.run_read(self.data_store.get_dpp_database_metadata)
+
+    async def add_dpp_object(
+        self, document_id: str, dpp_object: DigitalProductPassport
+    ) -> None:
+        return await self.run_write(
+            self.data_store.add_dpp_object, document_id, dpp_object
+        )
+
+    async def add_dpp_document(
+        self,
+        document_id: str,
+        dpp_document: Dict,
+        template_id: Optional[str] = None,
+        template_version: Optional[str] = "latest",
+    ) -> None:
+        return await self.run_write(
+            self.data_store.add_dpp_document,
+            document_id,
+            dpp_document,
+            template_id,
+            template_version,
+        )
+
+    async def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        return await self.run_write(self.data_store.add_dpp_documents, dpp_documents)
+
+    async def get_dpp_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict]:
+        return await self.run_read(
+            self.data_store.get_dpp_events,
+            document_id,
+            sorted=sorted,
+            event_type=event_type,
+            since=since,
+            until=until,
+        )
+
+    async def get_dpp_full_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict]:
+        return await self.run_read(
+            self.data_store.get_dpp_full_events,
+            document_id,
+            sorted=sorted,
+            event_type=event_type,
+            since=since,
+            until=until,
+        )
+
+    async def add_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> str | None:
+        return await self.run_write(
+            self.data_store.add_dpp_event, document_id, event, event_type
+        )
+
+    async def add_dpp_events(
+        self, document_id: str, event_list: List[Dict], event_type: str = "activity"
+    ) -> List[str | None]:
+        return await self.run_write(
+            self.data_store.add_dpp_events, document_id, event_list, event_type
+        )
+
+    async def update_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> None:
+        return await self.run_write(
+            self.data_store.update_dpp_event, document_id, event, event_type
+        )
+
+    async def delete_dpp_event(
+        self, document_id: str, event_id: str, event_type: str = "activity"
+    ) -> None:
+        return await self.run_write(
+            self.data_store.delete_dpp_event, document_id, event_id, event_type
+        )
+
+    async def get_event(self, event_id: str) -> Dict | None:
+        return await self.run_read(self.data_store.get_event, event_id)
+
+    async def get_event_metadata(self) -> Dict:
+        return await self.run_read(self.data_store.get_event_metadata)
+
+    async def attach_subpassport_by_id(
+        self, document_id: str, subpassport_id: str
+    ) -> None:
+        return await self.run_write(
+            self.data_store.attach_subpassport_by_id, document_id, subpassport_id
+        )
+
+    async def attach_subpassport(
+        self, document_id: str, subpassport_document: Dict
+    ) -> None:
+        return await self.run_write(
+            self.data_store.attach_subpassport, document_id, subpassport_document
+        )
+
+    async def detach_subpassport_by_id(
+        self, document_id: str, subpassport_id: str
+    ) -> None:
+        return await self.run_write(
+            self.data_store.detach_subpassport_by_id, document_id, subpassport_id
+        )
+
+    # A store of this process only, so it is up to date already.
+    async def catch_up(self) -> None:
+        pass
+
+    async def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: Optional[AttachmentReference],
+        document_id: Optional[str] = None,
+    ) -> None:
+        return await self.run_write(
+            self.data_store.register_attachment_change,
+            attachment_id,
+            attachment_reference,
+            document_id,
+        )
+
+    async def search_for_dpp(
+        self, filter_conditions: FilterConditions
+    ) -> List[Dict[str, str]]:
+        return await self.run_read(self.data_store.search_for_dpp, filter_conditions)
+
+    # Results are computed in batches, one worker call each. Writes may run in between batches,
+    # as they could between the results of the synchronous iterator.
+    async def search_for_dpp_iterator(
+        self,
+        filter_conditions: FilterConditions,
+        after_document_id: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, str]]:
+        results = await self.run_read(
+            self.data_store.search_for_dpp_iterator,
+            filter_conditions,
+            after_document_id=after_document_id,
+        )
+        while True:
+            batch = await self.run_read(
+                lambda: list(islice(results, self.SEARCH_BATCH_SIZE))
+            )
+            for result in batch:
+                yield result
+            if len(batch) < self.SEARCH_BATCH_SIZE:
+                return
+
+
+class ExecutorStoreStatistics(AsyncBaseStoreStatistics):
+    # Shares the worker pool and lock of the store the statistics are taken from.
+    def __init__(
+        self, store_statistics: BaseStoreStatistics, data_store: ExecutorDataStore
+    ) -> None:
+        self.store_statistics = store_statistics
+        self.data_store = data_store
+
+    async def passports_created_in_time_range(
+        self, start_time: datetime, end_time: datetime
+    ) -> int:
+        return await self.data_store.run_read(
+            self.store_statistics.passports_created_in_time_range, start_time, end_time
+        )
+
+    async def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        return await self.data_store.run_read(
+            self.store_statistics.passports_created_histogram,
+            start_time,
+            end_time,
+            interval,
+        )
+
+    async def to_dict(self):
+        return await self.data_store.run_read(self.store_statistics.to_dict)
@@ -0,0 +1,251 @@
+import random
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Set
+
+# Secondary index structures used by the in-memory data store.
+# They only hold DPP IDs, the DigitalProductPassport objects remain in the store itself.
+
+
+# Inverted index -> postings[key] = set of DPP IDs
+class InvertedIndex:
+    def __init__(self) -> None:
+        self.postings: Dict[Hashable, Set[str]] = defaultdict(set)
+
+    def add(self, key: Hashable, document_id: str) -> None:
+        self.postings[key].add(document_id)
+
+    def remove(self, key: Hashable, document_id: str) -> None:
+        posting = self.postings.get(key, None)
+        if posting is None:
+            return
+        posting.discard(document_id)
+        # Drop empty postings, so keys() only reflects values still in use.
+        if not posting:
+            del self.postings[key]
+
+    def get(self, key: Hashable) -> Set[str]:
+        return self.postings.get(key, set())
+
+    def union(self, keys: Iterable[Hashable]) -> Set[str]:
+        output: Set[str] = set()
+        for key in keys:
+            output.update(self.postings.get(key, ()))
+        return output
+
+    def keys(self) -> Iterable[Any]:
+        return self.postings.keys()
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+
+# Trigram index for case-insensitive substring search over short texts (IDs, titles).
+# Structure-> postings[trigram] = set of DPP IDs, texts[ID] = lowercased texts of that DPP
+# joined by TEXT_SEPARATOR, so verifying a candidate is a single substring check.
+# Substrings shorter than a trigram cannot use the postings, and fall back to a scan of texts.
+class TrigramIndex:
+    GRAM_SIZE = 3
+    TEXT_SEPARATOR = "\x00"
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        self.texts: Dict[str, str] = {}
+
+    @classmethod
+    def trigrams(cls, text: str) -> Set[str]:
+        return {
+            text[i : i + cls.GRAM_SIZE] for i in range(len(text) - cls.GRAM_SIZE + 1)
+        }
+
+    def text_trigrams(self, joined_text: str) -> Set[str]:
+        output: Set[str] = set()
+        for text in joined_text.split(self.TEXT_SEPARATOR):
+            output.update(self.trigrams(text))
+        return output
+
+    def add(self, document_id: str, *texts: Optional[str]) -> None:
+        if document_id in self.texts:
+            self.remove(document_id)
+        joined_text = self.TEXT_SEPARATOR.join(text.lower() for text in texts if text)
+        self.texts[document_id] = joined_text
+        for trigram in self.text_trigrams(joined_text):
+            self.postings[trigram].add(document_id)
+
+    def remove(self, document_id: str) -> None:
+        joined_text = self.texts.pop(document_id, None)
+        if joined_text is None:
+            return
+        for trigram in self.text_trigrams(joined_text):
+            posting = self.postings.get(trigram, None)
+            if posting is None:
+                continue
+            posting.discard(document_id)
+            if not posting:
+                del self.postings[trigram]
+
+    def contains(self, document_id: str, substring: str) -> bool:
+        return substring.lower() in self.texts.get(document_id, "")
+
+    def can_use_postings(self, substring: str) -> bool:
+        return len(substring) >= self.GRAM_SIZE
+
+    # Superset of the DPP IDs containing the substring, to be verified with contains().
+    def candidates(self, substring: str) -> Set[str]:
+        needle = substring.lower()
+        if not self.can_use_postings(needle):
+            return set(self.texts.keys())
+        # The posting of the rarest trigram is a superset of the result. Verifying its
+        # members directly is cheaper than intersecting with the more common trigrams.
+        return min(
+            (self.postings.get(trigram, set()) for trigram in self.trigrams(needle)),
+            key=len,
+        )
+
+    def search(self, substring: str) -> Set[str]:
+        needle = substring.lower()
+        if not self.can_use_postings(needle):
+            return {
+                document_id
+                for document_id, text in self.texts.items()
+                if needle in text
+            }
+        texts = self.texts
+        return {
+            document_id
+            for document_id in self.candidates(needle)
+            if needle in texts[document_id]
+        }
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+# Sorted index of DPP IDs by a timestamp (epoch seconds), for range counts in O(log n).
+# Structure-> epochs = sorted timestamps, document_ids[i] = DPP ID belonging to epochs[i]
+# Structure-> epoch_by_id[ID] = timestamp, to find entries again when they are replaced.
+# Every single insert shifts the entries after it. Bulk additions (see bulk_add) are collected
+# instead, and merged in at once with a single sort.
+class SortedTimeIndex:
+    def __init__(self) -> None:
+        self.epochs: List[float] = []
+        self.document_ids: List[str] = []
+        self.epoch_by_id: Dict[str, float] = {}
+        # Structure-> pending[ID] = timestamp, in insertion order, during bulk_add.
+        self.pending: Dict[str, float] | None = None
+
+    def add(self, document_id: str, epoch: float) -> None:
+        if document_id in self.epoch_by_id:
+            self.remove(document_id)
+        self.epoch_by_id[document_id] = epoch
+        if self.pending is not None:
+            self.pending[document_id] = epoch
+            return
+        # Insert before equal timestamps, so newest-first reads return ties in insertion order.
+        position = bisect_left(self.epochs, epoch)
+        self.epochs.insert(position, epoch)
+        self.document_ids.insert(position, document_id)
+
+    def remove(self, document_id: str) -> None:
+        epoch = self.epoch_by_id.pop(document_id, None)
+        if epoch is None:
+            return
+        if self.pending is not None and self.pending.pop(document_id, None) is not None:
+            return
+        position = bisect_left(self.epochs, epoch)
+        while self.document_ids[position] != document_id:
+            position += 1
+        del self.epochs[position]
+        del self.document_ids[position]
+
+    # Collect the additions within the block, and merge them in at its end. Reads in the block
+    # do not see them yet.
+    @contextmanager
+    def bulk_add(self) -> Iterator[None]:
+        if self.pending is not None:
+            yield
+            return
+        self.pending = {}
+        try:
+            yield
+        finally:
+            pending, self.pending = self.pending, None
+            self.merge(pending)
+
+    def merge(self, pending: Dict[str, float]) -> None:
+        # Latest additions first among equal timestamps, like single inserts.
+        added = sorted(
+            ((epoch, document_id) for document_id, epoch in reversed(pending.items())),
+            key=itemgetter(0),
+        )
+        epochs: List[float] = []
+        document_ids: List[str] = []
+        start = 0
+        for epoch, document_id in added:
+            position = bisect_left(self.epochs, epoch, start)
+            epochs += self.epochs[start:position]
+            document_ids += self.document_ids[start:position]
+            epochs.append(epoch)
+            document_ids.append(document_id)
+            start = position
+        epochs += self.epochs[start:]
+        document_ids += self.document_ids[start:]
+        self.epochs, self.document_ids = epochs, document_ids
+
+    def count(
+        self, start_epoch: float, end_epoch: float, include_end: bool = True
+    ) -> int:
+        start_position = bisect_left(self.epochs, start_epoch)
+        if include_end:
+            end_position = bisect_right(self.epochs, end_epoch)
+        else:
+            end_position = bisect_left(self.epochs, end_epoch)
+        return max(end_position - start_position, 0)
+
+    # The n DPP IDs with the highest timestamps, newest first.
+    def latest(self, n: int = 1) -> List[str]:
+        return self.document_ids[: -n - 1 : -1]
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+
+# Array-backed set of DPP IDs with O(1) add, remove (by swapping in the last ID) and
+# uniform random sampling without copying the IDs.
+# Structure-> ids = list of IDs in arbitrary order, positions[ID] = position in ids
+class IdRegistry:
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+
+    def add(self, document_id: str) -> None:
+        if document_id in self.positions:
+            return
+        self.positions[document_id] = len(self.ids)
+        self.ids.append(document_id)
+
+    def remove(self, document_id: str) -> None:
+        position = self.positions.pop(document_id, None)
+        if position is None:
+            return
+        last_document_id = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last_document_id
+            self.positions[last_document_id] = position
+
+    def choice(self) -> Optional[str]:
+        if not self.ids:
+            return None
+        return self.ids[random.randrange(len(self.ids))]
+
+    # Sample up to k distinct IDs.
+    def sample(self, k: int) -> List[str]:
+        return random.sample(self.ids, min(k, len(self.ids)))
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.ids)
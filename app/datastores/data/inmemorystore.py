@@ -1,30 +1,79 @@
+import copy
+import heapq
 import json
 import logging
 import random
 import uuid
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
 
 from app.config import format_multiline_log
+from app.datamodel.attachment import AttachmentReference
 from app.datamodel.dpp import DigitalProductPassport, Entity, Facility
+from app.datamodel.encoding import encode_json
 from app.datamodel.serde import deserialize_dpp, import_dpp_into_storage
 from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
 from app.datastores.data.basedatastore import (
     BaseDataStore,
     BaseStoreStatistics,
+    CreationHistogramIntervals,
     DPPResponseContentFormats,
     DPPResponseFormats,
     DPPResponseSignatureFormats,
     EventFilterFormats,
     FilterConditions,
 )
+from app.datastores.data.indexes import (
+    IdRegistry,
+    InvertedIndex,
+    SortedTimeIndex,
+    TrigramIndex,
+)
+from app.datastores.data.responsecache import ResponseCache
 
 logger = logging.getLogger("in-memory-data")
 
 
+# Parse an ISO 8601 timestamp (with or without "Z") into epoch seconds. Naive timestamps are
+# assumed to be UTC. Returns None for missing or unparseable timestamps.
+def timestamp_to_epoch(timestamp: str | None) -> float | None:
+    if not timestamp:
+        return None
+    try:
+        parsed_timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        logger.warning("Unable to parse timestamp -> " + str(timestamp))
+        return None
+    return datetime_to_epoch(parsed_timestamp)
+
+
+# Naive datetimes are assumed to be UTC, like naive timestamps in the stored documents.
+def datetime_to_epoch(moment: datetime) -> float:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
 class InMemoryStore(BaseDataStore):
+    # Upper bound on expected draws per accepted sample, before falling back to the matches.
+    SAMPLING_MAX_REJECTION_RATE = 8
+    # Number of encoded DPP responses kept in the response cache.
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
+    # Attributes left out of snapshots: references to other stores and config, and caches.
+    SNAPSHOT_EXCLUDED_ATTRIBUTES = (
+        "attachment_store_ref",
+        "identity_config_ref",
+        "response_cache",
+        "mutation_log",
+        "pending_mutations",
+        "operation_time",
+    )
+
     def __init__(self, identity_config: Dict, attachment_store: BaseAttachmentStore):
         # Structure-> dpp_store[ID] = DigitalProductPassport
         # Structure-> dpp_templates_store[ID][version] = JSONSchema (which is just a Dict)
@@ -37,6 +86,83 @@ class InMemoryStore(BaseDataStore):
         self.attachment_store_ref = attachment_store
         self.identity_config_ref = identity_config
 
+        # Secondary indexes for search, kept in sync on every DPP addition or replacement.
+        # Structure-> <field>_index.postings[value] = set of DPP IDs
+        # Passports without a registration_id/current_owner/manufacturer are indexed under None,
+        # because search_for_dpp does not exclude them on those filters.
+        self.passport_type_index = InvertedIndex()
+        self.tag_index = InvertedIndex()
+        self.batch_id_index = InvertedIndex()
+        self.registration_id_index = InvertedIndex()
+        self.current_country_code_index = InvertedIndex()
+        self.origin_country_code_index = InvertedIndex()
+        # Substring index over the lowercased ID and title of each DPP, for name_contains.
+        self.name_index = TrigramIndex()
+        # Substring index over the distinct registration IDs (keyed by themselves, not by DPP
+        # ID), which narrows down the keys of registration_id_index to check.
+        self.registration_id_names = TrigramIndex()
+        # Structure-> dpp_sequence[ID] = insertion number, dpp_ids_by_sequence[number] = ID
+        # Search results are returned in insertion order, which also makes them resumable.
+        self.dpp_sequence: Dict[str, int] = {}
+        self.dpp_ids_by_sequence: List[str] = []
+        # Array-backed registry of DPP IDs, for random sampling without copying the keys.
+        self.dpp_id_registry = IdRegistry()
+
+        # Running counters for InMemoryStoreStatistics, so statistics don't need a full pass.
+        # Structure-> connected_dpp_ids = IDs of DPPs with a parent or subpassports
+        # Structure-> creation_time_index = DPP IDs sorted by creation_timestamp (epoch seconds)
+        # Structure-> event_type_counts[event type] = number of events in the event_store
+        self.connected_dpp_ids: Set[str] = set()
+        self.creation_time_index = SortedTimeIndex()
+        self.event_type_counts: Dict[str | None, int] = defaultdict(int)
+
+        # Event timelines. Each DPP keeps its event ID lists ordered by event timestamp.
+        # Structure-> event_epochs[event ID] = parsed event timestamp in epoch seconds
+        # Structure-> event_links[event ID] = set of (DPP ID, event type) referencing it
+        self.event_epochs: Dict[str, float] = {}
+        self.event_links: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+        # Structure-> full_event_timelines[DPP ID][event type] = event IDs of the DPP subtree
+        self.full_event_timelines: Dict[str, Dict[str, List[str]]] = {}
+        # Structure-> subpassport_parents[ID] = IDs of the DPPs listing it as subpassport
+        # A subpassport can be listed by more DPPs than its parent, after attaching it again.
+        self.subpassport_parents: Dict[str, Set[str]] = defaultdict(set)
+        # Structure-> attachment_dpps[attachment ID] = IDs of the DPPs listing the attachment
+        self.attachment_dpps: Dict[str, Set[str]] = defaultdict(set)
+
+        # Structure-> dpp_versions[DPP ID] = number of changes to the DPP and its subtree
+        # Encoded responses are cached per DPP version, see get_encoded_dpp_document.
+        self.dpp_versions: Dict[str, int] = defaultdict(int)
+        # Structure-> dpp_modified_at[DPP ID] = time of the last change to the DPP or its subtree
+        self.dpp_modified_at: Dict[str, datetime] = {}
+        self.response_cache = ResponseCache(self.RESPONSE_CACHE_MAX_ENTRIES)
+
+        # Write-ahead log of mutations, attached at startup when configured. The number of the
+        # last applied log record is part of snapshots, so replays continue after it.
+        self.mutation_log: Any = None
+        self.applied_log_sequence = 0
+        # Mutations of the running logical operation, logged as one record when it ends.
+        self.pending_mutations: List[Tuple[str, Tuple]] | None = None
+        # Time of the running operation, which DPPs changed by it are modified at. It is part
+        # of the log record, so every replay (and every worker) gets the same time.
+        self.operation_time: datetime | None = None
+
+    # State of the store, including its indexes, for snapshots (see app.datastores.snapshot).
+    def get_snapshot_state(self) -> Dict[str, Any]:
+        return {
+            name: value
+            for name, value in vars(self).items()
+            if name not in self.SNAPSHOT_EXCLUDED_ATTRIBUTES
+        }
+
+    # Replace the state of the store by a snapshot state. Returns False, without changes, if the
+    # snapshot was taken from a store with different attributes.
+    def restore_snapshot_state(self, state: Dict[str, Any]) -> bool:
+        if set(state) != set(self.get_snapshot_state()):
+            return False
+        vars(self).update(state)
+        self.response_cache.clear()
+        return True
+
     def get_dpp_document(
         self,
         document_id: str,
@@ -53,37 +179,49 @@ class InMemoryStore(BaseDataStore):
             signature_format,
         )
 
+    def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        cache_key = (document_id, content_format, format, signature_format)
+        version = self.get_dpp_version(document_id)
+        content = self.response_cache.get(cache_key, version)
+        if content is None:
+            content = encode_json(
+                self.get_dpp_document(
+                    document_id, content_format, format, signature_format
+                )
+            )
+            self.response_cache.put(cache_key, version, content)
+        return content
+
+    def get_dpp_version(self, document_id: str) -> int:
+        return self.dpp_versions.get(document_id, 0)
+
+    def get_dpp_last_modified(self, document_id: str) -> datetime | None:
+        if document_id not in self.dpp_store:
+            return None
+        return self.dpp_modified_at.get(document_id, None)
+
+    def get_response_cache_metrics(self) -> Dict:
+        return self.response_cache.to_dict()
+
     def get_dpp_object(self, document_id: str) -> DigitalProductPassport | None:
         return self.dpp_store.get(document_id, None)
 
     def get_random_dpp_document_id(self) -> str | None:
-        return random.choice(list(self.dpp_store.keys()))
+        return self.dpp_id_registry.choice()
 
-    # TODO: Sort by creation date.
+    # Latest by creation_timestamp, DPPs without one are not considered.
     def get_latest_added_dpp_document_id(self) -> str | None:
-        # dpp_list = list(self.dpp_store.keys())
-        # creation_timestamp_list = [self.dpp_store[dpp_id].creation_timestamp for dpp_id in dpp_list]
-        dpp_creation_timestamps = [
-            (dpp_id, self.dpp_store[dpp_id].creation_timestamp)
-            for dpp_id in self.dpp_store.keys()
-        ]
-        # Filter out entries with None as creation_timestamp and convert the remaining timestamps to datetime objects
-        valid_dpp_creation_timestamps = [
-            (dpp_id, datetime.strptime(creation_timestamp, "%Y-%m-%dT%H:%M:%SZ"))
-            for dpp_id, creation_timestamp in dpp_creation_timestamps
-            if creation_timestamp is not None
-        ]
-        # If no valid timestamps, return None
-        if not valid_dpp_creation_timestamps:
-            return None
-        # log_string = "Timestamps :\n"
-        # for i in valid_dpp_creation_timestamps:
-        #     log_string += i[0] + " -> " + i[1].isoformat() + "\n"
-        # logger.debug(format_multiline_log(log_string))
-        latest_dpp_id, _ = max(valid_dpp_creation_timestamps, key=lambda item: item[1])
-        return latest_dpp_id
+        latest_dpp_ids = self.get_latest_added_dpp_document_ids(1)
+        return latest_dpp_ids[0] if latest_dpp_ids else None
 
-        # return list(self.dpp_store.keys())[-1] if self.dpp_store else None
+    def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        return self.creation_time_index.latest(n)
 
     def get_dpp_database_metadata(self) -> Dict:
         return {
@@ -122,7 +260,14 @@ class InMemoryStore(BaseDataStore):
         template_id: str | None = None,
         template_version: str | None = "latest",
     ) -> None:
-        import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+        with self.logged_operation():
+            import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+
+    def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        # The creation times of the batch are sorted into their index at once.
+        with self.logged_operation(), self.creation_time_index.bulk_add():
+            for dpp_document in dpp_documents:
+                import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
 
     def update_dpp_document(self, document_id: str, dpp_document: str) -> None:
         raise NotImplementedError
@@ -130,82 +275,344 @@ class InMemoryStore(BaseDataStore):
     def add_dpp_object(
         self, document_id: str, dpp_object: DigitalProductPassport
     ) -> None:
+        existing_dpp_object = self.dpp_store.get(document_id, None)
+        if existing_dpp_object is not None:
+            # Replacing a DPP, so the old values must leave the indexes first.
+            self.unindex_dpp(document_id, existing_dpp_object)
+            self.mark_dpp_changed(document_id)
+            for subpassport_id in existing_dpp_object.subpassports:
+                self.subpassport_parents[subpassport_id].discard(document_id)
+            for attachment_id in existing_dpp_object.attachments:
+                self.attachment_dpps[attachment_id].discard(document_id)
+            for event_type, event_id_list in existing_dpp_object.events.items():
+                for event_id in event_id_list:
+                    self.event_links.get(event_id, set()).discard(
+                        (document_id, event_type)
+                    )
+        else:
+            self.dpp_sequence[document_id] = len(self.dpp_ids_by_sequence)
+            self.dpp_ids_by_sequence.append(document_id)
+            self.dpp_id_registry.add(document_id)
         self.dpp_store[document_id] = dpp_object
-
-    def filter_events_full(
-        self,
-        dpp_id: str,
-        dpp_store: Dict[str, DigitalProductPassport],
-        event_store: Dict[str, List[Dict]],
-        event_type: str = EventFilterFormats.ACTIVITY.value,
-    ):
-        list_dpp_hierarchy = []
-
-        def traverse(dpp_id):
-            list_dpp_hierarchy.append(dpp_id)
-            for subpassport in dpp_store[dpp_id].subpassports:
-                traverse(subpassport)
-
-        traverse(dpp_id)
-
-        filtered_events_ids_full = set()
-        for dpp_id in list_dpp_hierarchy:
-            if event_type == EventFilterFormats.ALL.value:
-                event_id_list = (
-                    self.dpp_store[dpp_id].events["activity"]
-                    + self.dpp_store[dpp_id].events["ownership"]
-                )
-            else:
-                event_id_list = self.dpp_store[dpp_id].events[event_type]
-
-            filtered_events_ids_full.update(event_id_list)
-            # filtered_events_full += self.filter_events(dpp_id, event_store)
-        filtered_events_full = [
-            self.event_store[event] for event in list(filtered_events_ids_full)
+        self.index_dpp(document_id, dpp_object)
+        for attachment_id in dpp_object.attachments:
+            self.attachment_dpps[attachment_id].add(document_id)
+        self.mark_dpp_changed(document_id)
+
+        # Register references to known events, and bring them in timestamp order.
+        for event_type, event_id_list in dpp_object.events.items():
+            known_event_ids = [
+                event_id for event_id in event_id_list if event_id in self.event_store
+            ]
+            event_id_list.clear()
+            for event_id in known_event_ids:
+                self.link_event(document_id, event_id, event_type)
+
+        creation_epoch = timestamp_to_epoch(dpp_object.creation_timestamp)
+        if creation_epoch is None:
+            self.creation_time_index.remove(document_id)
+        else:
+            self.creation_time_index.add(document_id, creation_epoch)
+
+        # Subpassports get their parent assigned before the parent itself is added. It is
+        # assigned here as well, so a replay of the write-ahead log restores it.
+        self.update_connected_state(document_id)
+        for subpassport_id in dpp_object.subpassports:
+            self.subpassport_parents[subpassport_id].add(document_id)
+            subpassport_object = self.dpp_store.get(subpassport_id, None)
+            if subpassport_object is not None:
+                subpassport_object.parent = document_id
+            self.update_connected_state(subpassport_id)
+            self.mark_dpp_changed(subpassport_id)
+        if dpp_object.parent:
+            self.update_connected_state(dpp_object.parent)
+        self.log_mutation("add_dpp_object", document_id, dpp_object)
+
+    # Record a mutation in the write-ahead log, when one is attached (see app.datastores.wal).
+    # Mutations are recorded once applied, with their final arguments (such as generated IDs).
+    def log_mutation(self, operation: str, *arguments: Any) -> None:
+        if self.pending_mutations is not None:
+            if self.mutation_log is not None:
+                # The arguments are recorded as they are now, the operation may change them.
+                self.pending_mutations.append((operation, copy.deepcopy(arguments)))
+            return
+        modified_at, self.operation_time = self.operation_time, None
+        if self.mutation_log is None:
+            return
+        self.applied_log_sequence = self.mutation_log.append(
+            operation, arguments, modified_at
+        )
+        self.mutation_log.compact_if_due()
+
+    def get_operation_time(self) -> datetime:
+        if self.operation_time is None:
+            self.operation_time = datetime.now(timezone.utc)
+        return self.operation_time
+
+    # Log the mutations of a logical operation (such as a DPP with its events) as a single
+    # record, when the outermost operation ends. Mutations applied before an error are logged
+    # as well, as they stay applied.
+    @contextmanager
+    def logged_operation(self) -> Iterator[None]:
+        if self.pending_mutations is not None:
+            yield
+            return
+        self.pending_mutations = []
+        self.operation_time = None
+        try:
+            yield
+        finally:
+            mutations, self.pending_mutations = self.pending_mutations, None
+            if len(mutations) == 1:
+                self.log_mutation(mutations[0][0], *mutations[0][1])
+            elif mutations:
+                self.log_mutation("apply_mutations", mutations)
+            self.operation_time = None
+
+    # Replay of a record of several mutations.
+    def apply_mutations(self, mutations: List[Tuple[str, Tuple]]) -> None:
+        with self.logged_operation():
+            for operation, arguments in mutations:
+                getattr(self, operation)(*arguments)
+
+    # Apply a record of the write-ahead log, at the time it was logged (None for records
+    # written before log records had a time).
+    def replay_mutation(
+        self, operation: str, arguments: Tuple, modified_at: datetime | None
+    ) -> None:
+        with self.logged_operation():
+            self.operation_time = modified_at
+            getattr(self, operation)(*arguments)
+
+    def update_connected_state(self, document_id: str) -> None:
+        dpp_object = self.dpp_store.get(document_id, None)
+        if dpp_object is not None and (dpp_object.subpassports or dpp_object.parent):
+            self.connected_dpp_ids.add(document_id)
+        else:
+            self.connected_dpp_ids.discard(document_id)
+
+    def index_key_values(self, dpp_object: DigitalProductPassport):
+        # Pairs of (index, key) that a DPP is registered under.
+        index_key_values = [
+            (self.passport_type_index, dpp_object.passport_type),
+            (self.batch_id_index, dpp_object.batch_id),
+            (self.registration_id_index, dpp_object.registration_id or None),
+            (
+                self.current_country_code_index,
+                (
+                    self.get_country_code(dpp_object.current_owner)
+                    if dpp_object.current_owner
+                    else None
+                ),
+            ),
+            (
+                self.origin_country_code_index,
+                (
+                    self.get_country_code(dpp_object.manufacturer)
+                    if dpp_object.manufacturer
+                    else None
+                ),
+            ),
         ]
-        return filtered_events_full
-
-    def sort_events(self, event_list: List[Dict]) -> List[Dict]:
-        # Helper function to extract timestamp
-        def extract_timestamp(event: Dict) -> datetime:
-            if "prov:atTime" in event:
-                return datetime.fromisoformat(
-                    event["prov:atTime"]["@value"].replace("Z", "+00:00")
+        index_key_values += [(self.tag_index, tag) for tag in set(dpp_object.tags)]
+        return index_key_values
+
+    def index_dpp(self, document_id: str, dpp_object: DigitalProductPassport) -> None:
+        for index, key in self.index_key_values(dpp_object):
+            index.add(key, document_id)
+        self.name_index.add(document_id, dpp_object.id, dpp_object.title)
+        registration_id = dpp_object.registration_id
+        if (
+            registration_id
+            and len(self.registration_id_index.get(registration_id)) == 1
+        ):
+            self.registration_id_names.add(registration_id, registration_id)
+
+    def unindex_dpp(self, document_id: str, dpp_object: DigitalProductPassport) -> None:
+        for index, key in self.index_key_values(dpp_object):
+            index.remove(key, document_id)
+        self.name_index.remove(document_id)
+        registration_id = dpp_object.registration_id
+        if registration_id and not self.registration_id_index.get(registration_id):
+            self.registration_id_names.remove(registration_id)
+
+    # Timestamp-ordered event IDs of a single DPP, for one event type or all of them.
+    def get_event_timeline(self, document_id: str, event_type: str) -> List[str]:
+        dpp_events = self.dpp_store[document_id].events
+        if event_type == EventFilterFormats.ALL.value:
+            return list(
+                heapq.merge(
+                    dpp_events["activity"],
+                    dpp_events["ownership"],
+                    key=self.event_epochs.__getitem__,
                 )
-            if "prov:endedAtTime" in event:
-                return datetime.fromisoformat(
-                    event["prov:endedAtTime"]["@value"].replace("Z", "+00:00")
+            )
+        return dpp_events[event_type]
+
+    # Merged, timestamp-ordered and deduplicated event IDs of a DPP and all of its (nested)
+    # subpassports. Timelines are cached per subtree, and are invalidated along the ancestor
+    # path when events or subpassports change (see mark_dpp_changed).
+    def get_full_event_timeline(self, document_id: str, event_type: str) -> List[str]:
+        cached_timeline = self.full_event_timelines.get(document_id, {}).get(
+            event_type, None
+        )
+        if cached_timeline is not None:
+            return cached_timeline
+
+        # Iterative post-order traversal, so subpassport timelines are built before their
+        # parents'. DPPs already on the path are skipped, which guards against cycles.
+        on_path: Set[str] = set()
+        stack: List[Tuple[str, bool]] = [(document_id, False)]
+        while stack:
+            dpp_id, subpassports_done = stack.pop()
+            if event_type in self.full_event_timelines.get(dpp_id, {}):
+                continue
+            dpp_object = self.dpp_store[dpp_id]
+            if not subpassports_done:
+                if dpp_id in on_path:
+                    continue
+                on_path.add(dpp_id)
+                stack.append((dpp_id, True))
+                for subpassport_id in dpp_object.subpassports:
+                    if (
+                        subpassport_id in self.dpp_store
+                        and subpassport_id not in on_path
+                    ):
+                        stack.append((subpassport_id, False))
+                continue
+
+            on_path.discard(dpp_id)
+            timelines = [self.get_event_timeline(dpp_id, event_type)]
+            for subpassport_id in dpp_object.subpassports:
+                subpassport_timeline = self.full_event_timelines.get(
+                    subpassport_id, {}
+                ).get(event_type, None)
+                if subpassport_timeline is not None:
+                    timelines.append(subpassport_timeline)
+            merged_timeline: List[str] = []
+            seen_event_ids: Set[str] = set()
+            for event_id in heapq.merge(*timelines, key=self.event_epochs.__getitem__):
+                if event_id not in seen_event_ids:
+                    seen_event_ids.add(event_id)
+                    merged_timeline.append(event_id)
+            self.full_event_timelines.setdefault(dpp_id, {})[
+                event_type
+            ] = merged_timeline
+
+        return self.full_event_timelines[document_id][event_type]
+
+    # Register a change to a DPP. Its responses and full event timeline are derived from its
+    # subtree, so the version of every ancestor (every DPP listing it as subpassport, and its
+    # parent) is bumped and their timelines are dropped too.
+    def mark_dpp_changed(self, document_id: str | None) -> None:
+        visited: Set[str] = set()
+        modified_at = self.get_operation_time()
+        pending = [document_id]
+        while pending:
+            document_id = pending.pop()
+            if not document_id or document_id in visited:
+                continue
+            visited.add(document_id)
+            self.dpp_versions[document_id] += 1
+            self.dpp_modified_at[document_id] = modified_at
+            self.full_event_timelines.pop(document_id, None)
+            pending.extend(self.subpassport_parents.get(document_id, ()))
+            dpp_object = self.dpp_store.get(document_id, None)
+            if dpp_object is not None:
+                pending.append(dpp_object.parent)
+
+    # Timestamp of an event in epoch seconds, events without one are sorted first.
+    @staticmethod
+    def extract_event_epoch(event: Dict) -> float:
+        for timestamp_key in ["prov:atTime", "prov:endedAtTime"]:
+            if timestamp_key in event:
+                event_epoch = timestamp_to_epoch(
+                    event[timestamp_key].get("@value", None)
                 )
-            return datetime.min  # Return a minimal date if no timestamp found
+                if event_epoch is not None:
+                    return event_epoch
+        return float("-inf")
+
+    def get_event_epoch(self, event: Dict) -> float:
+        try:
+            return self.event_epochs[self.get_id_value(event)]
+        except Exception:
+            return self.extract_event_epoch(event)
 
-        # Sort events by timestamp
-        sorted_events = sorted(event_list, key=extract_timestamp)
+    def sort_events(self, event_list: List[Dict]) -> List[Dict]:
+        # Sort events by (pre-parsed) timestamp
+        sorted_events = sorted(event_list, key=self.get_event_epoch)
         return sorted_events
 
+    # Slice of a timestamp-ordered list of event IDs within [since, until].
+    def event_ids_in_time_range(
+        self,
+        event_id_list: List[str],
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> List[str]:
+        start_position, end_position = 0, len(event_id_list)
+        if since is not None:
+            start_position = bisect_left(
+                event_id_list,
+                datetime_to_epoch(since),
+                key=self.event_epochs.__getitem__,
+            )
+        if until is not None:
+            end_position = bisect_right(
+                event_id_list,
+                datetime_to_epoch(until),
+                key=self.event_epochs.__getitem__,
+            )
+        return event_id_list[start_position:end_position]
+
     def get_dpp_events(
         self,
         document_id: str,
         sorted: bool = True,
         event_type: str = EventFilterFormats.ACTIVITY.value,
+        since: datetime | None = None,
+        until: datetime | None = None,
     ) -> List[Dict]:
-        if event_type == EventFilterFormats.ALL.value:
-            event_id_list = (
-                self.dpp_store[document_id].events["activity"]
-                + self.dpp_store[document_id].events["ownership"]
-            )
-        else:
-            event_id_list = self.dpp_store[document_id].events[event_type]
-        event_list = [self.event_store[event] for event in event_id_list]
-        # event_list = self.filter_events(document_id, self.event_store, event_type)
-        return self.sort_events(event_list)
+        # Event ID lists of a DPP are kept in timestamp order, so no sorting is needed.
+        event_id_list = self.event_ids_in_time_range(
+            self.get_event_timeline(document_id, event_type), since, until
+        )
+        return [self.event_store[event] for event in event_id_list]
 
     def get_dpp_full_events(
-        self, document_id: str, sorted: bool = True, event_type: str = "activity"
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: datetime | None = None,
+        until: datetime | None = None,
     ) -> List[Dict]:
-        event_list = self.filter_events_full(
-            document_id, self.dpp_store, self.event_store, event_type
+        # Cached subtree timelines are already merged in timestamp order.
+        event_id_list = self.event_ids_in_time_range(
+            self.get_full_event_timeline(document_id, event_type), since, until
         )
-        return self.sort_events(event_list)
+        return [self.event_store[event] for event in event_id_list]
+
+    # Reference an event from a DPP, keeping the event ID list of the DPP in timestamp order.
+    def link_event(self, document_id: str, event_id: str, event_type: str) -> None:
+        event_links = self.event_links[event_id]
+        if (document_id, event_type) in event_links:
+            return
+        event_links.add((document_id, event_type))
+        insort(
+            self.dpp_store[document_id].events[event_type],
+            event_id,
+            key=self.event_epochs.__getitem__,
+        )
+        self.mark_dpp_changed(document_id)
+
+    def unlink_event(self, document_id: str, event_id: str, event_type: str) -> None:
+        self.event_links.get(event_id, set()).discard((document_id, event_type))
+        dpp_object = self.dpp_store.get(document_id, None)
+        if dpp_object is not None and event_id in dpp_object.events[event_type]:
+            dpp_object.events[event_type].remove(event_id)
+            self.mark_dpp_changed(document_id)
 
     @staticmethod
     def get_id_value(obj):
@@ -216,6 +623,16 @@ class InMemoryStore(BaseDataStore):
         else:
             raise Exception("Unidentifiable object found.")
 
+    @staticmethod
+    def get_event_type(event: Dict):
+        return event.get("@type", event.get("type", None))
+
+    def count_event_type(self, event: Dict, change: int) -> None:
+        event_type = self.get_event_type(event)
+        self.event_type_counts[event_type] += change
+        if self.event_type_counts[event_type] <= 0:
+            del self.event_type_counts[event_type]
+
     # Add ID if event has no ID.
     def add_dpp_event(
         self, document_id: str, event: Dict, event_type: str = "activity"
@@ -225,6 +642,14 @@ class InMemoryStore(BaseDataStore):
         except:
             event_id = str(uuid.uuid4())
             event["id"] = event_id
+        if event_id in self.event_store:
+            logger.debug("Event was already present, only adding reference.")
+        else:
+            # Add event to event store, parsing its timestamp once.
+            self.event_store[event_id] = event
+            self.event_epochs[event_id] = self.extract_event_epoch(event)
+            self.event_type_counts[self.get_event_type(event)] += 1
+            logger.debug("Event added-> " + event_id)
         if document_id not in self.dpp_store:
             logger.warn(
                 "Adding event -> "
@@ -234,14 +659,9 @@ class InMemoryStore(BaseDataStore):
             )
         else:
             # Add event reference to DPP.
-            self.dpp_store[document_id].events[event_type].append(event_id)
-        if event_id in self.event_store:
-            logger.warn("Event was already present.")
-        else:
-            # Add event to event store.
-            self.event_store[event_id] = event
-            logger.debug("Event added-> " + event_id)
+            self.link_event(document_id, event_id, event_type)
 
+        self.log_mutation("add_dpp_event", document_id, event, event_type)
         return event_id
 
     def add_dpp_events(
@@ -249,10 +669,11 @@ class InMemoryStore(BaseDataStore):
     ) -> List[str | None]:
         if event_type is None:
             event_type = ["activity" for i in range(len(event_list))]
-        return [
-            self.add_dpp_event(document_id, event, etype)
-            for event, etype in zip(event_list, event_type)
-        ]
+        with self.logged_operation():
+            return [
+                self.add_dpp_event(document_id, event, etype)
+                for event, etype in zip(event_list, event_type)
+            ]
 
     def update_dpp_event(
         self, document_id: str, event: Dict, event_type: str = "activity"
@@ -261,7 +682,22 @@ class InMemoryStore(BaseDataStore):
         # Assume that this event is already in the event_store.
         # Then just overwrite.
         if event_id in self.event_store:
+            self.count_event_type(self.event_store[event_id], -1)
             self.event_store[event_id] = event
+            self.event_type_counts[self.get_event_type(event)] += 1
+            event_epoch = self.extract_event_epoch(event)
+            if event_epoch != self.event_epochs[event_id]:
+                # Reposition the event in every DPP referencing it.
+                event_links = list(self.event_links.get(event_id, set()))
+                for linked_document_id, linked_event_type in event_links:
+                    self.unlink_event(linked_document_id, event_id, linked_event_type)
+                self.event_epochs[event_id] = event_epoch
+                for linked_document_id, linked_event_type in event_links:
+                    self.link_event(linked_document_id, event_id, linked_event_type)
+            # Responses embed the event content, so every referencing DPP changed.
+            for linked_document_id, _ in list(self.event_links.get(event_id, set())):
+                self.mark_dpp_changed(linked_document_id)
+            self.log_mutation("update_dpp_event", document_id, event, event_type)
         # If not, then something wrong, so throw exception
         else:
             raise Exception("Event not found to update.")
@@ -272,7 +708,15 @@ class InMemoryStore(BaseDataStore):
         # Assume that this event is already in the event_store.
         # Then just delete.
         if event_id in self.event_store:
-            del self.event_store[event_id]
+            self.count_event_type(self.event_store.pop(event_id), -1)
+            # Remove the references from DPPs as well, no dangling IDs remain.
+            for linked_document_id, linked_event_type in list(
+                self.event_links.get(event_id, set())
+            ):
+                self.unlink_event(linked_document_id, event_id, linked_event_type)
+            self.event_links.pop(event_id, None)
+            del self.event_epochs[event_id]
+            self.log_mutation("delete_dpp_event", document_id, event_id, event_type)
         # If not, then something wrong, so throw exception
         else:
             raise Exception("Event not found to delete.")
@@ -292,16 +736,26 @@ class InMemoryStore(BaseDataStore):
             if subdpp is None:
                 raise Exception("Subpassport not available -> " + subpassport_id)
             else:
+                # The subpassport changes, along with the path of its former parent.
+                self.mark_dpp_changed(subpassport_id)
                 dpp.subpassports.append(subpassport_id)
+                self.subpassport_parents[subpassport_id].add(document_id)
                 subdpp.parent = document_id
+                self.mark_dpp_changed(document_id)
+                self.update_connected_state(document_id)
+                self.update_connected_state(subpassport_id)
+                self.log_mutation(
+                    "attach_subpassport_by_id", document_id, subpassport_id
+                )
 
     def attach_subpassport(self, document_id: str, subpassport_document: Dict) -> None:
         # subpassport_document_data = subpassport_document[
         #     list(subpassport_document.keys())[0]
         # ]
         subpassport_id = self.get_id_value(subpassport_document)
-        self.add_dpp_document(subpassport_id, subpassport_document)
-        self.attach_subpassport_by_id(document_id, subpassport_id)
+        with self.logged_operation():
+            self.add_dpp_document(subpassport_id, subpassport_document)
+            self.attach_subpassport_by_id(document_id, subpassport_id)
 
     def detach_subpassport_by_id(self, document_id: str, subpassport_id: str) -> None:
         dpp = self.dpp_store.get(document_id, None)
@@ -325,12 +779,28 @@ class InMemoryStore(BaseDataStore):
                     dpp.subpassports = [
                         x for x in dpp.subpassports if x != subpassport_id
                     ]
+                    self.subpassport_parents[subpassport_id].discard(document_id)
                     subdpp.parent = ""
+                    self.mark_dpp_changed(document_id)
+                    self.mark_dpp_changed(subpassport_id)
+                    self.update_connected_state(document_id)
+                    self.update_connected_state(subpassport_id)
+                    self.log_mutation(
+                        "detach_subpassport_by_id", document_id, subpassport_id
+                    )
                 else:
                     dpp.subpassports = [
                         x for x in dpp.subpassports if x != subpassport_id
                     ]
+                    self.subpassport_parents[subpassport_id].discard(document_id)
                     subdpp.parent = ""
+                    self.mark_dpp_changed(document_id)
+                    self.mark_dpp_changed(subpassport_id)
+                    self.update_connected_state(document_id)
+                    self.update_connected_state(subpassport_id)
+                    self.log_mutation(
+                        "detach_subpassport_by_id", document_id, subpassport_id
+                    )
                     logger.debug(
                         "Subpassport detached from -> "
                         + document_id
@@ -338,73 +808,209 @@ class InMemoryStore(BaseDataStore):
                         + subpassport_id
                     )
 
+    # The attachment index follows the change as well, so a replay of the write-ahead log
+    # restores changes to attachments. It is already up to date when the change was made here.
+    def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: AttachmentReference | None,
+        document_id: str | None = None,
+    ) -> None:
+        self.attachment_store_ref.restore_attachment(
+            attachment_id, attachment_reference
+        )
+        dpp_object = self.dpp_store.get(document_id, None) if document_id else None
+        if (
+            dpp_object is not None
+            and attachment_reference is not None
+            and attachment_id not in dpp_object.attachments
+        ):
+            dpp_object.attachments.append(attachment_id)
+            self.attachment_dpps[attachment_id].add(document_id)
+        listing_dpp_ids = list(self.attachment_dpps.get(attachment_id, ()))
+        if attachment_reference is None:
+            for listing_dpp_id in listing_dpp_ids:
+                listing_dpp_object = self.dpp_store[listing_dpp_id]
+                listing_dpp_object.attachments = [
+                    listed_id
+                    for listed_id in listing_dpp_object.attachments
+                    if listed_id != attachment_id
+                ]
+            self.attachment_dpps.pop(attachment_id, None)
+        for listing_dpp_id in listing_dpp_ids:
+            self.mark_dpp_changed(listing_dpp_id)
+        self.log_mutation(
+            "register_attachment_change",
+            attachment_id,
+            attachment_reference,
+            document_id,
+        )
+
     # Define helper function to get country code from entity
+    # Entities are imported as plain dicts, but may also be Entity objects.
     @staticmethod
-    def get_country_code(entity: Entity):
-        if not entity or not entity.facility:
+    def get_country_code(entity: Entity | Dict | None):
+        if not entity:
             return "None"
-        elif isinstance(entity.facility, list):
-            return entity.facility[0].country_code
-        else:
-            return entity.facility.country_code
+        facility = (
+            entity.get("facility", None)
+            if isinstance(entity, dict)
+            else entity.facility
+        )
+        if not facility:
+            return "None"
+        if isinstance(facility, list):
+            facility = facility[0]
+        if isinstance(facility, dict):
+            return facility.get("country_code", None)
+        return facility.country_code
 
     def search_for_dpp(self, filters: FilterConditions) -> List[Dict[str, str]]:
-        # Holds the filtered results
-        filtered_results = []
-
-        # Iterate through the DPP store
-        for id, dpp in self.dpp_store.items():
-            match = True
-
-            # Check if name_contains present in ID
-            if (
-                filters.name_contains
-                and filters.name_contains.lower() not in dpp.id.lower()
-            ):
-                match = False
+        return list(self.search_for_dpp_iterator(filters))
+
+    def search_for_dpp_iterator(
+        self, filters: FilterConditions, after_document_id: str | None = None
+    ) -> Iterator[Dict[str, str]]:
+        # Resume after a previously returned DPP, if requested.
+        if after_document_id is None:
+            start_sequence = 0
+        elif after_document_id in self.dpp_sequence:
+            start_sequence = self.dpp_sequence[after_document_id] + 1
+        else:
+            raise KeyError(
+                "Unknown DPP to continue search from -> " + after_document_id
+            )
 
-            # Check passport_type
-            if filters.passport_type and dpp.passport_type not in filters.passport_type:
-                match = False
+        candidate_sets = self.filter_candidate_sets(filters)
+        name_contains = filters.name_contains
+
+        if candidate_sets:
+            # Walk the smallest posting set in store order, and check membership in the others.
+            candidate_sets.sort(key=len)
+            remaining_sets = candidate_sets[1:]
+            candidate_sequences = sorted(
+                sequence
+                for sequence in map(self.dpp_sequence.__getitem__, candidate_sets[0])
+                if sequence >= start_sequence
+            )
+            candidate_ids: Iterable[str] = (
+                self.dpp_ids_by_sequence[sequence] for sequence in candidate_sequences
+            )
+        else:
+            remaining_sets = []
+            candidate_ids = islice(self.dpp_ids_by_sequence, start_sequence, None)
+
+        for id in candidate_ids:
+            if self.filter_matches(id, remaining_sets, name_contains):
+                yield {"label": id, "value": id}
+
+    # Posting sets of every active filter. A DPP matches the filters when it is in all sets,
+    # and (if given) contains name_contains, which the trigram postings only narrow down.
+    def filter_candidate_sets(self, filters: FilterConditions) -> List[Set[str]]:
+        candidate_sets: List[Set[str]] = []
+
+        # Check passport_type
+        if filters.passport_type:
+            candidate_sets.append(self.passport_type_index.union(filters.passport_type))
+
+        # Check tags (all tags need to be present)
+        for tag in set(filters.tags):
+            candidate_sets.append(self.tag_index.get(tag))
+
+        # Check batch_id
+        if filters.batch_ids:
+            candidate_sets.append(self.batch_id_index.union(filters.batch_ids))
+
+        # Check registration_id (substring match, DPPs without one are not excluded)
+        # The trigram index is case-insensitive, so its candidates are checked once more.
+        if filters.registration_id:
+            matching_registration_ids = [None] + [
+                registration_id
+                for registration_id in self.registration_id_names.candidates(
+                    filters.registration_id
+                )
+                if filters.registration_id in registration_id
+            ]
+            candidate_sets.append(
+                self.registration_id_index.union(matching_registration_ids)
+            )
 
-            # Check tags
-            if filters.tags and not set(filters.tags).issubset(set(dpp.tags)):
-                match = False
+        # Check current_country_codes (DPPs without current owner are not excluded)
+        if filters.current_country_codes:
+            candidate_sets.append(
+                self.current_country_code_index.union(
+                    list(filters.current_country_codes) + [None]
+                )
+            )
 
-            # Check batch_id
-            if filters.batch_ids and dpp.batch_id not in filters.batch_ids:
-                match = False
+        # Check origin_country_codes (DPPs without manufacturer are not excluded)
+        if filters.origin_country_codes:
+            candidate_sets.append(
+                self.origin_country_code_index.union(
+                    list(filters.origin_country_codes) + [None]
+                )
+            )
 
-            # Check registration_id
-            if (
-                filters.registration_id
-                and dpp.registration_id
-                and filters.registration_id not in dpp.registration_id
-            ):
-                match = False
-
-            # Check current_country_codes
-            if (
-                filters.current_country_codes
-                and dpp.current_owner
-                and self.get_country_code(dpp.current_owner)
-                not in filters.current_country_codes
-            ):
-                match = False
-
-            # Check origin_country_codes
-            if (
-                filters.origin_country_codes
-                and dpp.manufacturer
-                and self.get_country_code(dpp.manufacturer)
-                not in filters.origin_country_codes
-            ):
-                match = False
+        # Check if name_contains present in ID or title
+        # The trigram index narrows down the candidates, the substring itself is checked per DPP.
+        if filters.name_contains and self.name_index.can_use_postings(
+            filters.name_contains
+        ):
+            candidate_sets.append(self.name_index.candidates(filters.name_contains))
 
-            if match:
-                filtered_results.append({"label": id, "value": id})
+        return candidate_sets
 
-        return filtered_results
+    def filter_matches(
+        self,
+        document_id: str,
+        candidate_sets: List[Set[str]],
+        name_contains: str | None,
+    ) -> bool:
+        if any(document_id not in candidate_set for candidate_set in candidate_sets):
+            return False
+        return not name_contains or self.name_index.contains(document_id, name_contains)
+
+    # Sample up to count distinct DPP IDs matching the filters, without copying the store.
+    # With filters, IDs are drawn from the registry until enough match (rejection sampling).
+    # When matches turn out to be rare, the matching IDs are collected and sampled instead.
+    def sample_dpp_document_ids(
+        self, count: int, filters: FilterConditions | None = None
+    ) -> List[str]:
+        candidate_sets = self.filter_candidate_sets(filters) if filters else []
+        name_contains = filters.name_contains if filters else None
+        if not candidate_sets and not name_contains:
+            return self.dpp_id_registry.sample(count)
+
+        candidate_sets.sort(key=len)
+        smallest_set_size = (
+            len(candidate_sets[0]) if candidate_sets else len(self.dpp_id_registry)
+        )
+        if smallest_set_size * self.SAMPLING_MAX_REJECTION_RATE >= len(
+            self.dpp_id_registry
+        ):
+            sampled_ids: Dict[str, None] = {}
+            for _ in range(count * self.SAMPLING_MAX_REJECTION_RATE):
+                document_id = self.dpp_id_registry.choice()
+                if document_id is not None and self.filter_matches(
+                    document_id, candidate_sets, name_contains
+                ):
+                    sampled_ids[document_id] = None
+                    if len(sampled_ids) == count:
+                        return list(sampled_ids)
+
+        if candidate_sets:
+            matching_ids = [
+                document_id
+                for document_id in candidate_sets[0]
+                if self.filter_matches(document_id, candidate_sets[1:], name_contains)
+            ]
+        else:
+            matching_ids = [
+                document_id
+                for document_id in self.dpp_id_registry.ids
+                if self.filter_matches(document_id, [], name_contains)
+            ]
+        return random.sample(matching_ids, min(count, len(matching_ids)))
 
     # TODO: Handle updating events independently
     def update_event(self, event_id: str, event: Dict) -> None:
@@ -439,78 +1045,107 @@ class InMemoryStore(BaseDataStore):
         raise NotImplementedError
 
 
+# Statistics are read from the indexes and counters that the InMemoryStore keeps up to date,
+# so they are proportional to the number of buckets rather than the number of passports.
 class InMemoryStoreStatistics(BaseStoreStatistics):
+    MAX_HISTOGRAM_BUCKETS = 10000
+
     def __init__(self, store: InMemoryStore):
         self.store = store
 
     def passports_by_batch(self) -> Dict[str, int]:
         batches = defaultdict(int)
-        for passport in self.store.dpp_store.values():
-            if passport.batch_id:
-                batches[passport.batch_id] += 1
+        for batch_id, dpp_ids in self.store.batch_id_index.postings.items():
+            if batch_id:
+                batches[batch_id] += len(dpp_ids)
             else:
-                batches["undefined"] += 1
+                batches["undefined"] += len(dpp_ids)
         return dict(batches)
 
     def number_of_batches(self) -> int:
-        output_list = []
-        for passport in self.store.dpp_store.values():
-            if passport.batch_id:
-                output_list.append(passport.batch_id)
-            else:
-                output_list.append("unknown")
-        return len(set(output_list))
+        return len(self.passports_by_batch())
 
     def number_of_unique_tags(self) -> int:
-        tags = set(
-            tag for passport in self.store.dpp_store.values() for tag in passport.tags
-        )
-        return len(tags)
+        return len(self.store.tag_index)
 
     def passports_by_tag(self) -> Dict[str, int]:
-        tags = defaultdict(int)
-        for passport in self.store.dpp_store.values():
-            if len(passport.tags) > 0:
-                for tag in passport.tags:
-                    tags[tag] += 1
-                    # batches[passport.batch_id] += 1
-        return dict(tags)
+        return {
+            tag: len(dpp_ids) for tag, dpp_ids in self.store.tag_index.postings.items()
+        }
 
     def passports_by_type(self) -> Dict[str, int]:
-        passport_types = defaultdict(int)
-        for passport in self.store.dpp_store.values():
-            passport_types[passport.passport_type] += 1
-
-        return dict(passport_types)
+        return {
+            passport_type: len(dpp_ids)
+            for passport_type, dpp_ids in self.store.passport_type_index.postings.items()
+        }
 
     def number_of_single_passports(self) -> int:
-        return sum(
-            1
-            for passport in self.store.dpp_store.values()
-            if not passport.subpassports and not passport.parent
-        )
+        return len(self.store.dpp_store) - len(self.store.connected_dpp_ids)
 
     def number_of_connected_passports(self) -> int:
-        return sum(
-            1
-            for passport in self.store.dpp_store.values()
-            if passport.subpassports or passport.parent
-        )
+        return len(self.store.connected_dpp_ids)
 
     def passports_created_in_time_range(
         self, start_time: datetime, end_time: datetime
     ) -> int:
-        return sum(
-            1
-            for passport in self.store.dpp_store.values()
-            if passport.creation_timestamp
-            and start_time
-            <= datetime.fromisoformat(
-                passport.creation_timestamp.replace("Z", "+00:00")
-            )
-            <= end_time
+        return self.store.creation_time_index.count(
+            datetime_to_epoch(start_time), datetime_to_epoch(end_time)
         )
 
+    @staticmethod
+    def start_of_interval(moment: datetime, interval: str) -> datetime:
+        moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        if interval == CreationHistogramIntervals.WEEK.value:
+            return moment - timedelta(days=moment.weekday())
+        elif interval == CreationHistogramIntervals.MONTH.value:
+            return moment.replace(day=1)
+        return moment
+
+    @staticmethod
+    def start_of_next_interval(interval_start: datetime, interval: str) -> datetime:
+        if interval == CreationHistogramIntervals.WEEK.value:
+            return interval_start + timedelta(weeks=1)
+        elif interval == CreationHistogramIntervals.MONTH.value:
+            if interval_start.month == 12:
+                return interval_start.replace(year=interval_start.year + 1, month=1)
+            return interval_start.replace(month=interval_start.month + 1)
+        return interval_start + timedelta(days=1)
+
+    def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        if interval not in [i.value for i in CreationHistogramIntervals]:
+            raise ValueError("Unknown histogram interval -> " + interval)
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+
+        # Buckets are aligned to calendar days/weeks (Monday)/months, and each count only
+        # includes passports within [start_time, end_time].
+        histogram = []
+        bucket_start = self.start_of_interval(start_time, interval)
+        while bucket_start <= end_time:
+            if len(histogram) >= self.MAX_HISTOGRAM_BUCKETS:
+                raise ValueError("Too many histogram buckets requested.")
+            bucket_end = self.start_of_next_interval(bucket_start, interval)
+            histogram.append(
+                {
+                    "start": bucket_start.isoformat(),
+                    "end": bucket_end.isoformat(),
+                    "count": self.store.creation_time_index.count(
+                        max(bucket_start, start_time).timestamp(),
+                        min(bucket_end, end_time).timestamp(),
+                        include_end=bucket_end > end_time,
+                    ),
+                }
+            )
+            bucket_start = bucket_end
+        return histogram
+
     def passports_created_last_day(self) -> int:
         now = datetime.now(timezone.utc)
         return self.passports_created_in_time_range(now - timedelta(days=1), now)
@@ -532,18 +1167,13 @@ class InMemoryStoreStatistics(BaseStoreStatistics):
         return self.passports_created_in_time_range(now - timedelta(days=365 * 5), now)
 
     def passports_created_all_time(self) -> int:
-        return sum(1 for passport in self.store.dpp_store.values())
+        return len(self.store.dpp_store)
 
     def events_all_time(self) -> int:
-        return len(self.store.event_store.values())
+        return len(self.store.event_store)
 
     def number_per_event_type(self) -> Dict[str, int]:
-        output = defaultdict(int)
-
-        for event in self.store.event_store.values():
-            event_type = event.get("@type", event.get("type", None))
-            output[event_type] += 1
-        return output
+        return dict(self.store.event_type_counts)
 
     def to_dict(self):
         passport_stats = {}
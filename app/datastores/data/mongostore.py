@@ -0,0 +1,1027 @@
+import logging
+import random
+import re
+import uuid
+from bisect import bisect_left, bisect_right
+from dataclasses import fields
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+from app.datamodel.attachment import AttachmentReference
+from app.datamodel.dpp import DigitalProductPassport
+from app.datamodel.encoding import decode_json, encode_json
+from app.datamodel.serde import deserialize_dpp, import_dpp_into_storage
+from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.data.basedatastore import (
+    BaseDataStore,
+    BaseStoreStatistics,
+    CreationHistogramIntervals,
+    DPPResponseContentFormats,
+    DPPResponseFormats,
+    DPPResponseSignatureFormats,
+    EventFilterFormats,
+    FilterConditions,
+)
+from app.datastores.data.indexes import TrigramIndex
+from app.datastores.data.inmemorystore import (
+    InMemoryStore,
+    InMemoryStoreStatistics,
+    datetime_to_epoch,
+    timestamp_to_epoch,
+)
+from app.datastores.data.responsecache import ResponseCache
+
+try:
+    import pymongo
+    import pymongo.errors
+except ImportError:
+    pymongo = None
+
+logger = logging.getLogger("mongodb-data")
+
+# Collections of the MongoDB data store.
+# Structure-> passports: one document per DPP, with _id = DPP ID. The searchable fields are
+#   top-level fields (like the columns of the SQLite store), tags holds the distinct tags,
+#   subpassports the ordered subpassport IDs, attachments the listed attachment IDs (also kept
+#   in document). name_trigrams holds the trigrams of name_text (see TrigramIndex), so substring
+#   searches are narrowed down by an index before the text is matched. The remaining fields are kept as encoded JSON in
+#   document, as DPP attributes may contain keys that are not valid MongoDB field names.
+#   sequence is the insertion number, which orders search results.
+# Structure-> events: one document per event, with _id = event ID and its parsed timestamp.
+# Structure-> dpp_events: references from DPPs to events, with the epoch of the event and a
+#   link number, so timelines are read in order from an index. Ties keep the order of linking.
+# Structure-> counters: sequence counters for passports and links.
+#
+# All reads and writes go through the connection pool of the MongoClient. Writes are not
+# transactional (transactions need a replica set), but every single-document write is atomic.
+
+
+class MongoStore(BaseDataStore):
+    # Number of encoded DPP responses kept in the response cache.
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
+    # Number of documents read per query when iterating over search results.
+    SEARCH_PAGE_SIZE = 500
+    # Fields of a DigitalProductPassport that are kept in their own fields or collections
+    # instead of the JSON document of the passport.
+    DOCUMENT_EXCLUDED_FIELDS = ("parent", "subpassports", "events")
+    # Indexes per collection, created at startup.
+    INDEXES = {
+        "passports": [
+            ([("sequence", 1)], {"unique": True}),
+            ([("passport_type", 1), ("sequence", 1)], {}),
+            ([("tags", 1), ("sequence", 1)], {}),
+            ([("batch_id", 1), ("sequence", 1)], {}),
+            ([("registration_id", 1)], {}),
+            ([("current_country_code", 1)], {}),
+            ([("origin_country_code", 1)], {}),
+            ([("creation_epoch", -1), ("sequence", 1)], {}),
+            ([("subpassports", 1)], {}),
+            ([("attachments", 1)], {}),
+            ([("name_trigrams", 1), ("sequence", 1)], {}),
+        ],
+        "events": [([("type", 1)], {})],
+        "dpp_events": [
+            ([("dpp_id", 1), ("event_type", 1), ("event_id", 1)], {"unique": True}),
+            ([("dpp_id", 1), ("epoch", 1), ("event_type", 1), ("link", 1)], {}),
+            ([("event_id", 1)], {}),
+        ],
+    }
+
+    def __init__(
+        self,
+        mongodb_config: Dict,
+        identity_config: Dict,
+        attachment_store: BaseAttachmentStore,
+        reset: bool = False,
+        client: Any = None,
+    ):
+        self.attachment_store_ref = attachment_store
+        self.identity_config_ref = identity_config
+        # A client can be passed in, such as a mongomock.MongoClient for tests.
+        if client is None:
+            if pymongo is None:
+                raise Exception("pymongo is required for the mongodb data store.")
+            client = pymongo.MongoClient(
+                mongodb_config["path"],
+                username=mongodb_config.get("username", None),
+                password=mongodb_config.get("password", None),
+                maxPoolSize=mongodb_config.get("pool_size", 100),
+            )
+        self.client = client
+        self.database = client[mongodb_config["database"]]
+        self.passports = self.database["passports"]
+        self.events = self.database["events"]
+        self.dpp_events = self.database["dpp_events"]
+        self.counters = self.database["counters"]
+        # Versions live in the database, so cached responses stay valid across processes.
+        self.response_cache = ResponseCache(self.RESPONSE_CACHE_MAX_ENTRIES)
+
+        if reset:
+            logger.debug("Found existing data, permanently deleting existing data.")
+            for collection in [self.dpp_events, self.events, self.passports]:
+                collection.delete_many({})
+            self.counters.delete_many({})
+        for collection_name, indexes in self.INDEXES.items():
+            for keys, options in indexes:
+                self.database[collection_name].create_index(keys, **options)
+
+    @staticmethod
+    def get_name_trigrams(name_text: str) -> List[str]:
+        return sorted(
+            {
+                trigram
+                for text in name_text.split(TrigramIndex.TEXT_SEPARATOR)
+                for trigram in TrigramIndex.trigrams(text)
+            }
+        )
+
+    # Reserve count consecutive numbers of a counter, returns the first one.
+    def reserve_sequence(self, name: str, count: int = 1) -> int:
+        counter = self.counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=True,
+        )
+        return counter["value"] - count + 1
+
+    def close(self) -> None:
+        self.client.close()
+
+    def get_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> Dict:
+        return deserialize_dpp(
+            document_id,
+            self,
+            self.attachment_store_ref,
+            content_format,
+            format,
+            signature_format,
+        )
+
+    def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        cache_key = (document_id, content_format, format, signature_format)
+        version = self.get_dpp_version(document_id)
+        content = self.response_cache.get(cache_key, version)
+        if content is None:
+            content = encode_json(
+                self.get_dpp_document(
+                    document_id, content_format, format, signature_format
+                )
+            )
+            self.response_cache.put(cache_key, version, content)
+        return content
+
+    def get_dpp_version(self, document_id: str) -> int:
+        passport = self.passports.find_one({"_id": document_id}, {"version": 1})
+        return passport["version"] if passport is not None else 0
+
+    def get_dpp_last_modified(self, document_id: str) -> datetime | None:
+        passport = self.passports.find_one({"_id": document_id}, {"modified_at": 1})
+        if passport is None or not passport.get("modified_at", None):
+            return None
+        return datetime.fromisoformat(passport["modified_at"])
+
+    def get_response_cache_metrics(self) -> Dict:
+        return self.response_cache.to_dict()
+
+    def get_dpp_object(self, document_id: str) -> DigitalProductPassport | None:
+        passport = self.passports.find_one(
+            {"_id": document_id}, {"parent": 1, "subpassports": 1, "document": 1}
+        )
+        if passport is None:
+            return None
+        events: Dict[str, List[str]] = {"activity": [], "ownership": []}
+        for link in self.dpp_events.find(
+            {"dpp_id": document_id}, {"event_type": 1, "event_id": 1}
+        ).sort([("epoch", 1), ("event_type", 1), ("link", 1)]):
+            events.setdefault(link["event_type"], []).append(link["event_id"])
+        return DigitalProductPassport(
+            **decode_json(passport["document"]),
+            parent=passport.get("parent", None),
+            subpassports=list(passport.get("subpassports", [])),
+            events=events,
+        )
+
+    def get_maximum_sequence(self) -> int:
+        passport = self.passports.find_one({}, {"sequence": 1}, sort=[("sequence", -1)])
+        return passport["sequence"] if passport is not None else 0
+
+    def get_random_dpp_document_id(self) -> str | None:
+        maximum_sequence = self.get_maximum_sequence()
+        if not maximum_sequence:
+            return None
+        passport = self.passports.find_one(
+            {"sequence": {"$gte": random.randint(1, maximum_sequence)}},
+            {"_id": 1},
+            sort=[("sequence", 1)],
+        )
+        return passport["_id"] if passport is not None else None
+
+    # Latest by creation_timestamp, DPPs without one are not considered.
+    def get_latest_added_dpp_document_id(self) -> str | None:
+        latest_dpp_ids = self.get_latest_added_dpp_document_ids(1)
+        return latest_dpp_ids[0] if latest_dpp_ids else None
+
+    def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        if n <= 0:
+            return []
+        passports = (
+            self.passports.find({"creation_epoch": {"$ne": None}}, {"_id": 1})
+            .sort([("creation_epoch", -1), ("sequence", 1)])
+            .limit(n)
+        )
+        return [passport["_id"] for passport in passports]
+
+    def get_dpp_database_metadata(self) -> Dict:
+        return {
+            "total_dpp_documents": self.passports.count_documents({}),
+            "total_templates": 0,
+            "total_events": self.events.count_documents({}),
+        }
+
+    def instantiate_dpp(
+        self, template_id: str, data_mapping: Dict, template_version="latest"
+    ) -> str:
+        raise NotImplementedError
+
+    # TODO: Implement robust DPP instantiation and validation.
+    def add_dpp_document(
+        self,
+        document_id: str,
+        dpp_document: Dict,
+        template_id: str | None = None,
+        template_version: str | None = "latest",
+    ) -> None:
+        import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+
+    def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        for dpp_document in dpp_documents:
+            import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+
+    def update_dpp_document(self, document_id: str, dpp_document: str) -> None:
+        raise NotImplementedError
+
+    def add_dpp_object(
+        self, document_id: str, dpp_object: DigitalProductPassport
+    ) -> None:
+        document = {
+            field.name: getattr(dpp_object, field.name)
+            for field in fields(DigitalProductPassport)
+            if field.name not in self.DOCUMENT_EXCLUDED_FIELDS
+        }
+        name_text = TrigramIndex.TEXT_SEPARATOR.join(
+            text.lower() for text in (dpp_object.id, dpp_object.title) if text
+        )
+        passport = {
+            "passport_type": dpp_object.passport_type,
+            "batch_id": dpp_object.batch_id,
+            "registration_id": dpp_object.registration_id or None,
+            "current_country_code": (
+                InMemoryStore.get_country_code(dpp_object.current_owner)
+                if dpp_object.current_owner
+                else None
+            ),
+            "origin_country_code": (
+                InMemoryStore.get_country_code(dpp_object.manufacturer)
+                if dpp_object.manufacturer
+                else None
+            ),
+            "name_text": name_text,
+            "name_trigrams": self.get_name_trigrams(name_text),
+            "creation_epoch": timestamp_to_epoch(dpp_object.creation_timestamp),
+            "parent": dpp_object.parent,
+            "tags": list(dict.fromkeys(dpp_object.tags)),
+            "subpassports": list(dpp_object.subpassports),
+            "attachments": list(dpp_object.attachments),
+            "document": encode_json(document).decode("utf-8"),
+        }
+        if self.passports.find_one({"_id": document_id}, {"_id": 1}) is not None:
+            # Replacing a DPP changes the path of its former parent as well.
+            self.mark_dpp_changed(document_id)
+            self.passports.update_one({"_id": document_id}, {"$set": passport})
+        else:
+            passport["sequence"] = self.reserve_sequence("passports")
+            passport["version"] = 0
+            self.passports.update_one(
+                {"_id": document_id}, {"$set": passport}, upsert=True
+            )
+
+        # Register references to known events, in timestamp order.
+        self.dpp_events.delete_many({"dpp_id": document_id})
+        self.link_events(
+            document_id,
+            [
+                (event_id, event_type)
+                for event_type, event_id_list in dpp_object.events.items()
+                for event_id in event_id_list
+            ],
+        )
+
+        if dpp_object.subpassports:
+            self.passports.update_many(
+                {"_id": {"$in": list(dpp_object.subpassports)}},
+                {"$set": {"parent": document_id}},
+            )
+        self.mark_dpp_changed(document_id, *dpp_object.subpassports)
+
+    # Register a change to DPPs, by bumping the version of the DPPs and all of their ancestors:
+    # every DPP listing one as subpassport, and its parent. Visited DPPs are not walked again,
+    # which guards against cycles.
+    def mark_dpp_changed(self, *document_ids: str) -> None:
+        visited: Set[str] = set()
+        frontier = {document_id for document_id in document_ids if document_id}
+        while frontier:
+            visited |= frontier
+            ancestor_ids: Set[str] = set()
+            for passport in self.passports.find(
+                {
+                    "$or": [
+                        {"_id": {"$in": list(frontier)}},
+                        {"subpassports": {"$in": list(frontier)}},
+                    ]
+                },
+                {"parent": 1, "subpassports": 1},
+            ):
+                if passport.get("parent", None):
+                    ancestor_ids.add(passport["parent"])
+                if frontier.intersection(passport.get("subpassports", [])):
+                    ancestor_ids.add(passport["_id"])
+            frontier = ancestor_ids - visited
+        self.passports.update_many(
+            {"_id": {"$in": list(visited)}},
+            {
+                "$inc": {"version": 1},
+                "$set": {"modified_at": datetime.now(timezone.utc).isoformat()},
+            },
+        )
+
+    # Reference known events from a DPP, in a single bulk write. Returns the number of new
+    # references; unknown events and existing references are skipped.
+    def link_events(self, document_id: str, links: List[Tuple[str, str]]) -> int:
+        links = list(dict.fromkeys(links))
+        if not links:
+            return 0
+        event_ids = list({event_id for event_id, _ in links})
+        epochs = {
+            event["_id"]: event["epoch"]
+            for event in self.events.find({"_id": {"$in": event_ids}}, {"epoch": 1})
+        }
+        existing_links = {
+            (link["event_id"], link["event_type"])
+            for link in self.dpp_events.find(
+                {"dpp_id": document_id, "event_id": {"$in": event_ids}},
+                {"event_id": 1, "event_type": 1},
+            )
+        }
+        new_links = [
+            (event_id, event_type)
+            for event_id, event_type in links
+            if event_id in epochs and (event_id, event_type) not in existing_links
+        ]
+        if not new_links:
+            return 0
+        first_link = self.reserve_sequence("links", len(new_links))
+        try:
+            self.dpp_events.insert_many(
+                [
+                    {
+                        "dpp_id": document_id,
+                        "event_type": event_type,
+                        "event_id": event_id,
+                        "epoch": epochs[event_id],
+                        "link": first_link + position,
+                    }
+                    for position, (event_id, event_type) in enumerate(new_links)
+                ],
+                ordered=False,
+            )
+        except pymongo.errors.BulkWriteError as e:
+            # A concurrent writer added some of the references already.
+            return e.details.get("nInserted", 0)
+        return len(new_links)
+
+    @staticmethod
+    def event_types(event_type: str) -> List[str]:
+        if event_type == EventFilterFormats.ALL.value:
+            return [
+                EventFilterFormats.ACTIVITY.value,
+                EventFilterFormats.OWNERSHIP.value,
+            ]
+        return [event_type]
+
+    @staticmethod
+    def epoch_range(since: datetime | None, until: datetime | None) -> Dict:
+        epoch_range = {}
+        if since is not None:
+            epoch_range["$gte"] = datetime_to_epoch(since)
+        if until is not None:
+            epoch_range["$lte"] = datetime_to_epoch(until)
+        return epoch_range
+
+    # Event documents in the order of the given IDs.
+    def get_events_in_order(self, event_ids: List[str]) -> List[Dict]:
+        documents = {
+            event["_id"]: event["document"]
+            for event in self.events.find({"_id": {"$in": event_ids}}, {"document": 1})
+        }
+        return [
+            decode_json(documents[event_id])
+            for event_id in event_ids
+            if event_id in documents
+        ]
+
+    def get_dpp_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = EventFilterFormats.ACTIVITY.value,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> List[Dict]:
+        # With all event types, activity events come first on equal timestamps.
+        link_filter: Dict[str, Any] = {
+            "dpp_id": document_id,
+            "event_type": {"$in": self.event_types(event_type)},
+        }
+        epoch_range = self.epoch_range(since, until)
+        if epoch_range:
+            link_filter["epoch"] = epoch_range
+        links = self.dpp_events.find(link_filter, {"event_id": 1}).sort(
+            [("epoch", 1), ("event_type", 1), ("link", 1)]
+        )
+        return self.get_events_in_order([link["event_id"] for link in links])
+
+    # IDs of a DPP and its (nested) subpassports.
+    def get_subtree_ids(self, document_id: str) -> Set[str]:
+        subtree_ids: Set[str] = set()
+        frontier = {document_id}
+        while frontier:
+            subtree_ids |= frontier
+            subpassport_ids: Set[str] = set()
+            for passport in self.passports.find(
+                {"_id": {"$in": list(frontier)}}, {"subpassports": 1}
+            ):
+                subpassport_ids.update(passport.get("subpassports", []))
+            frontier = subpassport_ids - subtree_ids
+        return subtree_ids
+
+    def get_dpp_full_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> List[Dict]:
+        # Events of the DPP and its (nested) subpassports, each event once.
+        link_filter: Dict[str, Any] = {
+            "dpp_id": {"$in": list(self.get_subtree_ids(document_id))},
+            "event_type": {"$in": self.event_types(event_type)},
+        }
+        epoch_range = self.epoch_range(since, until)
+        if epoch_range:
+            link_filter["epoch"] = epoch_range
+        event_ids = []
+        seen_event_ids: Set[str] = set()
+        for link in self.dpp_events.find(link_filter, {"event_id": 1}).sort(
+            [("epoch", 1), ("link", 1)]
+        ):
+            if link["event_id"] not in seen_event_ids:
+                seen_event_ids.add(link["event_id"])
+                event_ids.append(link["event_id"])
+        return self.get_events_in_order(event_ids)
+
+    @staticmethod
+    def get_id_value(obj):
+        return InMemoryStore.get_id_value(obj)
+
+    @staticmethod
+    def get_event_type(event: Dict):
+        return InMemoryStore.get_event_type(event)
+
+    # Add ID if event has no ID.
+    def add_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> str | None:
+        return self.add_dpp_events(document_id, [event], [event_type])[0]
+
+    # Events and references are written with one bulk write each.
+    def add_dpp_events(
+        self, document_id: str, event_list: List[Dict], event_type: List[str] | None
+    ) -> List[str | None]:
+        if event_type is None:
+            event_type = ["activity" for i in range(len(event_list))]
+        event_ids: List[str | None] = []
+        for event in event_list:
+            try:
+                event_ids.append(self.get_id_value(event))
+            except:
+                event_ids.append(str(uuid.uuid4()))
+                event["id"] = event_ids[-1]
+        if not event_list:
+            return event_ids
+
+        # Existing events are kept, only references are added for them. Unordered inserts
+        # continue past duplicate IDs.
+        try:
+            added = len(
+                self.events.insert_many(
+                    [
+                        {
+                            "_id": event_id,
+                            "type": self.get_event_type(event),
+                            "epoch": InMemoryStore.extract_event_epoch(event),
+                            "document": encode_json(event).decode("utf-8"),
+                        }
+                        for event_id, event in zip(event_ids, event_list)
+                    ],
+                    ordered=False,
+                ).inserted_ids
+            )
+        except pymongo.errors.BulkWriteError as e:
+            added = e.details.get("nInserted", 0)
+        logger.debug(
+            f"Events added-> {added}, already present-> {len(event_list) - added}"
+        )
+
+        if self.passports.find_one({"_id": document_id}, {"_id": 1}) is None:
+            logger.warning(
+                "Adding events -> "
+                + ", ".join(map(str, event_ids))
+                + " with unknown DPP reference -> "
+                + document_id
+            )
+        elif self.link_events(document_id, list(zip(event_ids, event_type))):
+            self.mark_dpp_changed(document_id)
+        return event_ids
+
+    def update_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> None:
+        event_id = self.get_id_value(event)
+        event_epoch = InMemoryStore.extract_event_epoch(event)
+        existing_event = self.events.find_one_and_update(
+            {"_id": event_id},
+            {
+                "$set": {
+                    "type": self.get_event_type(event),
+                    "epoch": event_epoch,
+                    "document": encode_json(event).decode("utf-8"),
+                }
+            },
+            {"epoch": 1},
+        )
+        if existing_event is None:
+            raise Exception("Event not found to update.")
+        links = list(
+            self.dpp_events.find({"event_id": event_id}, {"dpp_id": 1}).sort("link", 1)
+        )
+        if links and event_epoch != existing_event["epoch"]:
+            # Reposition the event in every DPP referencing it, as if linked again.
+            first_link = self.reserve_sequence("links", len(links))
+            for position, link in enumerate(links):
+                self.dpp_events.update_one(
+                    {"_id": link["_id"]},
+                    {"$set": {"epoch": event_epoch, "link": first_link + position}},
+                )
+        # Responses embed the event content, so every referencing DPP changed.
+        self.mark_dpp_changed(*{link["dpp_id"] for link in links})
+
+    def delete_dpp_event(
+        self, document_id: str, event_id: str, event_type: str = "activity"
+    ) -> None:
+        if not self.events.delete_one({"_id": event_id}).deleted_count:
+            raise Exception("Event not found to delete.")
+        # Remove the references from DPPs as well, no dangling IDs remain.
+        linked_document_ids = self.dpp_events.distinct("dpp_id", {"event_id": event_id})
+        self.dpp_events.delete_many({"event_id": event_id})
+        self.mark_dpp_changed(*linked_document_ids)
+
+    def get_event(self, event_id: str) -> Dict | None:
+        event = self.events.find_one({"_id": event_id}, {"document": 1})
+        return decode_json(event["document"]) if event is not None else None
+
+    def attach_subpassport_by_id(self, document_id: str, subpassport_id: str) -> None:
+        if self.passports.find_one({"_id": document_id}, {"_id": 1}) is None:
+            raise Exception("DPP not available -> " + document_id)
+        if self.passports.find_one({"_id": subpassport_id}, {"_id": 1}) is None:
+            raise Exception("Subpassport not available -> " + subpassport_id)
+        # The subpassport changes, along with the path of its former parent.
+        self.mark_dpp_changed(subpassport_id)
+        self.passports.update_one(
+            {"_id": document_id}, {"$push": {"subpassports": subpassport_id}}
+        )
+        self.passports.update_one(
+            {"_id": subpassport_id}, {"$set": {"parent": document_id}}
+        )
+        self.mark_dpp_changed(document_id)
+
+    # The attachment store already applied the change; the passports only list the attachment.
+    def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: AttachmentReference | None,
+        document_id: str | None = None,
+    ) -> None:
+        if document_id and attachment_reference is not None:
+            self.update_listed_attachments(
+                {"_id": document_id, "attachments": {"$ne": attachment_id}},
+                lambda attachments: attachments + [attachment_id],
+            )
+        listing_dpp_ids = self.passports.distinct("_id", {"attachments": attachment_id})
+        if attachment_reference is None:
+            self.update_listed_attachments(
+                {"attachments": attachment_id},
+                lambda attachments: [
+                    listed_id for listed_id in attachments if listed_id != attachment_id
+                ],
+            )
+        self.mark_dpp_changed(*listing_dpp_ids)
+
+    # Rewrite the attachment list of the matching passports, in its field and in the document.
+    def update_listed_attachments(
+        self, query: Dict, update: Callable[[List[str]], List[str]]
+    ) -> None:
+        for passport in self.passports.find(query, {"document": 1}):
+            document = decode_json(passport["document"])
+            document["attachments"] = update(document.get("attachments", []))
+            self.passports.update_one(
+                {"_id": passport["_id"]},
+                {
+                    "$set": {
+                        "attachments": document["attachments"],
+                        "document": encode_json(document).decode("utf-8"),
+                    }
+                },
+            )
+
+    def attach_subpassport(self, document_id: str, subpassport_document: Dict) -> None:
+        subpassport_id = self.get_id_value(subpassport_document)
+        self.add_dpp_document(subpassport_id, subpassport_document)
+        self.attach_subpassport_by_id(document_id, subpassport_id)
+
+    def detach_subpassport_by_id(self, document_id: str, subpassport_id: str) -> None:
+        dpp = self.passports.find_one({"_id": document_id}, {"subpassports": 1})
+        if dpp is None:
+            raise Exception("DPP not available -> " + document_id)
+        subdpp = self.passports.find_one({"_id": subpassport_id}, {"parent": 1})
+        if subdpp is None:
+            raise Exception("Subpassport not available -> " + subpassport_id)
+        if subpassport_id not in dpp.get("subpassports", []) and (
+            subdpp.get("parent", None) != document_id
+        ):
+            raise Exception("Subpassport already not attached")
+        # Mark before the edge is removed, so the former ancestors are found.
+        self.mark_dpp_changed(subpassport_id)
+        self.passports.update_one(
+            {"_id": document_id}, {"$pull": {"subpassports": subpassport_id}}
+        )
+        self.passports.update_one({"_id": subpassport_id}, {"$set": {"parent": ""}})
+        self.mark_dpp_changed(document_id, subpassport_id)
+        logger.debug(
+            "Subpassport detached from -> "
+            + document_id
+            + ", not removed ->"
+            + subpassport_id
+        )
+
+    # Query on passports for the filters, with the same semantics as
+    # InMemoryStore.filter_candidate_sets. Missing fields match None in MongoDB queries.
+    @staticmethod
+    def filter_query(filters: FilterConditions | None) -> Dict[str, Any]:
+        conditions: List[Dict[str, Any]] = []
+        if filters is None:
+            return {}
+
+        if filters.passport_type:
+            conditions.append({"passport_type": {"$in": list(filters.passport_type)}})
+
+        # All tags need to be present
+        if filters.tags:
+            conditions.append({"tags": {"$all": list(set(filters.tags))}})
+
+        if filters.batch_ids:
+            conditions.append({"batch_id": {"$in": list(filters.batch_ids)}})
+
+        # Substring match, DPPs without registration_id are not excluded
+        if filters.registration_id:
+            conditions.append(
+                {
+                    "$or": [
+                        {"registration_id": None},
+                        {
+                            "registration_id": {
+                                "$regex": re.escape(filters.registration_id)
+                            }
+                        },
+                    ]
+                }
+            )
+
+        # DPPs without current owner/manufacturer are not excluded
+        if filters.current_country_codes:
+            conditions.append(
+                {
+                    "current_country_code": {
+                        "$in": list(filters.current_country_codes) + [None]
+                    }
+                }
+            )
+        if filters.origin_country_codes:
+            conditions.append(
+                {
+                    "origin_country_code": {
+                        "$in": list(filters.origin_country_codes) + [None]
+                    }
+                }
+            )
+
+        # Passports with all trigrams of the substring are read from the index, and the
+        # substring is matched in their text. Substrings shorter than a trigram are only
+        # matched, after the other conditions narrowed down the candidates.
+        if filters.name_contains:
+            needle = filters.name_contains.lower()
+            if len(needle) >= TrigramIndex.GRAM_SIZE:
+                conditions.append(
+                    {"name_trigrams": {"$all": sorted(TrigramIndex.trigrams(needle))}}
+                )
+            conditions.append({"name_text": {"$regex": re.escape(needle)}})
+
+        return {"$and": conditions} if conditions else {}
+
+    def search_for_dpp(self, filters: FilterConditions) -> List[Dict[str, str]]:
+        return list(self.search_for_dpp_iterator(filters))
+
+    # Results in insertion order, read page by page (keyset pagination on sequence), so no
+    # cursor is held open while the results are consumed.
+    def search_for_dpp_iterator(
+        self, filters: FilterConditions, after_document_id: str | None = None
+    ) -> Iterator[Dict[str, str]]:
+        if after_document_id is None:
+            last_sequence = 0
+        else:
+            passport = self.passports.find_one(
+                {"_id": after_document_id}, {"sequence": 1}
+            )
+            if passport is None:
+                raise KeyError(
+                    "Unknown DPP to continue search from -> " + after_document_id
+                )
+            last_sequence = passport["sequence"]
+
+        query = self.filter_query(filters)
+        while True:
+            passports = list(
+                self.passports.find(
+                    {"$and": [{"sequence": {"$gt": last_sequence}}, query]},
+                    {"sequence": 1},
+                )
+                .sort("sequence", 1)
+                .limit(self.SEARCH_PAGE_SIZE)
+            )
+            for passport in passports:
+                last_sequence = passport["sequence"]
+                yield {"label": passport["_id"], "value": passport["_id"]}
+            if len(passports) < self.SEARCH_PAGE_SIZE:
+                return
+
+    # Sample up to count distinct DPP IDs matching the filters, sampled by the server.
+    def sample_dpp_document_ids(
+        self, count: int, filters: FilterConditions | None = None
+    ) -> List[str]:
+        if count <= 0:
+            return []
+        pipeline: List[Dict[str, Any]] = []
+        query = self.filter_query(filters)
+        if query:
+            pipeline.append({"$match": query})
+        pipeline += [{"$sample": {"size": count}}, {"$project": {"_id": 1}}]
+        sampled_ids = [
+            passport["_id"] for passport in self.passports.aggregate(pipeline)
+        ]
+        # $sample may return duplicates on large collections.
+        return list(dict.fromkeys(sampled_ids))
+
+    # TODO: Handle updating events independently
+    def update_event(self, event_id: str, event: Dict) -> None:
+        raise NotImplementedError
+
+    # TODO: Handle deleting events independently.
+    def delete_event(self, event_id: str) -> None:
+        raise NotImplementedError
+
+    def get_event_metadata(self) -> Dict:
+        return {"total_events": self.events.count_documents({})}
+
+    # TODO: Handle all DPP template endpoints
+    def get_dpp_template(self, template_id: str, version="latest") -> Dict:
+        raise NotImplementedError
+
+    def add_dpp_template(self, template_id: str, json_schema: str) -> str:
+        raise NotImplementedError
+
+    def publish_dpp_template(self, template_id: str, version: str) -> None:
+        raise NotImplementedError
+
+    def update_dpp_template(self, template_id: str) -> None:
+        raise NotImplementedError
+
+    def get_dpp_template_versions_with_metadata(self, template_id: str) -> Dict:
+        raise NotImplementedError
+
+    def get_dpp_template_ids_with_metadata(self) -> Dict:
+        raise NotImplementedError
+
+
+# Statistics are aggregated by the database, using the indexes of the MongoStore.
+class MongoStoreStatistics(BaseStoreStatistics):
+    MAX_HISTOGRAM_BUCKETS = 10000
+
+    def __init__(self, store: MongoStore):
+        self.store = store
+
+    def count_by(self, field: str, unwind: bool = False) -> Dict[Any, int]:
+        pipeline: List[Dict[str, Any]] = []
+        if unwind:
+            pipeline.append({"$unwind": "$" + field})
+        pipeline.append({"$group": {"_id": "$" + field, "count": {"$sum": 1}}})
+        return {
+            group["_id"]: group["count"]
+            for group in self.store.passports.aggregate(pipeline)
+        }
+
+    def passports_by_batch(self) -> Dict[str, int]:
+        batches: Dict[str, int] = {}
+        for batch_id, count in self.count_by("batch_id").items():
+            batch_key = batch_id if batch_id else "undefined"
+            batches[batch_key] = batches.get(batch_key, 0) + count
+        return batches
+
+    def number_of_batches(self) -> int:
+        return len(self.passports_by_batch())
+
+    def number_of_unique_tags(self) -> int:
+        return len(self.passports_by_tag())
+
+    def passports_by_tag(self) -> Dict[str, int]:
+        return self.count_by("tags", unwind=True)
+
+    def passports_by_type(self) -> Dict[str, int]:
+        return self.count_by("passport_type")
+
+    def number_of_single_passports(self) -> int:
+        return self.passports_created_all_time() - self.number_of_connected_passports()
+
+    # Connected passports have a parent or subpassports.
+    def number_of_connected_passports(self) -> int:
+        return self.store.passports.count_documents(
+            {
+                "$or": [
+                    {"parent": {"$nin": [None, ""]}},
+                    {"subpassports.0": {"$exists": True}},
+                ]
+            }
+        )
+
+    def passports_created_in_time_range(
+        self, start_time: datetime, end_time: datetime
+    ) -> int:
+        return self.store.passports.count_documents(
+            {
+                "creation_epoch": {
+                    "$gte": datetime_to_epoch(start_time),
+                    "$lte": datetime_to_epoch(end_time),
+                }
+            }
+        )
+
+    def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        if interval not in [i.value for i in CreationHistogramIntervals]:
+            raise ValueError("Unknown histogram interval -> " + interval)
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+
+        # The creation times in range are read once, in order, and counted per bucket.
+        epochs = [
+            passport["creation_epoch"]
+            for passport in self.store.passports.find(
+                {
+                    "creation_epoch": {
+                        "$gte": start_time.timestamp(),
+                        "$lte": end_time.timestamp(),
+                    }
+                },
+                {"creation_epoch": 1, "_id": 0},
+            ).sort("creation_epoch", 1)
+        ]
+
+        # Buckets are aligned like InMemoryStoreStatistics.passports_created_histogram.
+        histogram = []
+        bucket_start = InMemoryStoreStatistics.start_of_interval(start_time, interval)
+        while bucket_start <= end_time:
+            if len(histogram) >= self.MAX_HISTOGRAM_BUCKETS:
+                raise ValueError("Too many histogram buckets requested.")
+            bucket_end = InMemoryStoreStatistics.start_of_next_interval(
+                bucket_start, interval
+            )
+            start_position = bisect_left(
+                epochs, max(bucket_start, start_time).timestamp()
+            )
+            if bucket_end > end_time:
+                end_position = bisect_right(epochs, end_time.timestamp())
+            else:
+                end_position = bisect_left(epochs, bucket_end.timestamp())
+            histogram.append(
+                {
+                    "start": bucket_start.isoformat(),
+                    "end": bucket_end.isoformat(),
+                    "count": max(end_position - start_position, 0),
+                }
+            )
+            bucket_start = bucket_end
+        return histogram
+
+    def passports_created_last_day(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=1), now)
+
+    def passports_created_last_week(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(weeks=1), now)
+
+    def passports_created_last_month(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=30), now)
+
+    def passports_created_last_year(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=365), now)
+
+    def passports_created_last_5_years(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=365 * 5), now)
+
+    def passports_created_all_time(self) -> int:
+        return self.store.passports.count_documents({})
+
+    def events_all_time(self) -> int:
+        return self.store.events.count_documents({})
+
+    def number_per_event_type(self) -> Dict[str, int]:
+        return {
+            group["_id"]: group["count"]
+            for group in self.store.events.aggregate(
+                [{"$group": {"_id": "$type", "count": {"$sum": 1}}}]
+            )
+        }
+
+    def to_dict(self):
+        passport_stats = {}
+        passport_stats["passports_by_batch"] = self.passports_by_batch()
+        passport_stats["number_batches"] = self.number_of_batches()
+        passport_stats["passports_by_tag"] = self.passports_by_tag()
+        passport_stats["number_tags"] = self.number_of_unique_tags()
+        passport_stats["passports_by_type"] = self.passports_by_type()
+        passport_stats["number_single_passports"] = self.number_of_single_passports()
+        passport_stats["number_connected_passports"] = (
+            self.number_of_connected_passports()
+        )
+        passport_stats["passports_created_last_day"] = self.passports_created_last_day()
+        passport_stats["passports_created_last_week"] = (
+            self.passports_created_last_week()
+        )
+        passport_stats["passports_created_last_month"] = (
+            self.passports_created_last_month()
+        )
+        passport_stats["passports_created_last_year"] = (
+            self.passports_created_last_year()
+        )
+        passport_stats["passports_created_last_5_years"] = (
+            self.passports_created_last_5_years()
+        )
+        passport_stats["passports_created_all_time"] = self.passports_created_all_time()
+        passport_stats["total_dpp_documents"] = (self.passports_created_all_time(),)
+
+        event_stats = {}
+        event_stats["events_all_time"] = self.events_all_time()
+        event_stats["number_event_types"] = self.number_per_event_type()
+        return {"passport": passport_stats, "event": event_stats}
@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+
+# Bounded LRU cache of encoded DPP responses.
+# Structure-> entries[key] = (version, encoded content), where key starts with the DPP ID.
+# Entries are validated against the current version of the DPP on every read, so a change
+# to a DPP only invalidates the responses built from it. Stale entries are replaced on the
+# next miss, or evicted as least recently used. Lookups may come from several threads at once.
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, Tuple[int, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int) -> bytes | None:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, content: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (version, content)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def to_dict(self) -> Dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
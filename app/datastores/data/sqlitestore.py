@@ -0,0 +1,1184 @@
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from dataclasses import fields
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+from app.datamodel.attachment import AttachmentReference
+from app.datamodel.dpp import DigitalProductPassport
+from app.datamodel.encoding import decode_json, encode_json
+from app.datamodel.serde import deserialize_dpp, import_dpp_into_storage
+from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.data.basedatastore import (
+    BaseDataStore,
+    BaseStoreStatistics,
+    CreationHistogramIntervals,
+    DPPResponseContentFormats,
+    DPPResponseFormats,
+    DPPResponseSignatureFormats,
+    EventFilterFormats,
+    FilterConditions,
+)
+from app.datastores.data.inmemorystore import (
+    InMemoryStore,
+    InMemoryStoreStatistics,
+    datetime_to_epoch,
+    timestamp_to_epoch,
+)
+from app.datastores.data.responsecache import ResponseCache
+
+logger = logging.getLogger("sqlite-data")
+
+# Tables of the SQLite data store. The database runs in WAL mode, so readers are not blocked
+# by the (single) writer.
+# Structure-> passports: one row per DPP. The searchable fields are columns, the remaining
+#   fields are a JSON document. sequence is the insertion number, which orders search results.
+#   The country code columns are NULL for DPPs without current owner/manufacturer, as those
+#   are not excluded by the country code filters (see InMemoryStore.index_key_values).
+#   name_text holds the lowercased ID and title (one per line), for name_contains.
+# Structure-> passport_names: FTS5 trigram index over passports.name_text, for substrings.
+# Structure-> passport_tags: (tag, DPP ID) pairs.
+# Structure-> subpassport_edges: ordered subpassport IDs per DPP.
+# Structure-> passport_attachments: (attachment ID, DPP ID) pairs, the DPPs listing an
+#   attachment in their document.
+# Structure-> events: one row per event, with its parsed timestamp (epoch).
+# Structure-> dpp_events: references from DPPs to events. The epoch of the event is repeated,
+#   so timelines are read in timestamp order from an index. Ties keep the order of linking.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passports (
+    sequence INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    passport_type TEXT,
+    batch_id TEXT,
+    registration_id TEXT,
+    current_country_code TEXT,
+    origin_country_code TEXT,
+    name_text TEXT NOT NULL,
+    creation_epoch REAL,
+    parent TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    modified_at TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS passports_passport_type ON passports (passport_type);
+CREATE INDEX IF NOT EXISTS passports_batch_id ON passports (batch_id);
+CREATE INDEX IF NOT EXISTS passports_registration_id ON passports (registration_id);
+CREATE INDEX IF NOT EXISTS passports_current_country_code
+    ON passports (current_country_code);
+CREATE INDEX IF NOT EXISTS passports_origin_country_code
+    ON passports (origin_country_code);
+CREATE INDEX IF NOT EXISTS passports_creation_epoch ON passports (creation_epoch);
+CREATE INDEX IF NOT EXISTS passports_parent ON passports (parent);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS passport_names USING fts5 (
+    name_text, content='passports', content_rowid='sequence', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS passport_names_insert AFTER INSERT ON passports BEGIN
+    INSERT INTO passport_names (rowid, name_text) VALUES (new.sequence, new.name_text);
+END;
+CREATE TRIGGER IF NOT EXISTS passport_names_delete AFTER DELETE ON passports BEGIN
+    INSERT INTO passport_names (passport_names, rowid, name_text)
+        VALUES ('delete', old.sequence, old.name_text);
+END;
+CREATE TRIGGER IF NOT EXISTS passport_names_update AFTER UPDATE OF name_text ON passports
+BEGIN
+    INSERT INTO passport_names (passport_names, rowid, name_text)
+        VALUES ('delete', old.sequence, old.name_text);
+    INSERT INTO passport_names (rowid, name_text) VALUES (new.sequence, new.name_text);
+END;
+
+CREATE TABLE IF NOT EXISTS passport_tags (
+    tag TEXT NOT NULL,
+    dpp_id TEXT NOT NULL,
+    PRIMARY KEY (tag, dpp_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS passport_tags_dpp_id ON passport_tags (dpp_id);
+
+CREATE TABLE IF NOT EXISTS subpassport_edges (
+    dpp_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    subpassport_id TEXT NOT NULL,
+    PRIMARY KEY (dpp_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subpassport_edges_subpassport_id
+    ON subpassport_edges (subpassport_id);
+
+CREATE TABLE IF NOT EXISTS passport_attachments (
+    attachment_id TEXT NOT NULL,
+    dpp_id TEXT NOT NULL,
+    PRIMARY KEY (attachment_id, dpp_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS passport_attachments_dpp_id
+    ON passport_attachments (dpp_id);
+
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    epoch REAL NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_type ON events (type);
+
+CREATE TABLE IF NOT EXISTS dpp_events (
+    link INTEGER PRIMARY KEY,
+    dpp_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    epoch REAL NOT NULL,
+    UNIQUE (dpp_id, event_type, event_id)
+);
+CREATE INDEX IF NOT EXISTS dpp_events_timeline ON dpp_events (dpp_id, event_type, epoch);
+CREATE INDEX IF NOT EXISTS dpp_events_event_id ON dpp_events (event_id);
+"""
+
+# Tables in the order they are emptied on a reset.
+TABLES = [
+    "dpp_events",
+    "events",
+    "subpassport_edges",
+    "passport_attachments",
+    "passport_tags",
+    "passports",
+]
+
+
+# Pool of connections to a single database file, created on demand up to size.
+# Connections are shared across threads, but only used by one thread at a time. Every
+# connection keeps a cache of prepared statements, so the queries of the store are parsed
+# once per connection. All queries use parameters, never values formatted into the SQL.
+class SQLiteConnectionPool:
+    STATEMENT_CACHE_SIZE = 256
+
+    def __init__(self, path: str, size: int = 4, timeout: float = 30.0) -> None:
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.idle_connections: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self.connections: List[sqlite3.Connection] = []
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        # Autocommit mode, transactions are started explicitly by the store.
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.STATEMENT_CACHE_SIZE,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL only syncs at checkpoints, and the database stays consistent.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.connections) < self.size:
+                connection = self.connect()
+                self.connections.append(connection)
+                return connection
+        try:
+            return self.idle_connections.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception("No SQLite connection available -> " + self.path)
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        self.idle_connections.put(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
+        self.idle_connections = queue.LifoQueue()
+
+
+class SQLiteStore(BaseDataStore):
+    # Number of encoded DPP responses kept in the response cache.
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
+    # Number of rows read per query when iterating over search results.
+    SEARCH_PAGE_SIZE = 500
+    # Fields of a DigitalProductPassport that are kept in their own tables instead of the
+    # JSON document of the passport.
+    DOCUMENT_EXCLUDED_FIELDS = ("parent", "subpassports", "events")
+    # Separates the texts in name_text. FTS5 stops indexing a value at a NUL character, so
+    # the separator of the TrigramIndex is not used here.
+    NAME_TEXT_SEPARATOR = "\n"
+
+    def __init__(
+        self,
+        sqlite_config: Dict,
+        identity_config: Dict,
+        attachment_store: BaseAttachmentStore,
+        reset: bool = False,
+    ):
+        self.path = sqlite_config["path"]
+        self.attachment_store_ref = attachment_store
+        self.identity_config_ref = identity_config
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.pool = SQLiteConnectionPool(
+            self.path,
+            size=sqlite_config.get("pool_size", 4),
+            timeout=sqlite_config.get("timeout", 30.0),
+        )
+        # Writes are serialized within the process. Nested calls (such as the event additions
+        # of an import) join the transaction of their thread.
+        self.write_lock = threading.RLock()
+        self.transaction_state = threading.local()
+        # Versions live in the database, so cached responses stay valid across processes.
+        self.response_cache = ResponseCache(self.RESPONSE_CACHE_MAX_ENTRIES)
+
+        with self.pool.connection() as connection:
+            connection.executescript(SCHEMA)
+        if reset:
+            logger.debug("Found existing data, permanently deleting existing data.")
+            with self.transaction() as connection:
+                for table in TABLES:
+                    connection.execute("DELETE FROM " + table)
+                connection.execute(
+                    "INSERT INTO passport_names (passport_names) VALUES ('rebuild')"
+                )
+
+    # Connection for reads. Inside a transaction, this is the connection of the transaction,
+    # so reads see its uncommitted changes.
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = getattr(self.transaction_state, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        with self.pool.connection() as connection:
+            yield connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = getattr(self.transaction_state, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        with self.write_lock, self.pool.connection() as connection:
+            self.transaction_state.connection = connection
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                yield connection
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                self.transaction_state.connection = None
+
+    def fetch_all(self, query: str, parameters: Tuple | List = ()) -> List[Tuple]:
+        with self.connection() as connection:
+            return connection.execute(query, parameters).fetchall()
+
+    def fetch_one(self, query: str, parameters: Tuple | List = ()) -> Tuple | None:
+        with self.connection() as connection:
+            return connection.execute(query, parameters).fetchone()
+
+    def fetch_value(self, query: str, parameters: Tuple | List = ()) -> Any:
+        row = self.fetch_one(query, parameters)
+        return row[0] if row is not None else None
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def get_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> Dict:
+        return deserialize_dpp(
+            document_id,
+            self,
+            self.attachment_store_ref,
+            content_format,
+            format,
+            signature_format,
+        )
+
+    def get_encoded_dpp_document(
+        self,
+        document_id: str,
+        content_format: str = DPPResponseContentFormats.BASE.value,
+        format: str = DPPResponseFormats.JSON.value,
+        signature_format: str = DPPResponseSignatureFormats.UNSIGNED.value,
+    ) -> bytes:
+        cache_key = (document_id, content_format, format, signature_format)
+        version = self.get_dpp_version(document_id)
+        content = self.response_cache.get(cache_key, version)
+        if content is None:
+            content = encode_json(
+                self.get_dpp_document(
+                    document_id, content_format, format, signature_format
+                )
+            )
+            self.response_cache.put(cache_key, version, content)
+        return content
+
+    def get_dpp_version(self, document_id: str) -> int:
+        return (
+            self.fetch_value(
+                "SELECT version FROM passports WHERE id = ?", (document_id,)
+            )
+            or 0
+        )
+
+    def get_dpp_last_modified(self, document_id: str) -> datetime | None:
+        modified_at = self.fetch_value(
+            "SELECT modified_at FROM passports WHERE id = ?", (document_id,)
+        )
+        return datetime.fromisoformat(modified_at) if modified_at else None
+
+    def get_response_cache_metrics(self) -> Dict:
+        return self.response_cache.to_dict()
+
+    def get_dpp_object(self, document_id: str) -> DigitalProductPassport | None:
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT parent, document FROM passports WHERE id = ?", (document_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            subpassport_rows = connection.execute(
+                "SELECT subpassport_id FROM subpassport_edges WHERE dpp_id = ?"
+                " ORDER BY position",
+                (document_id,),
+            ).fetchall()
+            event_rows = connection.execute(
+                "SELECT event_type, event_id FROM dpp_events WHERE dpp_id = ?"
+                " ORDER BY event_type, epoch, link",
+                (document_id,),
+            ).fetchall()
+        events: Dict[str, List[str]] = {"activity": [], "ownership": []}
+        for event_type, event_id in event_rows:
+            events.setdefault(event_type, []).append(event_id)
+        return DigitalProductPassport(
+            **decode_json(row[1]),
+            parent=row[0],
+            subpassports=[subpassport_id for (subpassport_id,) in subpassport_rows],
+            events=events,
+        )
+
+    # DPP IDs are sequence numbers without gaps, as DPPs are never deleted.
+    def get_random_dpp_document_id(self) -> str | None:
+        maximum_sequence = self.fetch_value("SELECT MAX(sequence) FROM passports")
+        if maximum_sequence is None:
+            return None
+        return self.fetch_value(
+            "SELECT id FROM passports WHERE sequence >= ? ORDER BY sequence LIMIT 1",
+            (random.randint(1, maximum_sequence),),
+        )
+
+    # Latest by creation_timestamp, DPPs without one are not considered.
+    def get_latest_added_dpp_document_id(self) -> str | None:
+        latest_dpp_ids = self.get_latest_added_dpp_document_ids(1)
+        return latest_dpp_ids[0] if latest_dpp_ids else None
+
+    def get_latest_added_dpp_document_ids(self, n: int) -> List[str]:
+        rows = self.fetch_all(
+            "SELECT id FROM passports WHERE creation_epoch IS NOT NULL"
+            " ORDER BY creation_epoch DESC, sequence LIMIT ?",
+            (n,),
+        )
+        return [document_id for (document_id,) in rows]
+
+    def get_dpp_database_metadata(self) -> Dict:
+        return {
+            "total_dpp_documents": self.fetch_value("SELECT COUNT(*) FROM passports"),
+            "total_templates": 0,
+            "total_events": self.fetch_value("SELECT COUNT(*) FROM events"),
+        }
+
+    def instantiate_dpp(
+        self, template_id: str, data_mapping: Dict, template_version="latest"
+    ) -> str:
+        raise NotImplementedError
+
+    # TODO: Implement robust DPP instantiation and validation.
+    def add_dpp_document(
+        self,
+        document_id: str,
+        dpp_document: Dict,
+        template_id: str | None = None,
+        template_version: str | None = "latest",
+    ) -> None:
+        with self.transaction():
+            import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+
+    # A batch is imported in a single transaction.
+    def add_dpp_documents(self, dpp_documents: List[Dict]) -> None:
+        with self.transaction():
+            for dpp_document in dpp_documents:
+                import_dpp_into_storage(dpp_document, self, self.attachment_store_ref)
+
+    def update_dpp_document(self, document_id: str, dpp_document: str) -> None:
+        raise NotImplementedError
+
+    def add_dpp_object(
+        self, document_id: str, dpp_object: DigitalProductPassport
+    ) -> None:
+        document = {
+            field.name: getattr(dpp_object, field.name)
+            for field in fields(DigitalProductPassport)
+            if field.name not in self.DOCUMENT_EXCLUDED_FIELDS
+        }
+        name_text = self.NAME_TEXT_SEPARATOR.join(
+            text.lower() for text in (dpp_object.id, dpp_object.title) if text
+        )
+        with self.transaction() as connection:
+            if connection.execute(
+                "SELECT 1 FROM passports WHERE id = ?", (document_id,)
+            ).fetchone():
+                # Replacing a DPP changes the path of its former parent as well.
+                self.mark_dpp_changed(connection, document_id)
+            connection.execute(
+                "INSERT INTO passports (id, passport_type, batch_id, registration_id,"
+                " current_country_code, origin_country_code, name_text, creation_epoch,"
+                " parent, document) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET passport_type = excluded.passport_type,"
+                " batch_id = excluded.batch_id,"
+                " registration_id = excluded.registration_id,"
+                " current_country_code = excluded.current_country_code,"
+                " origin_country_code = excluded.origin_country_code,"
+                " name_text = excluded.name_text,"
+                " creation_epoch = excluded.creation_epoch,"
+                " parent = excluded.parent, document = excluded.document",
+                (
+                    document_id,
+                    dpp_object.passport_type,
+                    dpp_object.batch_id,
+                    dpp_object.registration_id or None,
+                    (
+                        InMemoryStore.get_country_code(dpp_object.current_owner)
+                        if dpp_object.current_owner
+                        else None
+                    ),
+                    (
+                        InMemoryStore.get_country_code(dpp_object.manufacturer)
+                        if dpp_object.manufacturer
+                        else None
+                    ),
+                    name_text,
+                    timestamp_to_epoch(dpp_object.creation_timestamp),
+                    dpp_object.parent,
+                    encode_json(document).decode("utf-8"),
+                ),
+            )
+
+            connection.execute(
+                "DELETE FROM passport_tags WHERE dpp_id = ?", (document_id,)
+            )
+            connection.executemany(
+                "INSERT INTO passport_tags (tag, dpp_id) VALUES (?, ?)",
+                [(tag, document_id) for tag in set(dpp_object.tags)],
+            )
+
+            # Register references to known events, in timestamp order.
+            connection.execute(
+                "DELETE FROM dpp_events WHERE dpp_id = ?", (document_id,)
+            )
+            for event_type, event_id_list in dpp_object.events.items():
+                for event_id in event_id_list:
+                    self.link_event(connection, document_id, event_id, event_type)
+
+            connection.execute(
+                "DELETE FROM passport_attachments WHERE dpp_id = ?", (document_id,)
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO passport_attachments (attachment_id, dpp_id)"
+                " VALUES (?, ?)",
+                [
+                    (attachment_id, document_id)
+                    for attachment_id in dpp_object.attachments
+                ],
+            )
+
+            connection.execute(
+                "DELETE FROM subpassport_edges WHERE dpp_id = ?", (document_id,)
+            )
+            connection.executemany(
+                "INSERT INTO subpassport_edges (dpp_id, position, subpassport_id)"
+                " VALUES (?, ?, ?)",
+                [
+                    (document_id, position, subpassport_id)
+                    for position, subpassport_id in enumerate(dpp_object.subpassports)
+                ],
+            )
+            self.mark_dpp_changed(connection, document_id)
+            for subpassport_id in dpp_object.subpassports:
+                connection.execute(
+                    "UPDATE passports SET parent = ? WHERE id = ?",
+                    (document_id, subpassport_id),
+                )
+                self.mark_dpp_changed(connection, subpassport_id)
+
+    # Register a change to a DPP, by bumping the version of the DPP and all of its ancestors:
+    # every DPP listing it as subpassport, and its parent. UNION (not UNION ALL) stops the
+    # walk at DPPs already visited, which guards against cycles.
+    def mark_dpp_changed(
+        self, connection: sqlite3.Connection, document_id: str
+    ) -> None:
+        connection.execute(
+            "WITH RECURSIVE ancestors (id) AS ("
+            " SELECT ? UNION"
+            " SELECT subpassport_edges.dpp_id FROM subpassport_edges JOIN ancestors"
+            " ON subpassport_edges.subpassport_id = ancestors.id UNION"
+            " SELECT passports.parent FROM passports JOIN ancestors"
+            " ON passports.id = ancestors.id WHERE passports.parent <> ''"
+            ") UPDATE passports SET version = version + 1, modified_at = ?"
+            " WHERE id IN (SELECT id FROM ancestors)",
+            (document_id, datetime.now(timezone.utc).isoformat()),
+        )
+
+    # Reference a known event from a DPP. Returns False if the event is unknown, or was
+    # already referenced.
+    def link_event(
+        self,
+        connection: sqlite3.Connection,
+        document_id: str,
+        event_id: str,
+        event_type: str,
+    ) -> bool:
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO dpp_events (dpp_id, event_type, event_id, epoch)"
+            " SELECT ?, ?, id, epoch FROM events WHERE id = ?",
+            (document_id, event_type, event_id),
+        )
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def event_types(event_type: str) -> str:
+        if event_type == EventFilterFormats.ALL.value:
+            return json.dumps(
+                [EventFilterFormats.ACTIVITY.value, EventFilterFormats.OWNERSHIP.value]
+            )
+        return json.dumps([event_type])
+
+    @staticmethod
+    def epoch_range(
+        since: datetime | None, until: datetime | None
+    ) -> Tuple[float, float]:
+        return (
+            datetime_to_epoch(since) if since is not None else float("-inf"),
+            datetime_to_epoch(until) if until is not None else float("inf"),
+        )
+
+    def get_dpp_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = EventFilterFormats.ACTIVITY.value,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> List[Dict]:
+        # With all event types, activity events come first on equal timestamps.
+        rows = self.fetch_all(
+            "SELECT events.document FROM dpp_events"
+            " JOIN events ON events.id = dpp_events.event_id"
+            " WHERE dpp_events.dpp_id = ?"
+            " AND dpp_events.event_type IN (SELECT value FROM json_each(?))"
+            " AND dpp_events.epoch BETWEEN ? AND ?"
+            " ORDER BY dpp_events.epoch, dpp_events.event_type <> 'activity',"
+            " dpp_events.link",
+            (
+                document_id,
+                self.event_types(event_type),
+                *self.epoch_range(since, until),
+            ),
+        )
+        return [decode_json(document) for (document,) in rows]
+
+    def get_dpp_full_events(
+        self,
+        document_id: str,
+        sorted: bool = True,
+        event_type: str = "activity",
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> List[Dict]:
+        # Events of the DPP and its (nested) subpassports, each event once.
+        rows = self.fetch_all(
+            "WITH RECURSIVE subtree (id) AS ("
+            " SELECT ? UNION"
+            " SELECT subpassport_edges.subpassport_id FROM subpassport_edges"
+            " JOIN subtree ON subpassport_edges.dpp_id = subtree.id"
+            ") SELECT events.document FROM ("
+            " SELECT event_id, MIN(epoch) AS epoch, MIN(link) AS link FROM dpp_events"
+            " WHERE dpp_id IN (SELECT id FROM subtree)"
+            " AND event_type IN (SELECT value FROM json_each(?))"
+            " AND epoch BETWEEN ? AND ? GROUP BY event_id"
+            ") AS subtree_events JOIN events ON events.id = subtree_events.event_id"
+            " ORDER BY subtree_events.epoch, subtree_events.link",
+            (
+                document_id,
+                self.event_types(event_type),
+                *self.epoch_range(since, until),
+            ),
+        )
+        return [decode_json(document) for (document,) in rows]
+
+    @staticmethod
+    def get_id_value(obj):
+        return InMemoryStore.get_id_value(obj)
+
+    @staticmethod
+    def get_event_type(event: Dict):
+        return InMemoryStore.get_event_type(event)
+
+    # Add ID if event has no ID.
+    def add_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> str | None:
+        try:
+            event_id = self.get_id_value(event)
+        except:
+            event_id = str(uuid.uuid4())
+            event["id"] = event_id
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO events (id, type, epoch, document)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    event_id,
+                    self.get_event_type(event),
+                    InMemoryStore.extract_event_epoch(event),
+                    encode_json(event).decode("utf-8"),
+                ),
+            )
+            if cursor.rowcount > 0:
+                logger.debug("Event added-> " + event_id)
+            else:
+                logger.debug("Event was already present, only adding reference.")
+            if not connection.execute(
+                "SELECT 1 FROM passports WHERE id = ?", (document_id,)
+            ).fetchone():
+                logger.warning(
+                    "Adding event -> "
+                    + event_id
+                    + " with unknown DPP reference -> "
+                    + document_id
+                )
+            elif self.link_event(connection, document_id, event_id, event_type):
+                self.mark_dpp_changed(connection, document_id)
+        return event_id
+
+    def add_dpp_events(
+        self, document_id: str, event_list: List[Dict], event_type: List[str] | None
+    ) -> List[str | None]:
+        if event_type is None:
+            event_type = ["activity" for i in range(len(event_list))]
+        with self.transaction():
+            return [
+                self.add_dpp_event(document_id, event, etype)
+                for event, etype in zip(event_list, event_type)
+            ]
+
+    def update_dpp_event(
+        self, document_id: str, event: Dict, event_type: str = "activity"
+    ) -> None:
+        event_id = self.get_id_value(event)
+        event_epoch = InMemoryStore.extract_event_epoch(event)
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT epoch FROM events WHERE id = ?", (event_id,)
+            ).fetchone()
+            if row is None:
+                raise Exception("Event not found to update.")
+            connection.execute(
+                "UPDATE events SET type = ?, epoch = ?, document = ? WHERE id = ?",
+                (
+                    self.get_event_type(event),
+                    event_epoch,
+                    encode_json(event).decode("utf-8"),
+                    event_id,
+                ),
+            )
+            links = connection.execute(
+                "SELECT dpp_id, event_type FROM dpp_events WHERE event_id = ?"
+                " ORDER BY link",
+                (event_id,),
+            ).fetchall()
+            if event_epoch != row[0]:
+                # Reposition the event in every DPP referencing it.
+                connection.execute(
+                    "DELETE FROM dpp_events WHERE event_id = ?", (event_id,)
+                )
+                for linked_document_id, linked_event_type in links:
+                    self.link_event(
+                        connection, linked_document_id, event_id, linked_event_type
+                    )
+            # Responses embed the event content, so every referencing DPP changed.
+            for linked_document_id, _ in links:
+                self.mark_dpp_changed(connection, linked_document_id)
+
+    def delete_dpp_event(
+        self, document_id: str, event_id: str, event_type: str = "activity"
+    ) -> None:
+        with self.transaction() as connection:
+            if not connection.execute(
+                "DELETE FROM events WHERE id = ?", (event_id,)
+            ).rowcount:
+                raise Exception("Event not found to delete.")
+            # Remove the references from DPPs as well, no dangling IDs remain.
+            linked_document_ids = connection.execute(
+                "DELETE FROM dpp_events WHERE event_id = ? RETURNING dpp_id",
+                (event_id,),
+            ).fetchall()
+            for (linked_document_id,) in linked_document_ids:
+                self.mark_dpp_changed(connection, linked_document_id)
+
+    def get_event(self, event_id: str) -> Dict | None:
+        document = self.fetch_value(
+            "SELECT document FROM events WHERE id = ?", (event_id,)
+        )
+        return decode_json(document) if document is not None else None
+
+    def attach_subpassport_by_id(self, document_id: str, subpassport_id: str) -> None:
+        with self.transaction() as connection:
+            if not connection.execute(
+                "SELECT 1 FROM passports WHERE id = ?", (document_id,)
+            ).fetchone():
+                raise Exception("DPP not available -> " + document_id)
+            if not connection.execute(
+                "SELECT 1 FROM passports WHERE id = ?", (subpassport_id,)
+            ).fetchone():
+                raise Exception("Subpassport not available -> " + subpassport_id)
+            # The subpassport changes, along with the path of its former parent.
+            self.mark_dpp_changed(connection, subpassport_id)
+            connection.execute(
+                "INSERT INTO subpassport_edges (dpp_id, position, subpassport_id)"
+                " SELECT ?, COALESCE(MAX(position) + 1, 0), ? FROM subpassport_edges"
+                " WHERE dpp_id = ?",
+                (document_id, subpassport_id, document_id),
+            )
+            connection.execute(
+                "UPDATE passports SET parent = ? WHERE id = ?",
+                (document_id, subpassport_id),
+            )
+            self.mark_dpp_changed(connection, document_id)
+
+    # The attachment store already applied the change; the database only tracks which DPPs
+    # list the attachment.
+    def register_attachment_change(
+        self,
+        attachment_id: str,
+        attachment_reference: AttachmentReference | None,
+        document_id: str | None = None,
+    ) -> None:
+        with self.transaction() as connection:
+            if document_id and attachment_reference is not None:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO passport_attachments (attachment_id, dpp_id)"
+                    " SELECT ?, id FROM passports WHERE id = ?",
+                    (attachment_id, document_id),
+                )
+                if cursor.rowcount:
+                    connection.execute(
+                        "UPDATE passports"
+                        " SET document = json_insert(document, '$.attachments[#]', ?)"
+                        " WHERE id = ?",
+                        (attachment_id, document_id),
+                    )
+            listing_dpp_ids = [
+                row[0]
+                for row in connection.execute(
+                    "SELECT dpp_id FROM passport_attachments WHERE attachment_id = ?",
+                    (attachment_id,),
+                )
+            ]
+            if attachment_reference is None:
+                for listing_dpp_id in listing_dpp_ids:
+                    connection.execute(
+                        "UPDATE passports SET document = json_set(document,"
+                        " '$.attachments', (SELECT json_group_array(value)"
+                        " FROM json_each(document, '$.attachments') WHERE value <> ?))"
+                        " WHERE id = ?",
+                        (attachment_id, listing_dpp_id),
+                    )
+                connection.execute(
+                    "DELETE FROM passport_attachments WHERE attachment_id = ?",
+                    (attachment_id,),
+                )
+            for listing_dpp_id in listing_dpp_ids:
+                self.mark_dpp_changed(connection, listing_dpp_id)
+
+    def attach_subpassport(self, document_id: str, subpassport_document: Dict) -> None:
+        subpassport_id = self.get_id_value(subpassport_document)
+        with self.transaction():
+            self.add_dpp_document(subpassport_id, subpassport_document)
+            self.attach_subpassport_by_id(document_id, subpassport_id)
+
+    def detach_subpassport_by_id(self, document_id: str, subpassport_id: str) -> None:
+        with self.transaction() as connection:
+            if not connection.execute(
+                "SELECT 1 FROM passports WHERE id = ?", (document_id,)
+            ).fetchone():
+                raise Exception("DPP not available -> " + document_id)
+            row = connection.execute(
+                "SELECT parent FROM passports WHERE id = ?", (subpassport_id,)
+            ).fetchone()
+            if row is None:
+                raise Exception("Subpassport not available -> " + subpassport_id)
+            detached_edges = connection.execute(
+                "DELETE FROM subpassport_edges WHERE dpp_id = ? AND subpassport_id = ?",
+                (document_id, subpassport_id),
+            ).rowcount
+            if not detached_edges and row[0] != document_id:
+                raise Exception("Subpassport already not attached")
+            connection.execute(
+                "UPDATE passports SET parent = '' WHERE id = ?", (subpassport_id,)
+            )
+            self.mark_dpp_changed(connection, document_id)
+            self.mark_dpp_changed(connection, subpassport_id)
+            logger.debug(
+                "Subpassport detached from -> "
+                + document_id
+                + ", not removed ->"
+                + subpassport_id
+            )
+
+    # SQL conditions (on passports, as p) and their parameters for the filters, with the
+    # same semantics as InMemoryStore.filter_candidate_sets. Lists are passed as a single
+    # JSON parameter, so the SQL only depends on which filters are active and the prepared
+    # statement is reused.
+    @staticmethod
+    def filter_conditions_sql(
+        filters: FilterConditions | None,
+    ) -> Tuple[List[str], List[Any]]:
+        conditions: List[str] = []
+        parameters: List[Any] = []
+        if filters is None:
+            return conditions, parameters
+
+        if filters.passport_type:
+            conditions.append("p.passport_type IN (SELECT value FROM json_each(?))")
+            parameters.append(json.dumps(list(filters.passport_type)))
+
+        # All tags need to be present
+        for tag in set(filters.tags):
+            conditions.append(
+                "p.id IN (SELECT dpp_id FROM passport_tags WHERE tag = ?)"
+            )
+            parameters.append(tag)
+
+        if filters.batch_ids:
+            conditions.append("p.batch_id IN (SELECT value FROM json_each(?))")
+            parameters.append(json.dumps(list(filters.batch_ids)))
+
+        # Substring match, DPPs without registration_id are not excluded
+        if filters.registration_id:
+            conditions.append(
+                "(p.registration_id IS NULL OR instr(p.registration_id, ?) > 0)"
+            )
+            parameters.append(filters.registration_id)
+
+        # DPPs without current owner/manufacturer are not excluded
+        if filters.current_country_codes:
+            conditions.append(
+                "(p.current_country_code IS NULL"
+                " OR p.current_country_code IN (SELECT value FROM json_each(?)))"
+            )
+            parameters.append(json.dumps(list(filters.current_country_codes)))
+        if filters.origin_country_codes:
+            conditions.append(
+                "(p.origin_country_code IS NULL"
+                " OR p.origin_country_code IN (SELECT value FROM json_each(?)))"
+            )
+            parameters.append(json.dumps(list(filters.origin_country_codes)))
+
+        # The trigram index narrows down the candidates, the substring itself is checked
+        # per DPP. Substrings shorter than a trigram can only be checked per DPP.
+        if filters.name_contains:
+            needle = filters.name_contains.lower()
+            if len(needle) >= 3:
+                conditions.append(
+                    "p.sequence IN"
+                    " (SELECT rowid FROM passport_names WHERE passport_names MATCH ?)"
+                )
+                parameters.append('"' + needle.replace('"', '""') + '"')
+            conditions.append("instr(p.name_text, ?) > 0")
+            parameters.append(needle)
+
+        return conditions, parameters
+
+    def search_for_dpp(self, filters: FilterConditions) -> List[Dict[str, str]]:
+        return list(self.search_for_dpp_iterator(filters))
+
+    # Results in insertion order, read page by page (keyset pagination on sequence), so no
+    # connection is held while the results are consumed.
+    def search_for_dpp_iterator(
+        self, filters: FilterConditions, after_document_id: str | None = None
+    ) -> Iterator[Dict[str, str]]:
+        if after_document_id is None:
+            last_sequence = 0
+        else:
+            last_sequence = self.fetch_value(
+                "SELECT sequence FROM passports WHERE id = ?", (after_document_id,)
+            )
+            if last_sequence is None:
+                raise KeyError(
+                    "Unknown DPP to continue search from -> " + after_document_id
+                )
+
+        conditions, parameters = self.filter_conditions_sql(filters)
+        query = (
+            "SELECT p.sequence, p.id FROM passports AS p WHERE "
+            + " AND ".join(["p.sequence > ?"] + conditions)
+            + " ORDER BY p.sequence LIMIT ?"
+        )
+        while True:
+            rows = self.fetch_all(
+                query, [last_sequence] + parameters + [self.SEARCH_PAGE_SIZE]
+            )
+            for last_sequence, document_id in rows:
+                yield {"label": document_id, "value": document_id}
+            if len(rows) < self.SEARCH_PAGE_SIZE:
+                return
+
+    # Sample up to count distinct DPP IDs matching the filters. Without filters, random
+    # sequence numbers are looked up. With filters, the database samples the matches.
+    def sample_dpp_document_ids(
+        self, count: int, filters: FilterConditions | None = None
+    ) -> List[str]:
+        conditions, parameters = self.filter_conditions_sql(filters)
+        if conditions:
+            rows = self.fetch_all(
+                "SELECT p.id FROM passports AS p WHERE "
+                + " AND ".join(conditions)
+                + " ORDER BY random() LIMIT ?",
+                parameters + [count],
+            )
+            return [document_id for (document_id,) in rows]
+
+        maximum_sequence = self.fetch_value("SELECT MAX(sequence) FROM passports") or 0
+        sequences = random.sample(
+            range(1, maximum_sequence + 1), min(count, maximum_sequence)
+        )
+        rows = self.fetch_all(
+            "SELECT sequence, id FROM passports"
+            " WHERE sequence IN (SELECT value FROM json_each(?))",
+            (json.dumps(sequences),),
+        )
+        document_ids = dict(rows)
+        return [
+            document_ids[sequence] for sequence in sequences if sequence in document_ids
+        ]
+
+    # TODO: Handle updating events independently
+    def update_event(self, event_id: str, event: Dict) -> None:
+        raise NotImplementedError
+
+    # TODO: Handle deleting events independently.
+    def delete_event(self, event_id: str) -> None:
+        raise NotImplementedError
+
+    def get_event_metadata(self) -> Dict:
+        return {"total_events": self.fetch_value("SELECT COUNT(*) FROM events")}
+
+    # TODO: Handle all DPP template endpoints
+    def get_dpp_template(self, template_id: str, version="latest") -> Dict:
+        raise NotImplementedError
+
+    def add_dpp_template(self, template_id: str, json_schema: str) -> str:
+        raise NotImplementedError
+
+    def publish_dpp_template(self, template_id: str, version: str) -> None:
+        raise NotImplementedError
+
+    def update_dpp_template(self, template_id: str) -> None:
+        raise NotImplementedError
+
+    def get_dpp_template_versions_with_metadata(self, template_id: str) -> Dict:
+        raise NotImplementedError
+
+    def get_dpp_template_ids_with_metadata(self) -> Dict:
+        raise NotImplementedError
+
+
+# Statistics are aggregated by the database, using the indexes of the SQLiteStore.
+class SQLiteStoreStatistics(BaseStoreStatistics):
+    MAX_HISTOGRAM_BUCKETS = 10000
+
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+
+    def passports_by_batch(self) -> Dict[str, int]:
+        batches: Dict[str, int] = {}
+        for batch_id, count in self.store.fetch_all(
+            "SELECT batch_id, COUNT(*) FROM passports GROUP BY batch_id"
+        ):
+            batch_key = batch_id if batch_id else "undefined"
+            batches[batch_key] = batches.get(batch_key, 0) + count
+        return batches
+
+    def number_of_batches(self) -> int:
+        return len(self.passports_by_batch())
+
+    def number_of_unique_tags(self) -> int:
+        return self.store.fetch_value("SELECT COUNT(DISTINCT tag) FROM passport_tags")
+
+    def passports_by_tag(self) -> Dict[str, int]:
+        return dict(
+            self.store.fetch_all("SELECT tag, COUNT(*) FROM passport_tags GROUP BY tag")
+        )
+
+    def passports_by_type(self) -> Dict[str, int]:
+        return dict(
+            self.store.fetch_all(
+                "SELECT passport_type, COUNT(*) FROM passports GROUP BY passport_type"
+            )
+        )
+
+    def number_of_single_passports(self) -> int:
+        return self.passports_created_all_time() - self.number_of_connected_passports()
+
+    # Connected passports have a parent or subpassports.
+    def number_of_connected_passports(self) -> int:
+        return self.store.fetch_value(
+            "SELECT COUNT(*) FROM passports AS p WHERE p.parent <> ''"
+            " OR EXISTS (SELECT 1 FROM subpassport_edges WHERE dpp_id = p.id)"
+        )
+
+    def passports_created_in_time_range(
+        self, start_time: datetime, end_time: datetime
+    ) -> int:
+        return self.store.fetch_value(
+            "SELECT COUNT(*) FROM passports WHERE creation_epoch BETWEEN ? AND ?",
+            (datetime_to_epoch(start_time), datetime_to_epoch(end_time)),
+        )
+
+    def passports_created_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        interval: str = CreationHistogramIntervals.DAY.value,
+    ) -> List[Dict[str, Any]]:
+        if interval not in [i.value for i in CreationHistogramIntervals]:
+            raise ValueError("Unknown histogram interval -> " + interval)
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+
+        # The creation times in range are read once, in order, and counted per bucket.
+        epochs = [
+            epoch
+            for (epoch,) in self.store.fetch_all(
+                "SELECT creation_epoch FROM passports"
+                " WHERE creation_epoch BETWEEN ? AND ? ORDER BY creation_epoch",
+                (start_time.timestamp(), end_time.timestamp()),
+            )
+        ]
+
+        # Buckets are aligned like InMemoryStoreStatistics.passports_created_histogram.
+        histogram = []
+        bucket_start = InMemoryStoreStatistics.start_of_interval(start_time, interval)
+        while bucket_start <= end_time:
+            if len(histogram) >= self.MAX_HISTOGRAM_BUCKETS:
+                raise ValueError("Too many histogram buckets requested.")
+            bucket_end = InMemoryStoreStatistics.start_of_next_interval(
+                bucket_start, interval
+            )
+            start_position = bisect_left(
+                epochs, max(bucket_start, start_time).timestamp()
+            )
+            if bucket_end > end_time:
+                end_position = bisect_right(epochs, end_time.timestamp())
+            else:
+                end_position = bisect_left(epochs, bucket_end.timestamp())
+            histogram.append(
+                {
+                    "start": bucket_start.isoformat(),
+                    "end": bucket_end.isoformat(),
+                    "count": max(end_position - start_position, 0),
+                }
+            )
+            bucket_start = bucket_end
+        return histogram
+
+    def passports_created_last_day(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=1), now)
+
+    def passports_created_last_week(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(weeks=1), now)
+
+    def passports_created_last_month(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=30), now)
+
+    def passports_created_last_year(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=365), now)
+
+    def passports_created_last_5_years(self) -> int:
+        now = datetime.now(timezone.utc)
+        return self.passports_created_in_time_range(now - timedelta(days=365 * 5), now)
+
+    def passports_created_all_time(self) -> int:
+        return self.store.fetch_value("SELECT COUNT(*) FROM passports")
+
+    def events_all_time(self) -> int:
+        return self.store.fetch_value("SELECT COUNT(*) FROM events")
+
+    def number_per_event_type(self) -> Dict[str, int]:
+        return dict(
+            self.store.fetch_all("SELECT type, COUNT(*) FROM events GROUP BY type")
+        )
+
+    def to_dict(self):
+        passport_stats = {}
+        passport_stats["passports_by_batch"] = self.passports_by_batch()
+        passport_stats["number_batches"] = self.number_of_batches()
+        passport_stats["passports_by_tag"] = self.passports_by_tag()
+        passport_stats["number_tags"] = self.number_of_unique_tags()
+        passport_stats["passports_by_type"] = self.passports_by_type()
+        passport_stats["number_single_passports"] = self.number_of_single_passports()
+        passport_stats["number_connected_passports"] = (
+            self.number_of_connected_passports()
+        )
+        passport_stats["passports_created_last_day"] = self.passports_created_last_day()
+        passport_stats["passports_created_last_week"] = (
+            self.passports_created_last_week()
+        )
+        passport_stats["passports_created_last_month"] = (
+            self.passports_created_last_month()
+        )
+        passport_stats["passports_created_last_year"] = (
+            self.passports_created_last_year()
+        )
+        passport_stats["passports_created_last_5_years"] = (
+            self.passports_created_last_5_years()
+        )
+        passport_stats["passports_created_all_time"] = self.passports_created_all_time()
+        passport_stats["total_dpp_documents"] = (self.passports_created_all_time(),)
+
+        event_stats = {}
+        event_stats["events_all_time"] = self.events_all_time()
+        event_stats["number_event_types"] = self.number_per_event_type()
+        return {"passport": passport_stats, "event": event_stats}
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app.config import config
+from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.data.executorstore import ExecutorDataStore, ReadWriteLock
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.snapshot import get_snapshot_config, load_snapshot
+from app.datastores.wal import get_wal_config, read_log_records
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("shared-state")
+
+# Shared state of an in-memory store served by several worker processes (uvicorn --workers).
+# Every worker holds its own copy of the store, loaded from the snapshot, so reads scale with
+# the number of workers. The write-ahead log is the channel between workers: a worker applies
+# a change to its copy and appends it to the log as the only writer, holding an exclusive lock
+# on the lock file until the record is written to the file (its fsync is shared with later
+# writes, see app.datastores.wal). Before serving a read, a worker applies the records that other workers
+# appended since (holding a shared lock, so it only sees complete records).
+# When a worker compacts the log into the snapshot, the others notice that their position in
+# the log is no longer valid, and reload the snapshot before applying the remaining records.
+
+
+def get_shared_config() -> Dict[str, Any]:
+    return config.get("data", {}).get("shared", None) or {}
+
+
+def shared_state_enabled() -> bool:
+    return bool(get_shared_config().get("enabled", False))
+
+
+def get_shared_lock_path() -> str:
+    return get_shared_config().get("lock_path", None) or (
+        get_wal_config()["path"] + ".lock"
+    )
+
+
+# Startup hook: workers load (or import) the data and open the log one at a time.
+@contextmanager
+def shared_startup_lock() -> Iterator[None]:
+    if not shared_state_enabled():
+        yield
+        return
+    if fcntl is None:
+        raise Exception("Shared state needs file locks (fcntl), which are unavailable.")
+    lock_path = get_shared_lock_path()
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, "ab") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class SharedLogFollower:
+    def __init__(
+        self,
+        data_store: InMemoryStore,
+        attachment_store: BaseAttachmentStore,
+        wal_path: str,
+        snapshot_path: str,
+        lock_path: str,
+    ) -> None:
+        if fcntl is None:
+            raise Exception(
+                "Shared state needs file locks (fcntl), which are unavailable."
+            )
+        if data_store.mutation_log is None or not data_store.mutation_log.synchronous:
+            raise Exception("Shared state needs a synchronous write-ahead log.")
+        self.data_store = data_store
+        self.attachment_store = attachment_store
+        self.wal_path = wal_path
+        self.snapshot_path = snapshot_path
+        self.lock_file = open(lock_path, "ab")
+        # Position in the log up to which all records are applied, and the state of the log and
+        # snapshot files at that point.
+        self.offset = os.path.getsize(wal_path)
+        self.log_state = self.stat_log()
+        self.snapshot_state = self.stat_snapshot()
+
+    # (size, mtime) of the log.
+    def stat_log(self) -> Tuple[int, int]:
+        stat = os.stat(self.wal_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    # (inode, mtime) of the snapshot. Snapshots are written to a new file and renamed, so every
+    # snapshot has a new inode.
+    def stat_snapshot(self) -> Tuple[int, int]:
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return 0, 0
+        return stat.st_ino, stat.st_mtime_ns
+
+    # A single stat per read. Every change by another worker, including a compaction into the
+    # snapshot, changes the log.
+    def has_new_records(self) -> bool:
+        return self.stat_log() != self.log_state
+
+    # Apply the records appended by other workers. Callers hold the write lock of the store.
+    def catch_up(self) -> int:
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH)
+        try:
+            return self.catch_up_locked()
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def catch_up_locked(self) -> int:
+        log_state = self.stat_log()
+        snapshot_state = self.stat_snapshot()
+        if snapshot_state != self.snapshot_state or log_state[0] < self.offset:
+            # Another worker wrote a snapshot, and may have compacted the log into it.
+            applied = self.reload()
+        else:
+            applied = self.apply_records()
+            if self.offset != log_state[0]:
+                applied += self.reload()
+        self.log_state = log_state
+        self.snapshot_state = snapshot_state
+        # Continue the numbering of the log after the records of other workers.
+        if self.data_store.mutation_log is not None:
+            self.data_store.mutation_log.skip_to(self.data_store.applied_log_sequence)
+        return applied
+
+    # Apply the records after offset, stops at a gap in the numbering.
+    def apply_records(self) -> int:
+        applied = 0
+        for sequence, end_offset, operation, arguments, modified_at in read_log_records(
+            self.wal_path, self.offset
+        ):
+            if sequence > self.data_store.applied_log_sequence + 1:
+                break
+            if sequence == self.data_store.applied_log_sequence + 1:
+                # Applying a record must not log it again.
+                mutation_log = self.data_store.mutation_log
+                self.data_store.mutation_log = None
+                try:
+                    self.data_store.replay_mutation(operation, arguments, modified_at)
+                finally:
+                    self.data_store.mutation_log = mutation_log
+                self.data_store.applied_log_sequence = sequence
+                applied += 1
+            self.offset = end_offset
+        return applied
+
+    def reload(self) -> int:
+        logger.info(
+            "Log or snapshot changed by another worker, reloading " + self.snapshot_path
+        )
+        if not load_snapshot(
+            self.snapshot_path, self.data_store, self.attachment_store
+        ):
+            raise Exception("Unable to reload shared state from " + self.snapshot_path)
+        self.offset = 0
+        applied = self.apply_records()
+        if self.offset != os.path.getsize(self.wal_path):
+            raise Exception(
+                "Write-ahead log does not continue the snapshot -> " + self.wal_path
+            )
+        return applied
+
+    # Call a mutation of the store as the only writer among all workers, on top of the latest
+    # state. Callers hold the write lock of the store.
+    def write(self, function: Callable[[], Any]) -> Any:
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            self.catch_up_locked()
+            try:
+                return function()
+            finally:
+                # Other workers read the records from the file, the fsync follows later.
+                if self.data_store.mutation_log is not None:
+                    self.data_store.mutation_log.write_out()
+        finally:
+            # Records appended meanwhile are this worker's own, and applied already.
+            self.log_state = self.stat_log()
+            self.snapshot_state = self.stat_snapshot()
+            self.offset = self.log_state[0]
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Async adapter of an in-memory store shared with other worker processes.
+class SharedDataStore(ExecutorDataStore):
+    def __init__(
+        self,
+        data_store: InMemoryStore,
+        executor: Executor,
+        lock: ReadWriteLock,
+        follower: SharedLogFollower,
+    ) -> None:
+        super().__init__(data_store, executor, lock)
+        self.follower = follower
+
+    # Apply the records of other workers, as the only writer of this copy.
+    def apply_new_records(self) -> None:
+        with self.write_locked():
+            self.follower.catch_up()
+
+    def call_read(self, function: Callable, *args, **kwargs) -> Any:
+        if self.follower.has_new_records():
+            self.apply_new_records()
+        return super().call_read(function, *args, **kwargs)
+
+    async def catch_up(self) -> None:
+        if self.follower.has_new_records():
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.apply_new_records
+            )
+
+    def apply_write(
+        self, function: Callable, *args, **kwargs
+    ) -> Tuple[Any, Optional[int]]:
+        return super().apply_write(
+            self.follower.write, partial(function, *args, **kwargs)
+        )
+
+
+def create_shared_data_store(
+    data_store: InMemoryStore,
+    attachment_store: BaseAttachmentStore,
+    executor: Executor,
+) -> SharedDataStore:
+    snapshot_config = get_snapshot_config()
+    wal_path = get_wal_config().get("path", None)
+    if (
+        not isinstance(data_store, InMemoryStore)
+        or not snapshot_config.get("path", None)
+        or not snapshot_config.get("load_on_startup", False)
+        or not wal_path
+    ):
+        raise Exception(
+            "Shared state needs the in-memory store, with data.snapshot loaded on startup"
+            " and data.wal enabled."
+        )
+    follower = SharedLogFollower(
+        data_store,
+        attachment_store,
+        wal_path,
+        snapshot_config["path"],
+        get_shared_lock_path(),
+    )
+    return SharedDataStore(data_store, executor, ReadWriteLock(), follower)
@@ -0,0 +1,145 @@
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import time
+from typing import Any, Dict
+
+from app.config import config
+from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.data.basedatastore import BaseDataStore
+from app.datastores.data.inmemorystore import InMemoryStore
+
+logger = logging.getLogger("snapshot")
+
+# Binary snapshots of the in-memory data store (including its indexes) and the attachment
+# index, so a restart is a single bulk read instead of re-importing all JSON data.
+# Layout: header (SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION), followed by a single pickle of
+# {"data_store": InMemoryStore state, "attachments_index": Dict[ID, AttachmentReference]}.
+# Bump SNAPSHOT_FORMAT_VERSION when the layout of the stored structures changes, older
+# snapshots are then ignored and the preseeded data is imported instead.
+# Snapshots are unpickled, so only load snapshot files written by this application.
+SNAPSHOT_MAGIC = b"DPPSNAP"
+SNAPSHOT_FORMAT_VERSION = 3
+SNAPSHOT_HEADER = struct.Struct("<7sI")
+
+
+def get_snapshot_config() -> Dict[str, Any]:
+    return config.get("data", {}).get("snapshot", None) or {}
+
+
+def write_snapshot(
+    path: str, data_store: InMemoryStore, attachment_store: BaseAttachmentStore
+) -> int:
+    start_time = time.perf_counter()
+    payload = pickle.dumps(
+        {
+            "data_store": data_store.get_snapshot_state(),
+            "attachments_index": attachment_store.attachments_index,
+        },
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Write next to the target and rename, so readers never see a partial snapshot.
+    with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as f:
+        try:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+    size = SNAPSHOT_HEADER.size + len(payload)
+    logger.info(
+        f"Wrote snapshot of {len(data_store.dpp_store)} DPPs to {path}"
+        f" ({size} bytes, {time.perf_counter() - start_time:.3f}s)"
+    )
+    return size
+
+
+def read_snapshot(path: str) -> Dict[str, Any] | None:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        content = f.read()
+    try:
+        magic, format_version = SNAPSHOT_HEADER.unpack_from(content)
+    except struct.error:
+        magic, format_version = None, None
+    if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+        logger.warning("Ignoring snapshot with unknown format -> " + path)
+        return None
+    try:
+        return pickle.loads(memoryview(content)[SNAPSHOT_HEADER.size :])
+    except Exception as e:
+        logger.warning("Ignoring unreadable snapshot -> " + path + " - " + str(e))
+        return None
+
+
+# Restore the stores from a snapshot. Returns False (leaving the stores untouched) when there
+# is no usable snapshot, in which case the data has to be imported instead.
+def load_snapshot(
+    path: str, data_store: InMemoryStore, attachment_store: BaseAttachmentStore
+) -> bool:
+    start_time = time.perf_counter()
+    state = read_snapshot(path)
+    if state is None:
+        return False
+    missing_paths = [
+        attachment.path
+        for attachment in state["attachments_index"].values()
+        if attachment.path and not os.path.exists(attachment.path)
+    ]
+    if missing_paths:
+        logger.warning(
+            f"Ignoring snapshot, {len(missing_paths)} attachment files are missing -> "
+            + path
+        )
+        return False
+    if not data_store.restore_snapshot_state(state["data_store"]):
+        logger.warning("Ignoring snapshot of a different store layout -> " + path)
+        return False
+    attachment_store.restore_attachments_index(state["attachments_index"])
+    logger.info(
+        f"Loaded snapshot of {len(data_store.dpp_store)} DPPs from {path}"
+        f" ({time.perf_counter() - start_time:.3f}s)"
+    )
+    return True
+
+
+def snapshot_available(data_store_type: str) -> bool:
+    snapshot_config = get_snapshot_config()
+    return (
+        data_store_type == "inmemory"
+        and snapshot_config.get("load_on_startup", False)
+        and os.path.isfile(snapshot_config.get("path", ""))
+    )
+
+
+# Startup and shutdown hooks, following data.snapshot in the config.
+def load_configured_snapshot(
+    data_store: BaseDataStore, attachment_store: BaseAttachmentStore
+) -> bool:
+    snapshot_config = get_snapshot_config()
+    if not isinstance(data_store, InMemoryStore) or not snapshot_config.get(
+        "load_on_startup", False
+    ):
+        return False
+    return load_snapshot(snapshot_config["path"], data_store, attachment_store)
+
+
+def write_configured_snapshot(
+    data_store: BaseDataStore,
+    attachment_store: BaseAttachmentStore,
+    on_shutdown: bool = False,
+) -> int | None:
+    snapshot_config = get_snapshot_config()
+    if not isinstance(data_store, InMemoryStore) or "path" not in snapshot_config:
+        return None
+    if on_shutdown and not snapshot_config.get("write_on_shutdown", False):
+        return None
+    return write_snapshot(snapshot_config["path"], data_store, attachment_store)
@@ -2,16 +2,38 @@ import json
 import logging
 import os
 import shutil
-from typing import Dict
+import time
+from collections import deque
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from itertools import islice
+from typing import Callable, Deque, Dict, Iterator, List, Tuple
 
 from app.config import config
-from app.datamodel.serde import import_dpp_into_storage
+from app.datamodel.encoding import decode_json
 from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
 from app.datastores.attachments.filesystemattachmentstore import (
     FileSystemAttachmentStore,
 )
-from app.datastores.data.basedatastore import BaseDataStore
+from app.datastores.data.basedatastore import (
+    AsyncBaseStoreStatistics,
+    BaseDataStore,
+    BaseStoreStatistics,
+)
+from app.datastores.data.executorstore import (
+    ExecutorDataStore,
+    ExecutorStoreStatistics,
+    ReadWriteLock,
+)
 from app.datastores.data.inmemorystore import InMemoryStore, InMemoryStoreStatistics
+from app.datastores.data.mongostore import MongoStore, MongoStoreStatistics
+from app.datastores.data.sqlitestore import SQLiteStore, SQLiteStoreStatistics
+from app.datastores.sharedstate import create_shared_data_store, shared_state_enabled
+from app.datastores.snapshot import snapshot_available
 
 logger = logging.getLogger("utils")
 
@@ -23,7 +45,12 @@ def initialize_stores():
         # All modes shall be in-memory and local by default.
         attachment_storage_type = "local"
         credential_storage_type = "inmemory"
-        data_storage_type = "inmemory"  # For DPPs, DPP templates and events
+        # For DPPs, DPP templates and events. A configured sqlite or mongodb store is used in
+        # dev mode as well, with its data cleared at startup.
+        if config["data"]["type"] in ["sqlite", "mongodb"]:
+            data_storage_type = config["data"]["type"]
+        else:
+            data_storage_type = "inmemory"
     else:
         attachment_storage_type = config["attachment"]["type"]
         # credential_storage_type = config["credentials"]["type"]
@@ -34,7 +61,8 @@ def initialize_stores():
     data_store = None
 
     if attachment_storage_type == "local":
-        if config["mode"] == "dev":
+        # Keep the attachment files when they will be restored from a snapshot.
+        if config["mode"] == "dev" and not snapshot_available(data_storage_type):
             reset = True
         else:
             reset = False
@@ -45,12 +73,54 @@ def initialize_stores():
     if data_storage_type == "inmemory":
         data_store = InMemoryStore(config["identities"], attachment_store)
         data_store_statistics = InMemoryStoreStatistics(data_store)
+    elif data_storage_type == "sqlite":
+        # Like the attachments, the database is cleared in dev mode.
+        data_store = SQLiteStore(
+            config["data"]["sqlite"],
+            config["identities"],
+            attachment_store,
+            reset=config["mode"] == "dev",
+        )
+        data_store_statistics = SQLiteStoreStatistics(data_store)
+    elif data_storage_type == "mongodb":
+        data_store = MongoStore(
+            config["data"],
+            config["identities"],
+            attachment_store,
+            reset=config["mode"] == "dev",
+        )
+        data_store_statistics = MongoStoreStatistics(data_store)
     else:
         raise NotImplementedError()
 
     return data_store, attachment_store, credential_store, data_store_statistics
 
 
+# Async adapters of the data store and its statistics, used by the API. Store operations run on
+# a pool of data.workers threads. The in-memory store is not thread-safe, so its reads and
+# writes are synchronized by the adapter. With data.shared, the in-memory store also follows
+# the changes of other worker processes.
+def initialize_async_stores(
+    data_store: BaseDataStore,
+    attachment_store: BaseAttachmentStore,
+    data_store_statistics: BaseStoreStatistics,
+) -> Tuple[ExecutorDataStore, AsyncBaseStoreStatistics]:
+    executor = ThreadPoolExecutor(
+        max_workers=config["data"].get("workers", None),
+        thread_name_prefix="data-store",
+    )
+    if shared_state_enabled():
+        async_data_store = create_shared_data_store(
+            data_store, attachment_store, executor
+        )
+    else:
+        lock = ReadWriteLock() if isinstance(data_store, InMemoryStore) else None
+        async_data_store = ExecutorDataStore(data_store, executor, lock)
+    return async_data_store, ExecutorStoreStatistics(
+        data_store_statistics, async_data_store
+    )
+
+
 def import_preseeded_data(
     data_store: BaseDataStore, attachment_store: FileSystemAttachmentStore
 ):
@@ -68,25 +138,125 @@ def import_preseeded_data(
         preseeded_data_path, "dpp-templates"
     )
 
-    # Copy attachments
-    target_attachment_data_path = config["attachment"]["path"]
-    if os.path.exists(target_attachment_data_path):
-        # Remove the destination folder if it exists
-        shutil.rmtree(target_attachment_data_path)
+    # Copy (or link) attachments, and import their manifest to the attachment store
+    attachment_import_config = config["preseeded-data"].get("attachments", {})
+    import_preseeded_attachments(
+        preseeded_attachment_data_path,
+        config["attachment"]["path"],
+        attachment_store,
+        mode=attachment_import_config.get("mode", "copy"),
+        workers=attachment_import_config.get("workers", None),
+    )
+
+    # Import DPP objects, while separating events into their own objects
+    import_config = config["preseeded-data"].get("import", {})
+    import_dpp_files(
+        preseeded_dpp_data_path,
+        data_store,
+        workers=import_config.get("workers", None),
+        executor_type=import_config.get("executor", "thread"),
+        batch_size=import_config.get("batch_size", 500),
+    )
+
+
+# Attachments are either copied into the attachment store (copy), which stores identical files
+# once, or used in place (hardlink, symlink). Linked files are not hashed when imported, and
+# their size is only read on first access, so the import does not read every file.
+# - hardlink: the tree is recreated with hardlinks to the preseeded files (copied when the
+#   target is on another filesystem).
+# - symlink: the top-level folders of the preseeded attachments are linked as a whole.
+def import_preseeded_attachments(
+    source_path: str,
+    target_path: str,
+    attachment_store: FileSystemAttachmentStore,
+    mode: str = "copy",
+    workers: int | None = None,
+) -> None:
+    if os.path.exists(target_path):
+        # Remove the destination folder if it exists. Links are removed, not followed.
+        shutil.rmtree(target_path)
 
-    # Copy the source folder to the destination
-    shutil.copytree(preseeded_attachment_data_path, target_attachment_data_path)
-    logger.debug("Copied pre-seeded attachments to the filesystem data folder")
+    if mode == "copy":
+        shutil.copytree(source_path, target_path)
+    elif mode == "hardlink":
+        shutil.copytree(source_path, target_path, copy_function=link_or_copy)
+    elif mode == "symlink":
+        os.makedirs(target_path)
+        for entry in os.scandir(source_path):
+            os.symlink(
+                os.path.abspath(entry.path), os.path.join(target_path, entry.name)
+            )
+    else:
+        raise Exception("Unknown attachment import mode -> " + mode)
+    logger.debug(f"Pre-seeded attachments added to the filesystem data folder ({mode})")
 
-    # Import attachment manifest to attachmentstore
-    with open(
-        os.path.join(target_attachment_data_path, "attachment_index.json"), "+rb"
-    ) as f:
+    with open(os.path.join(target_path, "attachment_index.json"), "rb") as f:
         attachment_manifest = json.loads(f.read())
-    attachment_store.import_attachments(attachment_manifest)
+    attachment_store.import_attachments(
+        attachment_manifest, in_place=mode != "copy", workers=workers
+    )
 
-    # Import DPP objects, while separating events into their own objects
-    for dpp_json_id in os.listdir(preseeded_dpp_data_path):
-        with open(os.path.join(preseeded_dpp_data_path, dpp_json_id), "+rb") as f:
-            dpp_json = json.loads(f.read())
-            import_dpp_into_storage(dpp_json, data_store, attachment_store)
+
+def link_or_copy(source: str, target: str) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def load_json_file(path: str) -> Dict:
+    with open(path, "rb") as f:
+        return decode_json(f.read())
+
+
+# Parse files in a thread or process pool, yielding the parsed documents in the order of paths.
+# At most a few files per worker are parsed ahead, so the parsed documents stream through
+# memory instead of all being held at once.
+def parse_json_files(
+    paths: List[str], workers: int | None = None, executor_type: str = "thread"
+) -> Iterator[Dict]:
+    workers = workers or os.cpu_count() or 1
+    if executor_type == "thread":
+        executor: Executor = ThreadPoolExecutor(max_workers=workers)
+    elif executor_type == "process":
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise Exception("Unknown import executor type -> " + executor_type)
+    with executor:
+        read_ahead = 4 * workers
+        pending: Deque[Future] = deque()
+        for path in paths:
+            pending.append(executor.submit(load_json_file, path))
+            if len(pending) >= read_ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Bulk import of all DPP JSON files in a folder (in directory listing order, so references
+# between files resolve as before). Files are parsed in parallel, and the parsed DPPs are
+# added to the data store in batches, with progress reported after every batch.
+def import_dpp_files(
+    dpp_data_path: str,
+    data_store: BaseDataStore,
+    workers: int | None = None,
+    executor_type: str = "thread",
+    batch_size: int = 500,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    paths = [entry.path for entry in os.scandir(dpp_data_path) if entry.is_file()]
+    total = len(paths)
+    imported = 0
+    start_time = time.perf_counter()
+    dpp_jsons = parse_json_files(paths, workers, executor_type)
+    while batch := list(islice(dpp_jsons, batch_size)):
+        data_store.add_dpp_documents(batch)
+        imported += len(batch)
+        elapsed_time = time.perf_counter() - start_time
+        logger.info(
+            f"Imported {imported}/{total} DPP files"
+            f" ({imported / elapsed_time if elapsed_time else 0:.0f} files/s)"
+        )
+        if progress is not None:
+            progress(imported, total)
+    return imported
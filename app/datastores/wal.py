@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from app.config import config
+from app.datastores.attachments.baseattachmentstore import BaseAttachmentStore
+from app.datastores.data.basedatastore import BaseDataStore
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.snapshot import get_snapshot_config, write_snapshot
+
+logger = logging.getLogger("wal")
+
+# Append-only write-ahead log of InMemoryStore mutations, so changes survive a restart.
+# Record layout: RECORD_HEADER (payload length, CRC32 of the payload, sequence number),
+# followed by a pickle of (operation name, arguments, time). Operations are InMemoryStore
+# methods, which are called again with the same arguments on replay. The time of the operation
+# is replayed as well, so DPPs get the same modification time (Last-Modified and ETag) in
+# every replay and in every worker sharing the log.
+# Records are numbered, and the store remembers the last applied number (also in snapshots),
+# so replay after a snapshot only applies the records that are not in the snapshot yet.
+#
+# Write-behind: the store applies a mutation first and appends its record afterwards, while
+# it is still the only writer, so records are in the order the mutations were applied.
+# Concurrent readers can see a change before its record is durable; a crash in between loses
+# the change, but never leaves a log that disagrees with what the store applied. A logical
+# operation (such as adding a DPP with its events) is a single record, see
+# InMemoryStore.logged_operation.
+#
+# Group commit: writers append records to a shared buffer, and a flusher thread writes and
+# fsyncs everything buffered since its previous fsync at once. append never waits, so the
+# store is not locked during an fsync. With synchronous writes (the default), the async
+# adapter of the store (ExecutorDataStore) waits for the record to be durable before it
+# answers, after releasing the store. Concurrent writers therefore share fsyncs instead of
+# each paying for one. Otherwise records become durable at most commit_delay seconds later.
+RECORD_HEADER = struct.Struct("<IIQ")
+
+
+def read_log_records(
+    path: str, start_offset: int = 0
+) -> Iterator[Tuple[int, int, str, Tuple, datetime | None]]:
+    # Yields (sequence, end offset, operation, arguments, time), reading from start_offset (the
+    # end offset of an earlier record). Stops at the first incomplete or corrupt record, which
+    # is the torn tail of an interrupted write. Records of older logs have no time (None).
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        content = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(content):
+        length, checksum, sequence = RECORD_HEADER.unpack_from(content, offset)
+        payload_start = offset + RECORD_HEADER.size
+        payload = content[payload_start : payload_start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        record = pickle.loads(payload)
+        offset = payload_start + length
+        yield sequence, start_offset + offset, record[0], record[1], (
+            record[2] if len(record) > 2 else None
+        )
+
+
+class WriteAheadLog:
+    def __init__(
+        self,
+        path: str,
+        synchronous: bool = True,
+        commit_delay: float = 0.0,
+        compaction_interval: int = 10000,
+        compact: Callable[[], None] | None = None,
+    ) -> None:
+        self.path = path
+        self.synchronous = synchronous
+        self.commit_delay = commit_delay
+        self.compaction_interval = compaction_interval
+        self.compact_callback = compact
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Continue numbering after the last valid record, and cut off a torn tail.
+        self.sequence = 0
+        valid_size = 0
+        if os.path.isfile(path):
+            for sequence, end_offset, _, _, _ in read_log_records(path):
+                self.sequence = sequence
+                valid_size = end_offset
+        self.file = open(path, "ab")
+        self.file.truncate(valid_size)
+        # Records up to written_sequence are in the file, up to durable_sequence also fsynced.
+        self.written_sequence = self.sequence
+        self.durable_sequence = self.sequence
+        self.records_since_compaction = 0
+        # Number of fsyncs of appended records, each one committing a group of records.
+        self.group_commits = 0
+
+        self.condition = threading.Condition()
+        # Held while taking records from the buffer and writing them, so they stay in order.
+        self.file_lock = threading.Lock()
+        self.buffer = bytearray()
+        # Futures of async writers, resolved when their record is durable.
+        self.durable_waiters: List[
+            Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]
+        ] = []
+        self.closed = False
+        self.write_error: Exception | None = None
+        self.flusher = threading.Thread(
+            target=self.flush_loop, name="wal-flusher", daemon=True
+        )
+        self.flusher.start()
+
+    # Returns the number of the record, which is durable once durable_sequence reaches it.
+    def append(
+        self, operation: str, arguments: Tuple, modified_at: datetime | None = None
+    ) -> int:
+        payload = pickle.dumps(
+            (operation, arguments, modified_at), protocol=pickle.HIGHEST_PROTOCOL
+        )
+        with self.condition:
+            if self.closed or self.write_error is not None:
+                raise Exception(
+                    "Write-ahead log is not writable -> "
+                    + self.path
+                    + (" - " + str(self.write_error) if self.write_error else "")
+                )
+            self.sequence += 1
+            self.buffer += RECORD_HEADER.pack(
+                len(payload), zlib.crc32(payload), self.sequence
+            )
+            self.buffer += payload
+            self.records_since_compaction += 1
+            self.condition.notify_all()
+            return self.sequence
+
+    # Called by the store after logging a mutation, so snapshots include it.
+    def compact_if_due(self) -> None:
+        if (
+            self.compact_callback is not None
+            and self.records_since_compaction >= self.compaction_interval
+        ):
+            self.compact_callback()
+
+    # Write the buffered records to the file, without waiting for an fsync. Workers sharing the
+    # log read them from there (see app.datastores.sharedstate).
+    def write_out(self) -> None:
+        with self.file_lock:
+            with self.condition:
+                data = bytes(self.buffer)
+                self.buffer.clear()
+                group_sequence = self.sequence
+            if not data:
+                return
+            try:
+                self.file.write(data)
+                self.file.flush()
+            except Exception as e:
+                self.fail(e)
+                raise Exception("Unable to write to write-ahead log -> " + self.path)
+        with self.condition:
+            self.written_sequence = group_sequence
+            self.condition.notify_all()
+
+    # Later records may not be written after a gap, so stop accepting writes.
+    def fail(self, error: Exception) -> None:
+        logger.error("Unable to write to write-ahead log -> " + str(error))
+        with self.condition:
+            self.write_error = error
+            self.condition.notify_all()
+            self.resolve_durable_waiters()
+
+    def flush_loop(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.buffer
+                    or self.written_sequence > self.durable_sequence
+                    or self.closed
+                )
+                if (
+                    self.closed
+                    and not self.buffer
+                    and self.written_sequence <= self.durable_sequence
+                ):
+                    return
+            if self.commit_delay:
+                # Give more writers the chance to join this group.
+                time.sleep(self.commit_delay)
+            try:
+                self.write_out()
+                with self.condition:
+                    group_sequence = self.written_sequence
+                os.fsync(self.file.fileno())
+            except Exception as e:
+                if self.write_error is None:
+                    self.fail(e)
+                return
+            with self.condition:
+                self.group_commits += 1
+                self.durable_sequence = max(self.durable_sequence, group_sequence)
+                self.condition.notify_all()
+                self.resolve_durable_waiters()
+
+    # Resolve the futures of durable records, or all of them after a write error. Called
+    # holding the condition.
+    def resolve_durable_waiters(self) -> None:
+        remaining_waiters = []
+        for sequence, loop, future in self.durable_waiters:
+            if self.write_error is not None or sequence <= self.durable_sequence:
+                loop.call_soon_threadsafe(self.resolve_durable_future, future)
+            else:
+                remaining_waiters.append((sequence, loop, future))
+        self.durable_waiters = remaining_waiters
+
+    def resolve_durable_future(self, future: asyncio.Future) -> None:
+        if future.done():
+            return
+        if self.write_error is not None:
+            future.set_exception(
+                Exception("Unable to write to write-ahead log -> " + self.path)
+            )
+        else:
+            future.set_result(None)
+
+    # Wait until record sequence is durable.
+    def wait_durable(self, sequence: int) -> None:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.durable_sequence >= sequence
+                or self.write_error is not None
+            )
+            if self.durable_sequence < sequence:
+                raise Exception("Unable to write to write-ahead log -> " + self.path)
+
+    # Wait until record sequence is durable, without blocking the event loop.
+    async def wait_durable_async(self, sequence: int) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            self.durable_waiters.append((sequence, loop, future))
+            self.resolve_durable_waiters()
+        await future
+
+    # Wait until all records appended so far are durable.
+    def flush(self) -> None:
+        with self.condition:
+            target_sequence = self.sequence
+            self.condition.wait_for(
+                lambda: self.durable_sequence >= target_sequence
+                or self.write_error is not None
+            )
+
+    # Continue the numbering after records appended by another worker, which are in the file
+    # already. Their durability is up to that worker.
+    def skip_to(self, sequence: int) -> None:
+        with self.condition:
+            if sequence <= self.sequence:
+                return
+            if self.durable_sequence == self.sequence:
+                self.durable_sequence = sequence
+            self.written_sequence = sequence
+            self.sequence = sequence
+            self.condition.notify_all()
+            self.resolve_durable_waiters()
+
+    # Drop all records up to now, after they were written to a snapshot. New appends wait
+    # until the log is truncated, so no record can be lost in between.
+    def truncate(self, write_snapshot_callback: Callable[[], Any]) -> None:
+        self.flush()
+        with self.condition:
+            self.condition.wait_for(
+                lambda: (not self.buffer and self.durable_sequence >= self.sequence)
+                or self.write_error is not None
+            )
+            if self.write_error is not None:
+                raise Exception("Unable to compact write-ahead log -> " + self.path)
+            write_snapshot_callback()
+            self.file.truncate(0)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records_since_compaction = 0
+
+    def close(self) -> None:
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.flusher.join()
+        self.file.close()
+
+
+# Apply the records of a log that are not in the store yet. Returns the number of applied records.
+def replay_write_ahead_log(path: str, data_store: InMemoryStore) -> int:
+    if not os.path.isfile(path):
+        return 0
+    applied = 0
+    for sequence, _, operation, arguments, modified_at in read_log_records(path):
+        if sequence <= data_store.applied_log_sequence:
+            continue
+        if applied == 0 and sequence != data_store.applied_log_sequence + 1:
+            raise Exception(
+                f"Write-ahead log {path} starts at record {sequence}, but the store was loaded"
+                f" up to record {data_store.applied_log_sequence}. Restore the matching"
+                " snapshot, or remove the log to start over."
+            )
+        data_store.replay_mutation(operation, arguments, modified_at)
+        data_store.applied_log_sequence = sequence
+        applied += 1
+    return applied
+
+
+# Empty when the log is disabled.
+def get_wal_config() -> Dict[str, Any]:
+    wal_config = config.get("data", {}).get("wal", None) or {}
+    if not wal_config.get("enabled", True):
+        return {}
+    return wal_config
+
+
+# Startup hook, following data.wal in the config: replay the log on top of the loaded data
+# (snapshot or preseeded data), then log all further mutations of the store.
+# Compaction writes a snapshot (data.snapshot.path) and empties the log.
+def open_configured_write_ahead_log(
+    data_store: BaseDataStore, attachment_store: BaseAttachmentStore
+) -> WriteAheadLog | None:
+    wal_config = get_wal_config()
+    if not isinstance(data_store, InMemoryStore) or "path" not in wal_config:
+        return None
+    start_time = time.perf_counter()
+    applied = replay_write_ahead_log(wal_config["path"], data_store)
+    logger.info(
+        f"Replayed {applied} records from {wal_config['path']}"
+        f" ({time.perf_counter() - start_time:.3f}s)"
+    )
+
+    snapshot_path = get_snapshot_config().get("path", None)
+
+    def compact() -> None:
+        if snapshot_path is None:
+            return
+        write_ahead_log.truncate(
+            lambda: write_snapshot(snapshot_path, data_store, attachment_store)
+        )
+        logger.info("Compacted write-ahead log into " + snapshot_path)
+
+    write_ahead_log = WriteAheadLog(
+        wal_config["path"],
+        synchronous=wal_config.get("synchronous", True),
+        commit_delay=wal_config.get("commit_delay", 0.0),
+        compaction_interval=wal_config.get("compaction_interval", 10000),
+        compact=compact,
+    )
+    # After a compaction emptied the log, continue the numbering of the snapshot.
+    write_ahead_log.skip_to(data_store.applied_log_sequence)
+    data_store.mutation_log = write_ahead_log
+    return write_ahead_log
+
+
+# Shutdown hook: compact into a snapshot when one is configured, and close the log.
+# Returns True if a snapshot was written.
+def close_configured_write_ahead_log(data_store: BaseDataStore) -> bool:
+    if not isinstance(data_store, InMemoryStore) or data_store.mutation_log is None:
+        return False
+    write_ahead_log = data_store.mutation_log
+    compacted = get_snapshot_config().get("path", None) is not None
+    write_ahead_log.compact_callback()
+    data_store.mutation_log = None
+    write_ahead_log.close()
+    return compacted
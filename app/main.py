@@ -6,7 +6,17 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 from app.config import config, format_multiline_log
-from app.datastores.utils import import_preseeded_data, initialize_stores
+from app.datastores.sharedstate import shared_startup_lock, shared_state_enabled
+from app.datastores.snapshot import load_configured_snapshot, write_configured_snapshot
+from app.datastores.utils import (
+    import_preseeded_data,
+    initialize_async_stores,
+    initialize_stores,
+)
+from app.datastores.wal import (
+    close_configured_write_ahead_log,
+    open_configured_write_ahead_log,
+)
 
 # List of allowed origins
 origins = [
@@ -32,18 +42,35 @@ startup_logger.log(
 # Startup steps
 # 1. Initialize stores of data. Clear if already containing
 #   data (not applicable for in-memory storage, also not for file-system storage.)
-# 2. Copy pre-seeded content and add to data stores.
-# 3. Give some information logs about loaded information.
-
-data_store, attachment_store, credential_store, data_store_statistics = (
-    initialize_stores()
-)
-import_preseeded_data(data_store, attachment_store)
+# 2. Copy pre-seeded content and add to data stores, unless restored from a snapshot.
+# 3. Replay changes from the write-ahead log, and log further changes.
+# 4. Wrap the data store for the API, which awaits its operations on worker threads.
+# 5. Give some information logs about loaded information.
+# With data.shared, worker processes run these steps one at a time, and the first one writes a
+# snapshot of the imported data for the others to load.
+
+with shared_startup_lock():
+    data_store, attachment_store, credential_store, data_store_statistics = (
+        initialize_stores()
+    )
+    if not load_configured_snapshot(data_store, attachment_store):
+        import_preseeded_data(data_store, attachment_store)
+        if shared_state_enabled():
+            write_configured_snapshot(data_store, attachment_store)
+    open_configured_write_ahead_log(data_store, attachment_store)
+    async_data_store, async_data_store_statistics = initialize_async_stores(
+        data_store, attachment_store, data_store_statistics
+    )
 
 
 # Common call for API endpoints
 def get_datastores():
-    return data_store, attachment_store, credential_store, data_store_statistics
+    return (
+        async_data_store,
+        attachment_store,
+        credential_store,
+        async_data_store_statistics,
+    )
 
 
 from app.api.dpp import dpp_app
@@ -75,6 +102,32 @@ def upload_preseeded_data():
     return {"status": "Not yet implemented"}
 
 
+@app.post("/snapshot", tags=["Dev"])
+async def write_snapshot():
+    # Written on demand here, and on shutdown when configured. No writes run meanwhile.
+    size = await async_data_store.run_write(
+        write_configured_snapshot, data_store, attachment_store
+    )
+    if size is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Snapshots are not configured for this data store",
+        )
+    return {"status": "Snapshot written", "size": size}
+
+
+@app.on_event("shutdown")
+def write_snapshot_on_shutdown():
+    # Let running operations finish first. The snapshot is written as the only writer.
+    async_data_store.close()
+    attachment_store.close()
+    # Closing the write-ahead log compacts it into a snapshot already.
+    if not async_data_store.call_write(close_configured_write_ahead_log, data_store):
+        async_data_store.call_write(
+            write_configured_snapshot, data_store, attachment_store, on_shutdown=True
+        )
+
+
 @app.get("/info", tags=["Metadata"])
 def metadata():
     return {
@@ -0,0 +1,89 @@
+# Benchmark: importing preseeded attachments by copying them into the attachment store, versus
+# using them in place through hardlinks or symlinks.
+#
+# Run from the repository root:
+#   python -m benchmarks.attachment_import [files] [files per folder] [size in KB]
+# Generates a manifest of the given number of files (default 20000), spread over folders of
+# DPPs (default 10 files each) of the given size (default 16 KB), in a temporary directory.
+# Every mode imports the same files into a fresh attachment store. Copies are hashed and stored
+# once per content, files used in place are only listed, and their size is read on first use.
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.utils import import_preseeded_attachments
+
+
+def generate_attachments(path: str, files: int, files_per_folder: int, size: int):
+    manifest = {}
+    for i in range(files):
+        source_id = f"urn:manufacturer:Bench:{i // files_per_folder:08d}"
+        file_name = f"manual-{i}.pdf"
+        folder = os.path.join(path, "dpps", source_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, file_name), "wb") as f:
+            f.write(os.urandom(size))
+        manifest[f"bench{i:08d}"] = {
+            "type": "document",
+            "source": "instance",
+            "source_id": source_id,
+            "attachment_id": f"bench{i:08d}",
+            "description": "Manual",
+            "file_name": file_name,
+        }
+    with open(os.path.join(path, "attachment_index.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def main(files: int, files_per_folder: int, size_kb: int):
+    logging.disable(logging.CRITICAL)
+    directory = tempfile.mkdtemp(prefix="attachment-import-")
+    try:
+        source_path = os.path.join(directory, "preseeded")
+        target_path = os.path.join(directory, "attachments")
+        generate_attachments(source_path, files, files_per_folder, size_kb * 1024)
+        print(f"{files} attachments of {size_kb} KB, {files_per_folder} per folder")
+        print(f"{'mode':>10} {'import s':>9} {'first use s':>12}")
+        for mode in ["copy", "hardlink", "symlink"]:
+            attachment_store = FileSystemAttachmentStore(
+                {
+                    "path": target_path,
+                    "renditions": {"workers": 0},
+                    "thumbnails": {"path": os.path.join(directory, "thumbnails")},
+                },
+                reset=True,
+            )
+            start_time = time.perf_counter()
+            import_preseeded_attachments(
+                source_path, target_path, attachment_store, mode=mode
+            )
+            import_time = time.perf_counter() - start_time
+            if len(attachment_store.attachments_index) != files:
+                raise Exception("Not all attachments were imported")
+
+            start_time = time.perf_counter()
+            total_size = sum(
+                attachment_reference.get_file_size() or 0
+                for attachment_reference in attachment_store.attachments_index.values()
+            )
+            first_use_time = time.perf_counter() - start_time
+            if total_size != files * size_kb * 1024:
+                raise Exception("Sizes of the imported attachments do not match")
+            print(f"{mode:>10} {import_time:>9.3f} {first_use_time:>12.3f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+    )
@@ -0,0 +1,140 @@
+# Benchmark: latency of DPP reads while large attachments are uploaded, with the former upload
+# path (blocking copy inside the async handler) versus the streaming upload on worker threads.
+#
+# Run from the repository root:
+#   python -m benchmarks.concurrent_uploads [uploaders] [size in MB] [seconds]
+# One client reads DPPs by ID, one request at a time, while uploaders (default 4) keep uploading
+# files of the given size (default 32 MB) for the given number of seconds (default 10). Requests
+# run in-process through an ASGI transport. Uploaded attachments are deleted afterwards.
+import asyncio
+import logging
+import os
+import shutil
+import statistics
+import sys
+import time
+import types
+import warnings
+from pathlib import Path
+
+import httpx
+from fastapi import UploadFile
+
+from app.datamodel.attachment import AttachmentReference
+from app.main import app, attachment_store, data_store
+
+
+# The former way: copying the upload blocks the event loop.
+async def blocking_add_attachment(
+    self, file: UploadFile, partial_attachment_ref: AttachmentReference
+) -> AttachmentReference:
+    unique_file_id = self.generate_unique_id_for_uploaded_attachment()
+    file_path = Path(self.generate_path(partial_attachment_ref), unique_file_id)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with file_path.open("wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    attachment_reference = AttachmentReference(
+        attachment_type=partial_attachment_ref.attachment_type,
+        path=file_path.as_posix(),
+        source=partial_attachment_ref.source,
+        source_id=partial_attachment_ref.source_id,
+        attachment_id=unique_file_id,
+        file_size=file.size,
+        file_name=file.filename,
+    )
+    self.attachments_index[unique_file_id] = attachment_reference
+    return attachment_reference
+
+
+async def read_latencies(client: httpx.AsyncClient, dpp_ids, stop: asyncio.Event):
+    latencies = []
+    while not stop.is_set():
+        dpp_id = dpp_ids[len(latencies) % len(dpp_ids)]
+        start_time = time.perf_counter()
+        response = await client.get(f"/dpps/{dpp_id}")
+        latencies.append(time.perf_counter() - start_time)
+        if response.status_code != 200:
+            raise Exception(f"Unexpected status {response.status_code}")
+        # Leave the event loop to the uploads in between reads.
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def upload(client: httpx.AsyncClient, dpp_id: str, content: bytes, stop):
+    attachment_ids = []
+    while not stop.is_set():
+        response = await client.post(
+            f"/dpps/{dpp_id}/attachments",
+            files={"file": ("manual.pdf", content, "application/pdf")},
+            data={"attachment_type": "document"},
+        )
+        if response.status_code != 200:
+            raise Exception(f"Unexpected status {response.status_code}")
+        attachment_ids.append(response.json()["attachment_id"])
+    return attachment_ids
+
+
+async def measure(dpp_ids, uploaders: int, content: bytes, seconds: float):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        stop = asyncio.Event()
+        reader = asyncio.create_task(read_latencies(client, dpp_ids, stop))
+        uploads = [
+            asyncio.create_task(upload(client, dpp_ids[i], content, stop))
+            for i in range(uploaders)
+        ]
+        await asyncio.sleep(seconds)
+        stop.set()
+        latencies = await reader
+        attachment_ids = [id for ids in await asyncio.gather(*uploads) for id in ids]
+    for attachment_id in attachment_ids:
+        attachment_store.delete_attachment(attachment_id)
+    return latencies, len(attachment_ids)
+
+
+def report(variant: str, latencies, uploaded: int, size: int, seconds: float):
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    print(
+        f"{variant:>10} {len(latencies):>6} {statistics.median(latencies) * 1000:>8.1f}"
+        f" {percentile(0.99) * 1000:>8.1f} {latencies[-1] * 1000:>8.1f}"
+        f" {uploaded * size / seconds / 2**20:>10.1f}"
+    )
+
+
+def main(uploaders: int, size_mb: int, seconds: float):
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings("ignore")
+    dpp_ids = sorted(data_store.dpp_store)
+    content = os.urandom(size_mb * 2**20)
+    print(f"{uploaders} uploaders of {size_mb} MB files, {seconds:.0f}s per variant")
+    print(
+        f"{'variant':>10} {'reads':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        f" {'upload MB/s':>10}"
+    )
+    for variant in ["idle", "blocking", "streaming"]:
+        if variant == "blocking":
+            attachment_store.add_attachment = types.MethodType(
+                blocking_add_attachment, attachment_store
+            )
+        elif "add_attachment" in vars(attachment_store):
+            del attachment_store.add_attachment
+        latencies, uploaded = asyncio.run(
+            measure(
+                dpp_ids,
+                uploaders if variant != "idle" else 0,
+                content,
+                seconds,
+            )
+        )
+        report(variant, latencies, uploaded, len(content), seconds)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 32,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 10.0,
+    )
@@ -0,0 +1,87 @@
+# Benchmark: GET /dpps/{id}/full before and after pre-encoded, cached responses.
+#
+# Run from the repository root:
+#   python -m benchmarks.dpp_full_response [repeats]
+# "before" serves the endpoint the former way: build the document and render it with the
+# stdlib json encoder on every request. "after" is the current endpoint, which serves cached
+# bytes from the configured encoder. Both are measured end-to-end through a TestClient, and
+# the rendering steps are also measured separately.
+import logging
+import sys
+import time
+import warnings
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.api.responses import EncodedJSONResponse
+from app.datamodel.encoding import JSON_ENCODERS
+from app.datastores.data.basedatastore import DPPResponseContentFormats
+from app.main import app, data_store
+
+FULL = DPPResponseContentFormats.FULL.value
+
+
+def timed(function, repeats: int):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main(repeats: int):
+    logging.getLogger().setLevel(logging.WARNING)
+    warnings.filterwarnings("ignore")
+
+    # The largest full document, which is the oscillator module passport in the preseeded data.
+    document_id = max(
+        data_store.dpp_store,
+        key=lambda dpp_id: len(data_store.get_encoded_dpp_document(dpp_id, FULL)),
+    )
+    size = len(data_store.get_encoded_dpp_document(document_id, FULL))
+    print(f"document {document_id} ({size / 1024:.0f} KB encoded)")
+
+    before_app = FastAPI()
+
+    @before_app.get("/dpps/{document_id}/full")
+    async def get_dpp_full_before(document_id: str):
+        return JSONResponse(
+            data_store.get_dpp_document(document_id, content_format=FULL)
+        )
+
+    before_client = TestClient(before_app)
+    after_client = TestClient(app)
+    path = "/dpps/" + document_id + "/full"
+    assert before_client.get(path).json() == after_client.get(path).json()
+
+    def build():
+        return data_store.get_dpp_document(document_id, content_format=FULL)
+
+    document = build()
+    steps = [
+        ("build document", build),
+        ("render stdlib json", lambda: JSONResponse(document)),
+    ]
+    for name, encoder in JSON_ENCODERS.items():
+        steps.append(
+            (f"encode {name}", lambda encoder=encoder: encoder(document)),
+        )
+    steps += [
+        (
+            "cached bytes",
+            lambda: EncodedJSONResponse(
+                data_store.get_encoded_dpp_document(document_id, FULL)
+            ),
+        ),
+        ("GET before", lambda: before_client.get(path)),
+        ("GET after", lambda: after_client.get(path)),
+    ]
+    print(f"{'step':>20} {'ms':>10}")
+    for name, function in steps:
+        print(f"{name:>20} {timed(function, repeats):>10.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
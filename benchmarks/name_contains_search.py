@@ -0,0 +1,66 @@
+# Benchmark: name_contains lookups through the TrigramIndex versus the former linear scan.
+#
+# Run from the repository root:
+#   python -m benchmarks.name_contains_search [sizes...]
+# Default sizes are 10000 100000 1000000. The largest size needs a few GB of memory for the index.
+import random
+import sys
+import time
+import uuid
+
+from app.datastores.data.indexes import TrigramIndex
+
+MANUFACTURERS = ["Elenco", "StyleEase", "ThreadLine", "Tuskla", "TNO"]
+PRODUCTS = ["Resistor Group", "LED Group", "T-Shirt", "Battery", "Oscillator Module"]
+QUERIES = ["elenco", "tuskla:0a", "battery", "oscillator module", "4b2e-8", "ba"]
+REPEATS = 20
+
+
+def generate_passports(size: int):
+    random.seed(size)
+    return [
+        (
+            f"urn:manufacturer:{random.choice(MANUFACTURERS)}:{uuid.UUID(int=random.getrandbits(128))}",
+            f"{random.choice(PRODUCTS)} - {i}",
+        )
+        for i in range(size)
+    ]
+
+
+def linear_scan(passports, name_contains: str):
+    needle = name_contains.lower()
+    return {
+        dpp_id
+        for dpp_id, title in passports
+        if needle in dpp_id.lower() or needle in title.lower()
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = function(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000, result
+
+
+def main(sizes):
+    print(f"{'size':>9} {'query':>18} {'matches':>9} {'scan ms':>10} {'index ms':>10}")
+    for size in sizes:
+        passports = generate_passports(size)
+        start = time.perf_counter()
+        index = TrigramIndex()
+        for dpp_id, title in passports:
+            index.add(dpp_id, dpp_id, title)
+        build_time = time.perf_counter() - start
+        print(f"{size:>9} index built in {build_time:.2f}s")
+        for query in QUERIES:
+            scan_ms, scan_result = timed(linear_scan, passports, query)
+            index_ms, index_result = timed(index.search, query)
+            assert scan_result == index_result
+            print(
+                f"{size:>9} {query:>18} {len(index_result):>9} {scan_ms:>10.3f} {index_ms:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,104 @@
+# Benchmark: throughput of importing DPP files, the former serial loop versus the bulk import
+# pipeline with thread and process pools.
+#
+# Run from the repository root:
+#   python -m benchmarks.preseeded_import [copies] [workers]
+# The preseeded DPP files are copied (copies, default 300) times with renamed IDs into a
+# temporary folder, and imported into a fresh InMemoryStore for every variant.
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from app.config import config
+from app.datamodel.serde import import_dpp_into_storage
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.utils import import_dpp_files
+from app.main import attachment_store
+
+
+def collect_ids(document, ids):
+    if isinstance(document, dict):
+        for key, value in document.items():
+            if key in ("@id", "id") and isinstance(value, str):
+                ids.add(value)
+            else:
+                collect_ids(value, ids)
+    elif isinstance(document, list):
+        for value in document:
+            collect_ids(value, ids)
+    return ids
+
+
+def generate_dpp_files(source_path: str, target_path: str, copies: int) -> int:
+    number_of_files = 0
+    for file_name in sorted(os.listdir(source_path)):
+        with open(os.path.join(source_path, file_name)) as f:
+            text = f.read()
+        ids = collect_ids(json.loads(text), set())
+        for copy in range(copies):
+            copy_text = text
+            for document_id in ids:
+                copy_text = copy_text.replace(
+                    f'"{document_id}"', f'"{document_id}-{copy}"'
+                )
+            copy_path = os.path.join(target_path, f"{copy}-{file_name}")
+            with open(copy_path, "w") as f:
+                f.write(copy_text)
+            number_of_files += 1
+    return number_of_files
+
+
+def import_serial(path: str, data_store: InMemoryStore):
+    for dpp_json_id in os.listdir(path):
+        with open(os.path.join(path, dpp_json_id), "+rb") as f:
+            dpp_json = json.loads(f.read())
+            import_dpp_into_storage(dpp_json, data_store, attachment_store)
+
+
+def main(copies: int, workers: int | None):
+    logging.getLogger().setLevel(logging.WARNING)
+    source_path = os.path.join(config["preseeded-data"]["path"], "dpps")
+    variants = [
+        ("serial (former)", import_serial),
+        (
+            "pipeline thread",
+            lambda path, data_store: import_dpp_files(
+                path, data_store, workers, "thread"
+            ),
+        ),
+        (
+            "pipeline process",
+            lambda path, data_store: import_dpp_files(
+                path, data_store, workers, "process"
+            ),
+        ),
+    ]
+    with tempfile.TemporaryDirectory() as target_path:
+        number_of_files = generate_dpp_files(source_path, target_path, copies)
+        size = sum(entry.stat().st_size for entry in os.scandir(target_path)) / (
+            1024 * 1024
+        )
+        print(
+            f"{number_of_files} files, {size:.0f} MB, workers: {workers or os.cpu_count()}"
+        )
+        print(f"{'variant':>18} {'seconds':>9} {'files/s':>9} {'DPPs/s':>9}")
+        for name, import_function in variants:
+            data_store = InMemoryStore(config["identities"], attachment_store)
+            start = time.perf_counter()
+            import_function(target_path, data_store)
+            elapsed_time = time.perf_counter() - start
+            number_of_dpps = len(data_store.dpp_store)
+            print(
+                f"{name:>18} {elapsed_time:>9.2f} {number_of_files / elapsed_time:>9.0f}"
+                f" {number_of_dpps / elapsed_time:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        int(sys.argv[2]) if len(sys.argv) > 2 else None,
+    )
@@ -0,0 +1,165 @@
+# Benchmark: read throughput of the API with shared state (data.shared) and 1..N worker
+# processes. Before measuring, an event is added through one connection, and every worker
+# has to serve it.
+#
+# Run from the repository root:
+#   python -m benchmarks.shared_read_scaling [max workers] [seconds] [clients]
+# Worker counts double from 1 up to max workers (default: the number of CPUs). Clients
+# (default: the number of CPUs) are separate processes with keep-alive connections, requesting
+# DPPs by ID for the given number of seconds (default 10) per worker count. Read throughput can
+# only scale with the number of workers on a machine with CPUs for both workers and clients.
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+CONNECTIONS_PER_CLIENT = 4
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(connection: http.client.HTTPConnection, method: str, path: str, body=None):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(
+        method, path, json.dumps(body) if body is not None else None, headers
+    )
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def write_config(directory: str) -> str:
+    with open("appconfig.yaml") as f:
+        benchmark_config = yaml.safe_load(f)
+    benchmark_config["mode"] = "production"
+    benchmark_config["attachment"]["path"] = os.path.join(directory, "attachments")
+    data_config = benchmark_config["data"]
+    data_config["type"] = "inmemory"
+    data_config["snapshot"] = {
+        "path": os.path.join(directory, "store.snapshot"),
+        "load_on_startup": True,
+        "write_on_shutdown": True,
+    }
+    data_config["wal"] = {"path": os.path.join(directory, "store.wal")}
+    data_config["shared"] = {"enabled": True}
+    config_path = os.path.join(directory, "appconfig.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(benchmark_config, f)
+    return config_path
+
+
+def start_server(config_path: str, port: int, workers: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app"]
+        + ["--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=dict(os.environ, PYC_CONFIG=config_path),
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline and server.poll() is None:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            if request(connection, "GET", "/healthz")[0] == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise Exception("Server did not start")
+
+
+def load_client(port: int, dpp_ids, seconds: float, results) -> None:
+    connections = [
+        http.client.HTTPConnection("127.0.0.1", port)
+        for _ in range(CONNECTIONS_PER_CLIENT)
+    ]
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        connection = connections[count % len(connections)]
+        status, _ = request(connection, "GET", "/dpps/" + dpp_ids[count % len(dpp_ids)])
+        if status != 200:
+            raise Exception(f"Unexpected status {status}")
+        count += 1
+    results.put(count)
+
+
+def check_shared_write(port: int, dpp_id: str, connections: int) -> bool:
+    event_id = "urn:benchmark:events:" + str(time.time_ns())
+    event = {"@id": event_id, "prov:atTime": {"@value": "2024-01-01T00:00:00Z"}}
+    writer = http.client.HTTPConnection("127.0.0.1", port)
+    request(writer, "POST", f"/dpps/{dpp_id}/events/activity", event)
+    # New connections are spread over the workers.
+    for _ in range(connections):
+        reader = http.client.HTTPConnection("127.0.0.1", port)
+        _, body = request(reader, "GET", f"/dpps/{dpp_id}/events/activity")
+        reader.close()
+        if event_id not in body.decode("utf-8"):
+            return False
+    return True
+
+
+def measure(port: int, dpp_ids, seconds: float, clients: int) -> float:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=load_client, args=(port, dpp_ids, seconds, results)
+        )
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total / seconds
+
+
+def main(max_workers: int, seconds: float, clients: int):
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+    print(f"CPUs: {os.cpu_count()}, clients: {clients}, {seconds:.0f}s per run")
+    if (os.cpu_count() or 1) < worker_counts[-1] + clients:
+        # Workers and clients compete for the CPUs, so this run does not show read scaling.
+        print(
+            "Fewer CPUs than workers and clients: the speedup is not a measure of scaling,"
+            " only the shared column is."
+        )
+    print(f"{'workers':>8} {'requests/s':>11} {'speedup':>8} {'shared':>7}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_config(directory)
+        for workers in worker_counts:
+            port = free_port()
+            server = start_server(config_path, port, workers)
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port)
+                _, body = request(connection, "POST", "/dpps/search", {})
+                dpp_ids = [result["value"] for result in json.loads(body)]
+                shared = check_shared_write(port, dpp_ids[0], 4 * workers)
+                throughput = measure(port, dpp_ids, seconds, clients)
+            finally:
+                server.terminate()
+                server.wait()
+            baseline = baseline or throughput
+            print(
+                f"{workers:>8} {throughput:>11.0f} {throughput / baseline:>8.2f}"
+                f" {'yes' if shared else 'NO':>7}"
+            )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 10.0,
+        int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1,
+    )
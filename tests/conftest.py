@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+import pytest
+import yaml
+
+# The app reads its config on import, so the tests point it to a copy of appconfig.yaml that
+# keeps all runtime data in a temporary folder, without snapshot or write-ahead log.
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = tempfile.mkdtemp(prefix="dpp-data-repository-tests-")
+
+with open(os.path.join(REPOSITORY_PATH, "appconfig.yaml"), "r") as stream:
+    test_config = yaml.safe_load(stream)
+test_config["attachment"]["path"] = os.path.join(DATA_PATH, "attachments")
+test_config["attachment"]["thumbnails"]["path"] = os.path.join(DATA_PATH, "thumbnails")
+test_config["credentials"]["received"]["path"] = os.path.join(DATA_PATH, "credentials")
+test_config["data"].pop("snapshot", None)
+test_config["data"].pop("wal", None)
+test_config["data"]["sqlite"]["path"] = os.path.join(DATA_PATH, "sqlite", "test.db")
+test_config["preseeded-data"]["path"] = os.path.join(REPOSITORY_PATH, "preseeded-data")
+with open(os.path.join(DATA_PATH, "appconfig.yaml"), "w") as stream:
+    yaml.safe_dump(test_config, stream)
+os.environ["PYC_CONFIG"] = os.path.join(DATA_PATH, "appconfig.yaml")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
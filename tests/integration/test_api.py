@@ -0,0 +1,208 @@
+import hashlib
+import os
+
+
+def get_dpp_id(client) -> str:
+    response = client.get("/dpps/latest")
+    assert response.status_code == 200
+    return response.json()["result"]
+
+
+def add_attachment(client, document_id: str, content: bytes, file_name: str) -> dict:
+    response = client.post(
+        f"/dpps/{document_id}/attachments",
+        files={"file": (file_name, content, "text/plain")},
+        data={"attachment_type": "document"},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_full_attachment(client, document_id: str, attachment_id: str):
+    response = client.get(f"/dpps/{document_id}/full")
+    assert response.status_code == 200
+    attachments = {
+        attachment["attachment_id"]: attachment
+        for attachment in response.json()["attachments"]
+    }
+    return attachments.get(attachment_id, None), response.headers["etag"]
+
+
+def test_attachment_changes_update_dpp(client):
+    document_id = get_dpp_id(client)
+    _, initial_etag = get_full_attachment(client, document_id, "")
+
+    attachment = add_attachment(client, document_id, b"first", "first.txt")
+    attachment_id = attachment["attachment_id"]
+    listed_attachment, added_etag = get_full_attachment(
+        client, document_id, attachment_id
+    )
+    assert listed_attachment["file_name"] == "first.txt"
+    assert added_etag != initial_etag
+
+    response = client.put(
+        f"/dpps/{document_id}/attachments/{attachment_id}",
+        files={"file": ("second.txt", b"second content", "text/plain")},
+    )
+    assert response.status_code == 200
+    listed_attachment, updated_etag = get_full_attachment(
+        client, document_id, attachment_id
+    )
+    assert listed_attachment["file_name"] == "second.txt"
+    assert listed_attachment["file_size"] == len(b"second content")
+    assert updated_etag != added_etag
+
+    response = client.delete(f"/dpps/{document_id}/attachments/{attachment_id}")
+    assert response.status_code == 200
+    listed_attachment, deleted_etag = get_full_attachment(
+        client, document_id, attachment_id
+    )
+    assert listed_attachment is None
+    assert deleted_etag != updated_etag
+    response = client.get(f"/dpps/{document_id}/attachments/{attachment_id}")
+    assert response.status_code == 404
+    response = client.delete(f"/dpps/{document_id}/attachments/{attachment_id}")
+    assert response.status_code == 404
+
+
+def test_stale_entity_tag_after_attachment_change(client):
+    document_id = get_dpp_id(client)
+    response = client.get(f"/dpps/{document_id}/full")
+    entity_tag = response.headers["etag"]
+    response = client.get(
+        f"/dpps/{document_id}/full", headers={"If-None-Match": entity_tag}
+    )
+    assert response.status_code == 304
+
+    add_attachment(client, document_id, b"content", "content.txt")
+    response = client.get(
+        f"/dpps/{document_id}/full", headers={"If-None-Match": entity_tag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != entity_tag
+    response = client.get(
+        f"/dpps/{document_id}/full",
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 304
+
+
+def encode_image(color: str, size) -> bytes:
+    from io import BytesIO
+
+    from PIL import Image
+
+    image_file = BytesIO()
+    Image.new("RGB", size, color).save(image_file, format="PNG")
+    return image_file.getvalue()
+
+
+def test_replace_attachment(client):
+    document_id = get_dpp_id(client)
+    response = client.put(
+        f"/dpps/{document_id}/attachments/missing",
+        files={"file": ("missing.txt", b"missing", "text/plain")},
+    )
+    assert response.status_code == 404
+
+    response = client.post(
+        f"/dpps/{document_id}/attachments",
+        files={"file": ("red.png", encode_image("red", (40, 20)), "image/png")},
+        data={"attachment_type": "image"},
+    )
+    assert response.status_code == 200
+    attachment_id = response.json()["attachment_id"]
+    download = client.get(f"/dpps/{document_id}/attachments/{attachment_id}")
+    thumbnail = client.get(
+        f"/dpps/{document_id}/attachments/{attachment_id}/thumbnail?height=10"
+    )
+    assert thumbnail.status_code == 200
+
+    blue_image = encode_image("blue", (20, 40))
+    response = client.put(
+        f"/dpps/{document_id}/attachments/{attachment_id}",
+        files={"file": ("blue.png", blue_image, "image/png")},
+    )
+    assert response.status_code == 200
+    assert response.json()["file_name"] == "blue.png"
+    assert response.json()["file_size"] == len(blue_image)
+
+    # The download and the thumbnail show the new image, not a cached copy of the old one.
+    replaced_download = client.get(
+        f"/dpps/{document_id}/attachments/{attachment_id}",
+        headers={"If-None-Match": download.headers["etag"]},
+    )
+    assert replaced_download.status_code == 200
+    assert replaced_download.content == blue_image
+    replaced_thumbnail = client.get(
+        f"/dpps/{document_id}/attachments/{attachment_id}/thumbnail?height=10"
+    )
+    assert replaced_thumbnail.status_code == 200
+    assert replaced_thumbnail.content != thumbnail.content
+
+
+def test_thumbnail_is_not_upscaled(client):
+    from io import BytesIO
+
+    from PIL import Image
+
+    from app.api.dpp import MAX_THUMBNAIL_HEIGHT
+
+    document_id = get_dpp_id(client)
+    response = client.post(
+        f"/dpps/{document_id}/attachments",
+        files={"file": ("small.png", encode_image("red", (40, 20)), "image/png")},
+        data={"attachment_type": "image"},
+    )
+    assert response.status_code == 200
+    thumbnail_url = (
+        f"/dpps/{document_id}/attachments/{response.json()['attachment_id']}/thumbnail"
+    )
+
+    thumbnail = client.get(f"{thumbnail_url}?height={MAX_THUMBNAIL_HEIGHT}")
+    assert thumbnail.status_code == 200
+    assert Image.open(BytesIO(thumbnail.content)).size == (40, 20)
+    thumbnail = client.get(f"{thumbnail_url}?height={MAX_THUMBNAIL_HEIGHT + 1}")
+    assert thumbnail.status_code == 422
+
+    missing_thumbnail = client.get(
+        f"/dpps/{document_id}/attachments/missing/thumbnail?height=10"
+    )
+    assert missing_thumbnail.status_code == 404
+
+
+def test_resume_download(client):
+    document_id = get_dpp_id(client)
+    content = os.urandom(3 * 2**20)
+    response = client.post(
+        f"/dpps/{document_id}/attachments",
+        files={"file": ("manual.pdf", content, "application/pdf")},
+        data={"attachment_type": "document"},
+    )
+    url = f"/dpps/{document_id}/attachments/{response.json()['attachment_id']}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+    entity_tag = response.headers["etag"]
+    assert entity_tag == f'"{hashlib.sha256(content).hexdigest()}"'
+
+    # An interrupted download continues where it stopped.
+    offset = len(content) * 4 // 5
+    response = client.get(
+        url, headers={"Range": f"bytes={offset}-", "If-Range": entity_tag}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-range"] == (
+        f"bytes {offset}-{len(content) - 1}/{len(content)}"
+    )
+    assert response.content == content[offset:]
+
+    # With an outdated ETag, the whole file is sent again.
+    response = client.get(
+        url, headers={"Range": f"bytes={offset}-", "If-Range": '"outdated"'}
+    )
+    assert response.status_code == 200
+    assert response.content == content
+
+    response = client.get(url, headers={"If-None-Match": entity_tag})
+    assert response.status_code == 304
@@ -0,0 +1,172 @@
+import base64
+import json
+from datetime import datetime
+
+
+def search(client, filter_conditions: dict, **params):
+    response = client.post("/dpps/search", json=filter_conditions, params=params)
+    assert response.status_code == 200
+    return response
+
+
+def test_search_pages(client):
+    results = search(client, {}).json()
+    assert len(results) > 3
+
+    page_results = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = search(client, {}, **params).json()
+        assert len(page["results"]) <= 2
+        page_results += page["results"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert page_results == results
+
+    # A cursor without a limit returns all remaining results.
+    cursor = search(client, {}, limit=1).json()["next_cursor"]
+    assert search(client, {}, cursor=cursor).json() == {
+        "results": results[1:],
+        "next_cursor": None,
+    }
+
+
+def test_search_stream(client):
+    filter_conditions = {"name_contains": "a"}
+    results = search(client, filter_conditions).json()
+    assert results
+
+    response = search(client, filter_conditions, stream=True)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == results
+
+    cursor = search(client, filter_conditions, limit=1).json()["next_cursor"]
+    response = search(client, filter_conditions, stream=True, limit=2, cursor=cursor)
+    assert [json.loads(line) for line in response.text.splitlines()] == results[1:3]
+
+
+def test_search_with_invalid_cursor(client):
+    unknown_cursor = base64.urlsafe_b64encode(b"urn:unknown").decode("ascii")
+    for cursor in ["not base64!", unknown_cursor]:
+        response = client.post(
+            "/dpps/search", json={}, params={"limit": 2, "cursor": cursor}
+        )
+        assert response.status_code == 400
+        response = client.post(
+            "/dpps/search", json={}, params={"stream": True, "cursor": cursor}
+        )
+        assert response.status_code == 400
+
+
+def test_passports_created(client):
+    params = {"start": "2022-01-01T00:00:00Z", "end": "2023-12-31T00:00:00Z"}
+    response = client.get("/dpps/metadata/created", params=params)
+    assert response.status_code == 200
+    count = response.json()["count"]
+    assert count > 0
+
+    response = client.get(
+        "/dpps/metadata/created", params=dict(params, interval="month")
+    )
+    assert response.status_code == 200
+    histogram = response.json()
+    assert len(histogram) == 24
+    assert sum(bucket["count"] for bucket in histogram) == count
+
+    response = client.get(
+        "/dpps/metadata/created",
+        params={"start": "1900-01-01", "end": "2023-01-01", "interval": "day"},
+    )
+    assert response.status_code == 400
+    response = client.get(
+        "/dpps/metadata/created", params=dict(params, interval="year")
+    )
+    assert response.status_code == 422
+
+
+def test_latest_dpps(client):
+    latest_id = client.get("/dpps/latest").json()["result"]
+    response = client.get("/dpps/latest", params={"n": 3})
+    assert response.status_code == 200
+    latest_dpps = response.json()["result"]
+    assert len(latest_dpps) == 3
+    assert latest_dpps[0] == client.get(f"/dpps/{latest_id}/compact").json()
+
+    response = client.get("/dpps/latest", params={"n": 0})
+    assert response.status_code == 422
+    response = client.get("/dpps/latest", params={"n": 101})
+    assert response.status_code == 422
+
+
+def test_random_dpps(client):
+    search_results = search(client, {}).json()
+    document_ids = {result["value"] for result in search_results}
+    assert client.get("/dpps/random").json()["result"] in document_ids
+
+    response = client.get("/dpps/random", params={"count": 3})
+    assert response.status_code == 200
+    random_ids = response.json()["result"]
+    assert len(set(random_ids)) == 3 and set(random_ids) <= document_ids
+
+    passport_type = next(
+        iter(client.get("/dpps/metadata").json()["passport"]["passports_by_type"])
+    )
+    typed_results = search(client, {"passport_type": [passport_type]}).json()
+    response = client.get(
+        "/dpps/random", params={"count": 100, "passport_type": passport_type}
+    )
+    assert sorted(response.json()["result"]) == sorted(
+        result["value"] for result in typed_results
+    )
+    response = client.get(
+        "/dpps/random", params={"count": 5, "passport_type": "unknown"}
+    )
+    assert response.json()["result"] == []
+    response = client.get("/dpps/random", params={"passport_type": "unknown"})
+    assert response.json()["result"] is None
+    response = client.get("/dpps/random", params={"count": 0})
+    assert response.status_code == 422
+
+
+def test_events_in_time_range(client):
+    response = client.post("/dpps/search", json={})
+    document_id = response.json()[-1]["value"]
+    for day in [20, 5, 12]:
+        response = client.post(
+            f"/dpps/{document_id}/events/ownership",
+            json={
+                "@id": f"urn:test:events:range-{day}",
+                "@type": "Test",
+                "prov:atTime": {"@value": f"2021-03-{day:02d}T00:00:00Z"},
+            },
+        )
+        assert response.status_code == 200
+
+    response = client.get(
+        f"/dpps/{document_id}/events/ownership",
+        params={"since": "2021-03-05T00:00:00Z", "until": "2021-03-12T00:00:00Z"},
+    )
+    assert response.status_code == 200
+    assert [event["@id"] for event in response.json()] == [
+        "urn:test:events:range-5",
+        "urn:test:events:range-12",
+    ]
+    response = client.get(
+        f"/dpps/{document_id}/events",
+        params={"since": "2021-03-06T00:00:00Z", "until": "2021-03-31T00:00:00Z"},
+    )
+    assert [event["@id"] for event in response.json()] == [
+        "urn:test:events:range-12",
+        "urn:test:events:range-20",
+    ]
+    events = client.get(f"/dpps/{document_id}/events").json()
+    epochs = [
+        datetime.fromisoformat(event["prov:atTime"]["@value"].replace("Z", "+00:00"))
+        for event in events
+        if "prov:atTime" in event
+    ]
+    assert epochs == sorted(epochs)
+    response = client.get(f"/dpps/{document_id}/events", params={"since": "never"})
+    assert response.status_code == 422
@@ -0,0 +1,142 @@
+import asyncio
+import os
+from io import BytesIO
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from app.datamodel.attachment import AttachmentReference
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.attachments.renditions import RenditionPipeline, render_renditions
+
+
+@pytest.fixture
+def attachment_store(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    yield attachment_store
+    attachment_store.close()
+
+
+# Two attachments with the same content, and one with another.
+def import_attachments(attachment_store, in_place: bool) -> None:
+    attachment_manifest = {}
+    for attachment_id, content in (("a", b"same"), ("b", b"same"), ("c", b"other")):
+        directory = os.path.join(attachment_store.DPP_FILE_DIRECTORY, attachment_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "file.txt"), "wb") as f:
+            f.write(content)
+        attachment_manifest[attachment_id] = {
+            "type": "document",
+            "source": "instance",
+            "source_id": attachment_id,
+            "file_name": "file.txt",
+        }
+    attachment_store.import_attachments(attachment_manifest, in_place=in_place)
+
+
+def test_copied_attachments_are_deduplicated(attachment_store):
+    import_attachments(attachment_store, in_place=False)
+    index = attachment_store.attachments_index
+    assert index["a"].path == index["b"].path
+    assert attachment_store.get_attachment_storage_metrics()["blobs"] == 2
+
+
+def test_in_place_attachments_are_hashed_on_first_access(attachment_store):
+    import_attachments(attachment_store, in_place=True)
+    index = attachment_store.attachments_index
+    imported_reference = index["a"]
+    assert imported_reference.content_hash is None
+
+    response = attachment_store.retrieve_attachment("a")
+    assert response.headers["etag"] == f'"{index["a"].content_hash}"'
+    # The hashed reference replaces the imported one, which is left as it was.
+    assert imported_reference.content_hash is None
+    assert index["b"].content_hash is None
+    attachment_store.retrieve_attachment("b")
+    attachment_store.retrieve_attachment("c")
+    assert index["a"].content_hash == index["b"].content_hash
+    assert index["a"].content_hash != index["c"].content_hash
+    assert index["a"].file_size == 4
+
+    # Files used in place are not moved into blobs.
+    metrics = attachment_store.get_attachment_storage_metrics()
+    assert metrics["blobs"] == 0
+    assert metrics["bytes_saved"] == 0
+
+    # Deleting one leaves the file of the other.
+    attachment_store.delete_attachment("a")
+    assert os.path.isfile(index["b"].path)
+
+
+def upload(content: bytes, file_name: str) -> UploadFile:
+    return UploadFile(BytesIO(content), filename=file_name)
+
+
+def test_blob_references_follow_changes(attachment_store):
+    import_attachments(attachment_store, in_place=False)
+    index = attachment_store.attachments_index
+    same_hash, other_hash = index["a"].content_hash, index["c"].content_hash
+    same_path, other_path = index["a"].path, index["c"].path
+    assert attachment_store.blob_references == {same_hash: 2, other_hash: 1}
+    assert attachment_store.get_attachment_storage_metrics()["bytes_saved"] == 4
+
+    uploaded_reference = asyncio.run(
+        attachment_store.add_attachment(
+            upload(b"same", "uploaded.txt"),
+            AttachmentReference(
+                attachment_type="document", path=None, source="instance", source_id="d"
+            ),
+        )
+    )
+    assert uploaded_reference.path == same_path
+    assert attachment_store.blob_references[same_hash] == 3
+    assert attachment_store.get_attachment_storage_metrics()["bytes_saved"] == 8
+
+    # Shared content stays until its last attachment is deleted or replaced.
+    attachment_store.delete_attachment("a")
+    assert attachment_store.blob_references[same_hash] == 2
+    asyncio.run(attachment_store.update_attachment(upload(b"other", "b.txt"), "b"))
+    assert index["b"].path == other_path
+    assert attachment_store.blob_references == {same_hash: 1, other_hash: 2}
+    assert os.path.isfile(same_path)
+    attachment_store.delete_attachment(uploaded_reference.attachment_id)
+    assert attachment_store.blob_references == {other_hash: 2}
+    assert not os.path.isfile(same_path)
+
+    attachment_store.delete_attachment("c")
+    assert attachment_store.blob_references == {other_hash: 1}
+    assert attachment_store.get_attachment_storage_metrics() == {
+        "attachments": 1,
+        "blobs": 1,
+        "attachment_bytes": 5,
+        "stored_bytes": 5,
+        "bytes_saved": 0,
+    }
+    with open(attachment_store.retrieve_attachment("b").path, "rb") as f:
+        assert f.read() == b"other"
+    attachment_store.delete_attachment("b")
+    assert not attachment_store.blob_references
+    assert not os.path.isfile(other_path)
+
+
+def test_rendition_in_accepted_format(tmp_path):
+    image_path = str(tmp_path / "image.png")
+    Image.new("RGB", (40, 20), "red").save(image_path, format="PNG")
+    renditions = RenditionPipeline(str(tmp_path / "renditions"), [10], ["jpeg"], 0)
+    render_renditions(image_path, renditions.get_directory("hash"), [10], ["jpeg"])
+
+    assert renditions.get_rendition("hash", 10, ["webp"]) is None
+    rendition_path, image_format = renditions.get_rendition(
+        "hash", 10, ["webp", "jpeg"]
+    )
+    assert image_format == "jpeg"
+    assert Image.open(rendition_path).size == (20, 10)
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+from fastapi.responses import JSONResponse
+
+from app.api.responses import EncodedJSONResponse
+from app.config import config
+from app.datamodel.encoding import JSON_ENCODERS, decode_json, select_json_encoder
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.utils import import_dpp_files
+
+CONTENT_FORMATS = ["compact", "base", "full", "complete"]
+
+
+# Preseeded DPPs in every content format.
+@pytest.fixture
+def dpp_documents(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    data_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"), data_store, workers=1
+    )
+    yield [
+        data_store.get_dpp_document(document_id, content_format)
+        for document_id in sorted(data_store.dpp_store)
+        for content_format in CONTENT_FORMATS
+    ]
+    attachment_store.close()
+
+
+@pytest.mark.parametrize("encoder_name", sorted(JSON_ENCODERS))
+def test_encoders_match_json_response(dpp_documents, encoder_name):
+    encode_json = select_json_encoder(encoder_name)
+    for dpp_document in dpp_documents:
+        assert encode_json(dpp_document) == JSONResponse(dpp_document).body
+
+
+@pytest.mark.parametrize("encoder_name", sorted(JSON_ENCODERS))
+def test_encoders_handle_edge_cases(encoder_name):
+    encode_json = select_json_encoder(encoder_name)
+    content = {"text": "Grüße ✓", "large": 2**70, "nested": [None, True, 1.5]}
+    assert encode_json(content) == JSONResponse(content).body
+    assert decode_json(encode_json(content)) == content
+    assert json.loads(encode_json({1: "a"})) == {"1": "a"}
+
+
+def test_unknown_encoder():
+    with pytest.raises(Exception):
+        select_json_encoder("unknown")
+
+
+def test_encoded_content_is_sent_as_is():
+    content = b'{"already":"encoded"}'
+    assert EncodedJSONResponse(content).body == content
+    assert EncodedJSONResponse({"a": 1}).body == b'{"a":1}'
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.config import config
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.basedatastore import FilterConditions
+from app.datastores.data.executorstore import ExecutorDataStore, ReadWriteLock
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.utils import import_dpp_files
+
+
+@pytest.fixture
+def data_store(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    data_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"), data_store, workers=1
+    )
+    yield data_store
+    attachment_store.close()
+
+
+def test_slow_read_does_not_block_other_reads(data_store):
+    async_data_store = ExecutorDataStore(
+        data_store, ThreadPoolExecutor(2), ReadWriteLock()
+    )
+    slow_search_started = threading.Event()
+    slow_search_released = threading.Event()
+    search_for_dpp = data_store.search_for_dpp
+
+    def slow_search_for_dpp(filter_conditions):
+        slow_search_started.set()
+        assert slow_search_released.wait(10)
+        return search_for_dpp(filter_conditions)
+
+    data_store.search_for_dpp = slow_search_for_dpp
+    document_id = sorted(data_store.dpp_store)[0]
+
+    async def read_during_search():
+        slow_search = asyncio.create_task(
+            async_data_store.search_for_dpp(FilterConditions())
+        )
+        await asyncio.get_running_loop().run_in_executor(
+            None, slow_search_started.wait, 10
+        )
+        # The event loop and the other worker still serve reads.
+        dpp_document = await asyncio.wait_for(
+            async_data_store.get_dpp_document(document_id), 5
+        )
+        assert not slow_search.done()
+        slow_search_released.set()
+        return dpp_document, await slow_search
+
+    dpp_document, search_results = asyncio.run(read_during_search())
+    assert dpp_document == data_store.get_dpp_document(document_id)
+    assert search_results == search_for_dpp(FilterConditions())
+    async_data_store.close()
+
+
+def test_writes_exclude_reads():
+    lock = ReadWriteLock()
+    events = []
+    reading = threading.Event()
+
+    def read(name, hold=None):
+        with lock.read():
+            events.append(name)
+            reading.set()
+            if hold is not None:
+                assert hold.wait(10)
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    released = threading.Event()
+    first_read = threading.Thread(target=read, args=("first read", released))
+    first_read.start()
+    assert reading.wait(10)
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not lock.waiting_writers:
+        time.sleep(0.001)
+    # A waiting writer goes before reads arriving after it.
+    second_read = threading.Thread(target=read, args=("second read",))
+    second_read.start()
+    released.set()
+    for thread in [first_read, writer, second_read]:
+        thread.join(10)
+    assert events == ["first read", "write", "second read"]
+
+
+def test_concurrent_operations_match_sequential_ones(tmp_path, data_store):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "sequential"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "sequential-thumbnails")},
+        }
+    )
+    sequential_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"),
+        sequential_store,
+        workers=1,
+    )
+    async_data_store = ExecutorDataStore(
+        data_store, ThreadPoolExecutor(4), ReadWriteLock()
+    )
+    async_data_store.SEARCH_BATCH_SIZE = 2
+    document_ids = sorted(data_store.dpp_store)
+    events = [
+        {
+            "@id": f"urn:test:events:{n}",
+            "@type": "Test",
+            "prov:atTime": {"@value": f"2022-08-{1 + n % 28:02d}T{n // 28:02d}:00:00Z"},
+        }
+        for n in range(40)
+    ]
+
+    async def search():
+        return [
+            result
+            async for result in async_data_store.search_for_dpp_iterator(
+                FilterConditions()
+            )
+        ]
+
+    async def run_operations():
+        return await asyncio.gather(
+            *[
+                async_data_store.add_dpp_event(
+                    document_ids[n % len(document_ids)], dict(event)
+                )
+                for n, event in enumerate(events)
+            ],
+            *[search() for _ in range(5)],
+        )
+
+    results = asyncio.run(run_operations())
+    for n, event in enumerate(events):
+        sequential_store.add_dpp_event(document_ids[n % len(document_ids)], dict(event))
+    assert (
+        results[len(events) :]
+        == [sequential_store.search_for_dpp(FilterConditions())] * 5
+    )
+    for document_id in document_ids:
+        assert data_store.get_dpp_full_events(
+            document_id, event_type="all"
+        ) == sequential_store.get_dpp_full_events(document_id, event_type="all")
+    async_data_store.close()
+    attachment_store.close()
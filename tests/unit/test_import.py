@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from app.config import config
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.basedatastore import FilterConditions
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.utils import import_dpp_files, parse_json_files
+
+CONTENT_FORMATS = ["compact", "base", "full", "complete"]
+DPP_PATH = os.path.join(config["preseeded-data"]["path"], "dpps")
+
+
+@pytest.fixture
+def attachment_store(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    yield attachment_store
+    attachment_store.close()
+
+
+def get_state(data_store: InMemoryStore) -> list:
+    return [
+        [data_store.get_dpp_document(document_id, f) for f in CONTENT_FORMATS]
+        + [data_store.get_dpp_events(document_id, event_type="all")]
+        for document_id in data_store.dpp_ids_by_sequence
+    ] + [
+        data_store.search_for_dpp(FilterConditions()),
+        data_store.get_latest_added_dpp_document_ids(100),
+    ]
+
+
+def test_parsed_in_order():
+    paths = [entry.path for entry in os.scandir(DPP_PATH) if entry.is_file()]
+    documents = []
+    for path in paths:
+        with open(path, "r") as f:
+            documents.append(json.load(f))
+    for executor_type in ["thread", "process"]:
+        assert list(parse_json_files(paths, 2, executor_type)) == documents
+
+
+@pytest.mark.parametrize("executor_type", ["thread", "process"])
+def test_bulk_import_matches_serial_import(attachment_store, executor_type):
+    # One file at a time, in directory listing order.
+    serial_store = InMemoryStore(config["identities"], attachment_store)
+    paths = [entry.path for entry in os.scandir(DPP_PATH) if entry.is_file()]
+    for path in paths:
+        with open(path, "r") as f:
+            serial_store.add_dpp_document(None, json.load(f))
+
+    bulk_store = InMemoryStore(config["identities"], attachment_store)
+    progress = []
+    imported = import_dpp_files(
+        DPP_PATH,
+        bulk_store,
+        workers=4,
+        executor_type=executor_type,
+        batch_size=2,
+        progress=lambda imported, total: progress.append((imported, total)),
+    )
+    assert imported == len(paths)
+    assert progress == [
+        (min(batch_end, len(paths)), len(paths))
+        for batch_end in range(2, len(paths) + 2, 2)
+    ]
+    assert get_state(bulk_store) == get_state(serial_store)
+
+
+def test_unknown_executor_type():
+    with pytest.raises(Exception):
+        list(parse_json_files([], 1, "unknown"))
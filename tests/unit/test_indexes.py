@@ -0,0 +1,83 @@
+import random
+
+from app.datastores.data.indexes import IdRegistry, SortedTimeIndex, TrigramIndex
+
+
+def test_bulk_add_matches_single_inserts():
+    generator = random.Random(1)
+    # Few IDs and timestamps, so there are replacements and ties.
+    additions = [
+        (f"dpp-{generator.randrange(50)}", generator.randrange(5)) for _ in range(500)
+    ]
+    single_index = SortedTimeIndex()
+    for document_id, epoch in additions:
+        single_index.add(document_id, epoch)
+    bulk_index = SortedTimeIndex()
+    for start in range(0, len(additions), 37):
+        with bulk_index.bulk_add():
+            for document_id, epoch in additions[start : start + 37]:
+                bulk_index.add(document_id, epoch)
+            bulk_index.remove("dpp-0")
+
+    single_index.remove("dpp-0")
+    assert bulk_index.epochs == single_index.epochs
+    assert bulk_index.document_ids == single_index.document_ids
+    assert bulk_index.latest(10) == single_index.latest(10)
+    assert bulk_index.count(1, 3) == single_index.count(1, 3)
+
+
+def test_id_registry_removes_by_swapping():
+    registry = IdRegistry()
+    for i in range(10):
+        registry.add(f"dpp-{i}")
+    registry.add("dpp-0")
+    for document_id in ["dpp-3", "dpp-9", "dpp-0", "unknown"]:
+        registry.remove(document_id)
+
+    remaining_ids = {f"dpp-{i}" for i in [1, 2, 4, 5, 6, 7, 8]}
+    assert set(registry.ids) == remaining_ids
+    assert len(registry) == len(remaining_ids)
+    for position, document_id in enumerate(registry.ids):
+        assert registry.positions[document_id] == position
+    assert "dpp-3" not in registry
+    assert registry.choice() in remaining_ids
+    sample = registry.sample(5)
+    assert len(set(sample)) == 5 and set(sample) <= remaining_ids
+    assert set(registry.sample(100)) == remaining_ids
+    assert IdRegistry().choice() is None
+
+
+def test_trigram_search_matches_linear_scan():
+    generator = random.Random(1)
+    texts = {
+        f"urn:dpp:{n}": (
+            f"urn:dpp:{n}",
+            "".join(generator.choice("abcAB ") for _ in range(generator.randrange(12))),
+        )
+        for n in range(200)
+    }
+    index = TrigramIndex()
+    for document_id, document_texts in texts.items():
+        index.add(document_id, *document_texts)
+    # Replaced and removed texts leave no trace in the postings.
+    for n in range(0, 200, 7):
+        texts[f"urn:dpp:{n}"] = (f"urn:dpp:{n}", "Replaced")
+        index.add(f"urn:dpp:{n}", *texts[f"urn:dpp:{n}"])
+    for n in range(0, 200, 11):
+        del texts[f"urn:dpp:{n}"]
+        index.remove(f"urn:dpp:{n}")
+    index.remove("unknown")
+
+    substrings = ["", "a", "Ab", "abc", "bca b", "dpp:1", "urn:dpp:19", "replaced"]
+    # Text of one document spanning its ID and title does not match.
+    substrings += [f"{document_id}{title[:2]}" for document_id, title in texts.values()]
+    for substring in substrings:
+        assert index.search(substring) == {
+            document_id
+            for document_id, document_texts in texts.items()
+            if any(substring.lower() in text.lower() for text in document_texts)
+        }, substring
+        assert index.search(substring) <= index.candidates(substring)
+    assert len(index) == len(texts)
+    assert set().union(*index.postings.values()) == set(texts)
+    assert all(index.postings.values())
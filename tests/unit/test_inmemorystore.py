@@ -0,0 +1,482 @@
+import copy
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+from app.config import config
+from app.datamodel.encoding import encode_json
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.basedatastore import FilterConditions
+from app.datastores.data.inmemorystore import InMemoryStore, InMemoryStoreStatistics
+from app.datastores.utils import import_dpp_files
+
+
+@pytest.fixture
+def data_store(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    data_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"), data_store, workers=1
+    )
+    yield data_store
+    attachment_store.close()
+
+
+# Search results of a full scan over all DPPs, in insertion order.
+def scan(data_store: InMemoryStore, filters: FilterConditions) -> list:
+    results = []
+    for document_id in data_store.dpp_ids_by_sequence:
+        dpp = data_store.dpp_store[document_id]
+        if filters.name_contains and not any(
+            filters.name_contains.lower() in text.lower()
+            for text in (dpp.id, dpp.title)
+            if text
+        ):
+            continue
+        if filters.passport_type and dpp.passport_type not in filters.passport_type:
+            continue
+        if filters.tags and not set(filters.tags).issubset(set(dpp.tags)):
+            continue
+        if filters.batch_ids and dpp.batch_id not in filters.batch_ids:
+            continue
+        if (
+            filters.registration_id
+            and dpp.registration_id
+            and filters.registration_id not in dpp.registration_id
+        ):
+            continue
+        if (
+            filters.current_country_codes
+            and dpp.current_owner
+            and data_store.get_country_code(dpp.current_owner)
+            not in filters.current_country_codes
+        ):
+            continue
+        if (
+            filters.origin_country_codes
+            and dpp.manufacturer
+            and data_store.get_country_code(dpp.manufacturer)
+            not in filters.origin_country_codes
+        ):
+            continue
+        results.append({"label": document_id, "value": document_id})
+    return results
+
+
+def get_filters(data_store: InMemoryStore) -> list:
+    tags = sorted(data_store.tag_index.keys())
+    passport_types = sorted(data_store.passport_type_index.keys())
+    batch_ids = sorted(key for key in data_store.batch_id_index.keys() if key)
+    return [
+        FilterConditions(),
+        FilterConditions(passport_type=passport_types[:1]),
+        FilterConditions(passport_type=passport_types[:2], tags=tags[:1]),
+        FilterConditions(tags=tags[:2]),
+        FilterConditions(batch_ids=batch_ids[:2]),
+        FilterConditions(current_country_codes=["NL"]),
+        FilterConditions(origin_country_codes=["NL", "DE"]),
+        FilterConditions(registration_id="REG20234"),
+        FilterConditions(registration_id="reg2023"),
+        FilterConditions(registration_id="7"),
+        FilterConditions(registration_id="REG", name_contains="osc"),
+        FilterConditions(name_contains="a"),
+        FilterConditions(name_contains="el"),
+        FilterConditions(name_contains="ELENCO"),
+        FilterConditions(name_contains="bat", tags=tags[:1]),
+        FilterConditions(name_contains="xyz"),
+    ]
+
+
+def test_search_matches_full_scan(data_store):
+    for filters in get_filters(data_store):
+        assert data_store.search_for_dpp(filters) == scan(data_store, filters), filters
+
+
+def test_indexes_follow_replaced_dpps(data_store):
+    document_id = next(
+        document_id
+        for document_id, dpp in data_store.dpp_store.items()
+        if dpp.registration_id
+    )
+    dpp_object = copy.deepcopy(data_store.dpp_store[document_id])
+    dpp_object.registration_id = "urn:registration:test:REPLACED"
+    dpp_object.title = "Replaced title"
+    data_store.add_dpp_object(document_id, dpp_object)
+
+    for filters in get_filters(data_store) + [
+        FilterConditions(registration_id="REPLACED"),
+        FilterConditions(name_contains="replaced"),
+    ]:
+        assert data_store.search_for_dpp(filters) == scan(data_store, filters), filters
+    assert data_store.search_for_dpp(FilterConditions(name_contains="replaced")) == [
+        {"label": document_id, "value": document_id}
+    ]
+
+
+def get_creation_time(dpp):
+    return datetime.fromisoformat(dpp.creation_timestamp.replace("Z", "+00:00"))
+
+
+TIME_RANGES = [
+    (
+        datetime(2022, 1, 1, tzinfo=timezone.utc),
+        datetime(2030, 1, 1, tzinfo=timezone.utc),
+    ),
+    (
+        datetime(2022, 7, 22, 10, tzinfo=timezone.utc),
+        datetime(2022, 9, 4, 12, tzinfo=timezone.utc),
+    ),
+    (
+        datetime(2023, 1, 15, 10, tzinfo=timezone.utc),
+        datetime(2023, 1, 15, 10, tzinfo=timezone.utc),
+    ),
+]
+
+
+# Statistics of a full scan over all DPPs and events.
+def scan_statistics(data_store: InMemoryStore) -> dict:
+    dpps = list(data_store.dpp_store.values())
+    return {
+        "passports_by_batch": dict(
+            Counter(dpp.batch_id or "undefined" for dpp in dpps)
+        ),
+        "passports_by_tag": dict(Counter(tag for dpp in dpps for tag in dpp.tags)),
+        "passports_by_type": dict(Counter(dpp.passport_type for dpp in dpps)),
+        "number_connected_passports": sum(
+            1 for dpp in dpps if dpp.subpassports or dpp.parent
+        ),
+        "passports_created": [
+            sum(
+                1
+                for dpp in dpps
+                if dpp.creation_timestamp
+                and start_time <= get_creation_time(dpp) <= end_time
+            )
+            for start_time, end_time in TIME_RANGES
+        ],
+        "number_event_types": dict(
+            Counter(
+                event.get("@type", event.get("type", None))
+                for event in data_store.event_store.values()
+            )
+        ),
+    }
+
+
+def get_statistics(data_store: InMemoryStore) -> dict:
+    statistics = InMemoryStoreStatistics(data_store)
+    passport_statistics = statistics.to_dict()["passport"]
+    return {
+        "passports_by_batch": passport_statistics["passports_by_batch"],
+        "passports_by_tag": passport_statistics["passports_by_tag"],
+        "passports_by_type": passport_statistics["passports_by_type"],
+        "number_connected_passports": passport_statistics["number_connected_passports"],
+        "passports_created": [
+            statistics.passports_created_in_time_range(start_time, end_time)
+            for start_time, end_time in TIME_RANGES
+        ],
+        "number_event_types": statistics.number_per_event_type(),
+    }
+
+
+def test_statistics_follow_changes(data_store):
+    assert get_statistics(data_store) == scan_statistics(data_store)
+    document_ids = sorted(data_store.dpp_store)
+    event = {
+        "@id": "urn:test:events:1",
+        "@type": "Test",
+        "prov:atTime": {"@value": "2022-03-01T00:00:00Z"},
+    }
+    data_store.add_dpp_event(document_ids[0], copy.deepcopy(event))
+    data_store.add_dpp_event(document_ids[1], copy.deepcopy(event), "ownership")
+    assert get_statistics(data_store) == scan_statistics(data_store)
+    data_store.update_dpp_event(document_ids[0], dict(event, **{"@type": "Updated"}))
+    assert get_statistics(data_store) == scan_statistics(data_store)
+    data_store.delete_dpp_event(document_ids[0], event["@id"])
+    assert get_statistics(data_store) == scan_statistics(data_store)
+
+    single_ids = [
+        document_id
+        for document_id in document_ids
+        if not data_store.dpp_store[document_id].parent
+        and not data_store.dpp_store[document_id].subpassports
+    ][:2]
+    data_store.attach_subpassport_by_id(*single_ids)
+    assert get_statistics(data_store) == scan_statistics(data_store)
+    data_store.detach_subpassport_by_id(*single_ids)
+    assert get_statistics(data_store) == scan_statistics(data_store)
+
+    # A replaced DPP moves to other batches, tags, types and creation times.
+    for document_id, creation_timestamp in [
+        (document_ids[0], "2023-01-15T10:00:00Z"),
+        (document_ids[1], None),
+    ]:
+        dpp_object = copy.deepcopy(data_store.dpp_store[document_id])
+        dpp_object.batch_id = None
+        dpp_object.tags = ["replaced"]
+        dpp_object.passport_type = "ReplacedPassport"
+        dpp_object.creation_timestamp = creation_timestamp
+        data_store.add_dpp_object(document_id, dpp_object)
+        assert get_statistics(data_store) == scan_statistics(data_store)
+
+
+@pytest.mark.parametrize("interval", ["day", "week", "month"])
+def test_histogram_matches_full_scan(data_store, interval):
+    statistics = InMemoryStoreStatistics(data_store)
+    start_time = datetime(2022, 7, 22, 10, tzinfo=timezone.utc)
+    end_time = datetime(2023, 1, 15, 10, tzinfo=timezone.utc)
+    histogram = statistics.passports_created_histogram(start_time, end_time, interval)
+    creation_times = [
+        get_creation_time(dpp)
+        for dpp in data_store.dpp_store.values()
+        if dpp.creation_timestamp
+    ]
+    for bucket in histogram:
+        bucket_start = datetime.fromisoformat(bucket["start"])
+        bucket_end = datetime.fromisoformat(bucket["end"])
+        assert bucket["count"] == sum(
+            1
+            for creation_time in creation_times
+            if max(bucket_start, start_time) <= creation_time <= end_time
+            and creation_time < bucket_end
+        ), bucket
+    assert histogram[0]["start"] <= start_time.isoformat() < histogram[0]["end"]
+    assert histogram[-1]["start"] <= end_time.isoformat() < histogram[-1]["end"]
+    assert sum(bucket["count"] for bucket in histogram) == (
+        statistics.passports_created_in_time_range(start_time, end_time)
+    )
+
+
+def test_latest_added_dpps(data_store):
+    creation_times = {
+        document_id: get_creation_time(dpp)
+        for document_id, dpp in data_store.dpp_store.items()
+        if dpp.creation_timestamp
+    }
+    latest_ids = data_store.get_latest_added_dpp_document_ids(len(data_store.dpp_store))
+    assert sorted(latest_ids) == sorted(creation_times)
+    latest_times = [creation_times[document_id] for document_id in latest_ids]
+    assert latest_times == sorted(latest_times, reverse=True)
+    assert data_store.get_latest_added_dpp_document_id() == latest_ids[0]
+
+    # A DPP replaced with a newer creation time becomes the latest one.
+    document_id = latest_ids[-1]
+    dpp_object = copy.deepcopy(data_store.dpp_store[document_id])
+    dpp_object.creation_timestamp = "2030-01-01T00:00:00Z"
+    data_store.add_dpp_object(document_id, dpp_object)
+    assert data_store.get_latest_added_dpp_document_ids(2) == [
+        document_id,
+        latest_ids[0],
+    ]
+
+
+def test_sampling_matches_filters(data_store):
+    for filters in get_filters(data_store):
+        matching_ids = {result["value"] for result in scan(data_store, filters)}
+        for count in [1, 3, len(data_store.dpp_store)]:
+            sample = data_store.sample_dpp_document_ids(count, filters)
+            assert len(sample) == len(set(sample)) == min(count, len(matching_ids))
+            assert set(sample) <= matching_ids, filters
+
+
+EVENT_TYPES = ["activity", "ownership", "all"]
+
+
+# Events of DPPs in timestamp order within [since, until], as (epoch, event ID) pairs.
+def scan_events(data_store, document_ids, event_type, since=None, until=None) -> list:
+    event_types = ["activity", "ownership"] if event_type == "all" else [event_type]
+    event_ids = {
+        event_id
+        for document_id in document_ids
+        for linked_event_type in event_types
+        for event_id in data_store.dpp_store[document_id].events[linked_event_type]
+    }
+    timeline = sorted(
+        (InMemoryStore.extract_event_epoch(data_store.event_store[event_id]), event_id)
+        for event_id in event_ids
+    )
+    return [
+        (epoch, event_id)
+        for epoch, event_id in timeline
+        if (since is None or since.timestamp() <= epoch)
+        and (until is None or epoch <= until.timestamp())
+    ]
+
+
+# Returned events as (epoch, event ID) pairs, checking they are in timestamp order.
+def get_timeline(events: list) -> list:
+    timeline = [
+        (InMemoryStore.extract_event_epoch(event), InMemoryStore.get_id_value(event))
+        for event in events
+    ]
+    assert [epoch for epoch, _ in timeline] == sorted(epoch for epoch, _ in timeline)
+    return sorted(timeline)
+
+
+def get_time_ranges(data_store) -> list:
+    epochs = sorted(
+        epoch for epoch in data_store.event_epochs.values() if epoch != float("-inf")
+    )
+    # Bounds on event timestamps, to check that both ends are included.
+    boundary = datetime.fromtimestamp(epochs[len(epochs) // 2], timezone.utc)
+    return [
+        (None, None),
+        (boundary, None),
+        (None, boundary),
+        (boundary, boundary),
+        (
+            datetime(2022, 8, 1, tzinfo=timezone.utc),
+            datetime(2023, 1, 1, tzinfo=timezone.utc),
+        ),
+    ]
+
+
+def assert_events_match_scan(data_store) -> None:
+    for document_id in data_store.dpp_store:
+        for event_type in EVENT_TYPES:
+            for since, until in get_time_ranges(data_store):
+                assert get_timeline(
+                    data_store.get_dpp_events(
+                        document_id, event_type=event_type, since=since, until=until
+                    )
+                ) == scan_events(data_store, [document_id], event_type, since, until)
+
+
+def test_events_are_ordered(data_store):
+    assert_events_match_scan(data_store)
+    document_id = sorted(data_store.dpp_store)[0]
+    # Added out of order, and one without an ID and timestamp.
+    for day in [20, 5, 12]:
+        data_store.add_dpp_event(
+            document_id,
+            {
+                "@id": f"urn:test:events:{day}",
+                "@type": "Test",
+                "prov:atTime": {"@value": f"2022-08-{day:02d}T00:00:00Z"},
+            },
+        )
+    data_store.add_dpp_event(document_id, {"@type": "Test"}, "ownership")
+    assert_events_match_scan(data_store)
+
+    data_store.update_dpp_event(
+        document_id,
+        {
+            "@id": "urn:test:events:5",
+            "@type": "Test",
+            "prov:endedAtTime": {"@value": "2022-08-25T00:00:00Z"},
+        },
+    )
+    data_store.delete_dpp_event(document_id, "urn:test:events:12")
+    assert_events_match_scan(data_store)
+    assert [
+        InMemoryStore.get_id_value(event)
+        for event in data_store.get_dpp_events(
+            document_id,
+            since=datetime(2022, 8, 1, tzinfo=timezone.utc),
+            until=datetime(2022, 8, 31, tzinfo=timezone.utc),
+        )
+    ] == ["urn:test:events:20", "urn:test:events:5"]
+
+
+def get_subtree(data_store, document_id) -> list:
+    subtree = [document_id]
+    for dpp_id in subtree:
+        subtree += [
+            subpassport_id
+            for subpassport_id in data_store.dpp_store[dpp_id].subpassports
+            if subpassport_id not in subtree
+        ]
+    return subtree
+
+
+def assert_full_events_match_scan(data_store) -> None:
+    for document_id in data_store.dpp_store:
+        subtree = get_subtree(data_store, document_id)
+        for event_type in EVENT_TYPES:
+            for since, until in get_time_ranges(data_store):
+                assert get_timeline(
+                    data_store.get_dpp_full_events(
+                        document_id, event_type=event_type, since=since, until=until
+                    )
+                ) == scan_events(data_store, subtree, event_type, since, until)
+
+
+def test_cached_full_events_follow_changes(data_store):
+    # Read all full timelines first, so each change has cached timelines to invalidate.
+    assert_full_events_match_scan(data_store)
+    # A subpassport two levels below a root passport, and the DPPs that are not connected.
+    leaf_id = next(
+        document_id
+        for document_id, dpp in data_store.dpp_store.items()
+        if dpp.parent and data_store.dpp_store[dpp.parent].parent
+    )
+    root_id = data_store.dpp_store[data_store.dpp_store[leaf_id].parent].parent
+    single_ids = [
+        document_id
+        for document_id in sorted(data_store.dpp_store)
+        if not data_store.dpp_store[document_id].parent
+        and not data_store.dpp_store[document_id].subpassports
+    ][:2]
+
+    event = {
+        "@id": "urn:test:events:nested",
+        "@type": "Test",
+        "prov:atTime": {"@value": "2022-08-15T00:00:00Z"},
+    }
+    data_store.add_dpp_event(leaf_id, copy.deepcopy(event), "ownership")
+    assert_full_events_match_scan(data_store)
+    assert "urn:test:events:nested" in [
+        InMemoryStore.get_id_value(event)
+        for event in data_store.get_dpp_full_events(root_id, event_type="all")
+    ]
+    data_store.update_dpp_event(
+        leaf_id, dict(event, **{"prov:atTime": {"@value": "2021-01-01T00:00:00Z"}})
+    )
+    assert_full_events_match_scan(data_store)
+
+    data_store.attach_subpassport_by_id(leaf_id, single_ids[0])
+    data_store.attach_subpassport_by_id(single_ids[0], single_ids[1])
+    assert_full_events_match_scan(data_store)
+    data_store.add_dpp_event(single_ids[1], copy.deepcopy(event))
+    assert_full_events_match_scan(data_store)
+    data_store.detach_subpassport_by_id(leaf_id, single_ids[0])
+    assert_full_events_match_scan(data_store)
+    data_store.delete_dpp_event(leaf_id, "urn:test:events:nested")
+    assert_full_events_match_scan(data_store)
+
+
+def test_encoded_dpps_follow_changes(data_store):
+    document_id = sorted(data_store.dpp_store)[0]
+    for content_format in ["compact", "base", "full", "complete"]:
+        encoded_dpp = data_store.get_encoded_dpp_document(document_id, content_format)
+        assert encoded_dpp == encode_json(
+            data_store.get_dpp_document(document_id, content_format)
+        )
+        # Served from the response cache until the DPP changes.
+        assert (
+            data_store.get_encoded_dpp_document(document_id, content_format)
+            is encoded_dpp
+        )
+    data_store.add_dpp_event(
+        document_id,
+        {
+            "@id": "urn:test:events:encoded",
+            "@type": "Test",
+            "prov:atTime": {"@value": "2022-08-01T00:00:00Z"},
+        },
+    )
+    encoded_dpp = data_store.get_encoded_dpp_document(document_id, "complete")
+    assert b"urn:test:events:encoded" in encoded_dpp
+    assert encoded_dpp == encode_json(
+        data_store.get_dpp_document(document_id, "complete")
+    )
@@ -0,0 +1,160 @@
+import copy
+import json
+import os
+
+import pytest
+
+from app.config import config
+from app.datamodel.attachment import AttachmentReference
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.basedatastore import FilterConditions
+from app.datastores.data.inmemorystore import InMemoryStore, InMemoryStoreStatistics
+from app.datastores.data.mongostore import MongoStore, MongoStoreStatistics
+from app.datastores.utils import import_dpp_files
+
+mongomock = pytest.importorskip("mongomock")
+
+CONTENT_FORMATS = ["compact", "base", "full", "complete"]
+EVENT_TYPES = ["activity", "ownership", "all"]
+
+
+# The same preseeded DPPs in an InMemoryStore and in a MongoStore on mongomock.
+@pytest.fixture
+def stores(tmp_path):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+    in_memory_store = InMemoryStore(config["identities"], attachment_store)
+    mongo_store = MongoStore(
+        {"database": "dpp-data-repository"},
+        config["identities"],
+        attachment_store,
+        client=mongomock.MongoClient(),
+    )
+    dpp_path = os.path.join(config["preseeded-data"]["path"], "dpps")
+    for data_store in [in_memory_store, mongo_store]:
+        import_dpp_files(dpp_path, data_store, workers=1)
+    yield in_memory_store, mongo_store
+    attachment_store.close()
+
+
+def get_state(data_store, document_ids) -> list:
+    return [
+        [data_store.get_dpp_document(document_id, f) for f in CONTENT_FORMATS]
+        + [data_store.get_dpp_events(document_id, event_type=t) for t in EVENT_TYPES]
+        for document_id in document_ids
+    ]
+
+
+def get_statistics(statistics) -> dict:
+    # Through JSON, so sets and tuples compare as lists.
+    return json.loads(json.dumps(statistics.to_dict(), sort_keys=True, default=sorted))
+
+
+def assert_same_state(in_memory_store, mongo_store):
+    document_ids = sorted(in_memory_store.dpp_store)
+    assert get_state(mongo_store, document_ids) == get_state(
+        in_memory_store, document_ids
+    )
+    assert get_statistics(MongoStoreStatistics(mongo_store)) == get_statistics(
+        InMemoryStoreStatistics(in_memory_store)
+    )
+
+
+def test_import(stores):
+    assert_same_state(*stores)
+    in_memory_store, mongo_store = stores
+    assert mongo_store.get_latest_added_dpp_document_ids(
+        5
+    ) == in_memory_store.get_latest_added_dpp_document_ids(5)
+
+
+@pytest.mark.parametrize(
+    "name_contains", [None, "a", "el", "osc", "ELENCO", "urn:manu", "xyz"]
+)
+def test_search(stores, name_contains):
+    in_memory_store, mongo_store = stores
+    tags = sorted(in_memory_store.tag_index.keys())[:2]
+    passport_types = sorted(in_memory_store.passport_type_index.keys())[:1]
+    for filter_conditions in [
+        FilterConditions(name_contains=name_contains),
+        FilterConditions(name_contains=name_contains, tags=tags[:1]),
+        FilterConditions(name_contains=name_contains, passport_type=passport_types),
+        FilterConditions(
+            name_contains=name_contains, current_country_codes=["NL", "DE"]
+        ),
+    ]:
+        results = in_memory_store.search_for_dpp(filter_conditions)
+        assert mongo_store.search_for_dpp(filter_conditions) == results
+        if results:
+            after_document_id = results[len(results) // 2]["value"]
+            assert list(
+                mongo_store.search_for_dpp_iterator(
+                    filter_conditions, after_document_id
+                )
+            ) == list(
+                in_memory_store.search_for_dpp_iterator(
+                    filter_conditions, after_document_id
+                )
+            )
+
+
+def test_mutations(stores):
+    in_memory_store, mongo_store = stores
+    document_ids = sorted(in_memory_store.dpp_store)
+    event = {
+        "@id": "urn:test:events:1",
+        "@type": "Test",
+        "prov:atTime": {"@value": "2022-03-01T00:00:00Z"},
+    }
+    updated_event = dict(event, **{"prov:atTime": {"@value": "2021-03-01T00:00:00Z"}})
+    subpassport_ids = [
+        document_id
+        for document_id in document_ids
+        if not in_memory_store.dpp_store[document_id].parent
+        and not in_memory_store.dpp_store[document_id].subpassports
+    ][:2]
+    for data_store in stores:
+        data_store.add_dpp_event(document_ids[0], copy.deepcopy(event), "activity")
+        data_store.add_dpp_event(document_ids[1], copy.deepcopy(event), "ownership")
+        data_store.update_dpp_event(document_ids[0], copy.deepcopy(updated_event))
+        data_store.attach_subpassport_by_id(*subpassport_ids)
+    assert_same_state(in_memory_store, mongo_store)
+
+    for data_store in stores:
+        data_store.delete_dpp_event(document_ids[0], event["@id"])
+        data_store.detach_subpassport_by_id(*subpassport_ids)
+    assert_same_state(in_memory_store, mongo_store)
+
+
+def test_attachment_change(stores):
+    in_memory_store, mongo_store = stores
+    document_id = sorted(in_memory_store.dpp_store)[0]
+    attachment_reference = AttachmentReference(
+        attachment_type="document",
+        path=None,
+        source="instance",
+        source_id=document_id,
+        attachment_id="test-attachment",
+        file_name="test.txt",
+        file_size=4,
+    )
+    versions = mongo_store.get_dpp_version(document_id)
+    for data_store in stores:
+        data_store.register_attachment_change(
+            "test-attachment", attachment_reference, document_id
+        )
+    assert mongo_store.get_dpp_version(document_id) > versions
+    assert "test-attachment" in mongo_store.get_dpp_object(document_id).attachments
+    assert_same_state(in_memory_store, mongo_store)
+
+    for data_store in stores:
+        data_store.register_attachment_change("test-attachment", None)
+    assert "test-attachment" not in mongo_store.get_dpp_object(document_id).attachments
+    assert_same_state(in_memory_store, mongo_store)
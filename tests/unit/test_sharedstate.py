@@ -0,0 +1,145 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.config import config
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.executorstore import ReadWriteLock
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.sharedstate import SharedDataStore, SharedLogFollower
+from app.datastores.snapshot import load_snapshot, write_snapshot
+from app.datastores.utils import import_dpp_files
+from app.datastores.wal import WriteAheadLog, replay_write_ahead_log
+
+
+# Two workers sharing a snapshot and write-ahead log, set up as at startup in shared mode:
+# the first one imports the data and writes the snapshot, the other loads it.
+@pytest.fixture
+def workers(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot" / "store.snapshot")
+    wal_path = str(tmp_path / "snapshot" / "store.wal")
+    lock_path = str(tmp_path / "snapshot" / "store.lock")
+    created_workers = []
+
+    def create_worker(compaction_interval: int) -> SharedDataStore:
+        attachment_store = FileSystemAttachmentStore(
+            {
+                "path": str(tmp_path / "attachments"),
+                "renditions": {"workers": 0},
+                "thumbnails": {
+                    "path": str(tmp_path / f"thumbnails-{len(created_workers)}")
+                },
+            }
+        )
+        data_store = InMemoryStore(config["identities"], attachment_store)
+        if not load_snapshot(snapshot_path, data_store, attachment_store):
+            import_dpp_files(
+                os.path.join(config["preseeded-data"]["path"], "dpps"),
+                data_store,
+                workers=1,
+            )
+            write_snapshot(snapshot_path, data_store, attachment_store)
+        replay_write_ahead_log(wal_path, data_store)
+
+        def compact() -> None:
+            write_ahead_log.truncate(
+                lambda: write_snapshot(snapshot_path, data_store, attachment_store)
+            )
+
+        write_ahead_log = WriteAheadLog(
+            wal_path, compaction_interval=compaction_interval, compact=compact
+        )
+        write_ahead_log.skip_to(data_store.applied_log_sequence)
+        data_store.mutation_log = write_ahead_log
+        follower = SharedLogFollower(
+            data_store, attachment_store, wal_path, snapshot_path, lock_path
+        )
+        worker = SharedDataStore(
+            data_store, ThreadPoolExecutor(2), ReadWriteLock(), follower
+        )
+        created_workers.append((worker, attachment_store))
+        return worker
+
+    yield create_worker
+    for worker, attachment_store in created_workers:
+        worker.close()
+        worker.data_store.mutation_log.close()
+        worker.follower.lock_file.close()
+        attachment_store.close()
+
+
+def create_event(n: int) -> dict:
+    return {
+        "@id": f"urn:test:events:{n}",
+        "@type": "Test",
+        "prov:atTime": {"@value": f"2030-01-{n:02d}T00:00:00Z"},
+    }
+
+
+async def get_state(worker: SharedDataStore) -> list:
+    return [
+        (
+            await worker.get_dpp_document(document_id, "complete"),
+            await worker.get_dpp_full_events(document_id, event_type="all"),
+        )
+        for document_id in sorted(worker.data_store.dpp_store)
+    ]
+
+
+def test_workers_see_each_others_writes(workers):
+    first_worker = workers(compaction_interval=10000)
+    second_worker = workers(compaction_interval=10000)
+    document_ids = sorted(first_worker.data_store.dpp_store)
+    single_ids = [
+        document_id
+        for document_id, dpp in sorted(first_worker.data_store.dpp_store.items())
+        if not dpp.parent and not dpp.subpassports
+    ]
+
+    async def run():
+        await first_worker.add_dpp_event(document_ids[0], create_event(1))
+        assert [
+            event["@id"]
+            for event in await second_worker.get_dpp_events(document_ids[0])
+        ][-1:] == ["urn:test:events:1"]
+        await second_worker.attach_subpassport_by_id(*single_ids[:2])
+        await second_worker.add_dpp_event(document_ids[1], create_event(2))
+        await first_worker.delete_dpp_event(document_ids[0], "urn:test:events:1")
+        assert await first_worker.get_dpp_version(
+            single_ids[0]
+        ) == await second_worker.get_dpp_version(single_ids[0])
+        assert await get_state(first_worker) == await get_state(second_worker)
+
+    asyncio.run(run())
+    # Records are numbered across both workers.
+    assert first_worker.data_store.applied_log_sequence == 4
+    assert second_worker.data_store.applied_log_sequence == 4
+
+
+def test_workers_follow_compaction(workers):
+    first_worker = workers(compaction_interval=2)
+    second_worker = workers(compaction_interval=10000)
+    document_id = sorted(first_worker.data_store.dpp_store)[0]
+
+    async def run():
+        await second_worker.add_dpp_event(document_id, create_event(1))
+        # The second record of the first worker is due for compaction, which writes a
+        # snapshot and empties the log the second worker is following.
+        await first_worker.add_dpp_event(document_id, create_event(2))
+        await first_worker.add_dpp_event(document_id, create_event(3))
+        assert os.path.getsize(first_worker.follower.wal_path) == 0
+        await second_worker.add_dpp_event(document_id, create_event(4))
+        assert await get_state(first_worker) == await get_state(second_worker)
+        assert [
+            event["@id"] for event in await first_worker.get_dpp_events(document_id)
+        ][-4:] == [f"urn:test:events:{n}" for n in range(1, 5)]
+
+    asyncio.run(run())
+
+    # A worker started now loads the compacted snapshot and the rest of the log.
+    third_worker = workers(compaction_interval=10000)
+    assert asyncio.run(get_state(third_worker)) == asyncio.run(get_state(first_worker))
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+from app.config import config
+from app.datastores import snapshot
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.basedatastore import FilterConditions
+from app.datastores.data.inmemorystore import InMemoryStore, InMemoryStoreStatistics
+from app.datastores.snapshot import load_snapshot, write_snapshot
+from app.datastores.utils import import_dpp_files
+
+CONTENT_FORMATS = ["compact", "base", "full", "complete"]
+
+
+def create_attachment_store(tmp_path) -> FileSystemAttachmentStore:
+    return FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path / "attachments"),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path / "thumbnails")},
+        }
+    )
+
+
+# Preseeded DPPs with a changed event and attachment, and two attachments with the same
+# content, as written to a snapshot.
+@pytest.fixture
+def stores(tmp_path):
+    attachment_store = create_attachment_store(tmp_path)
+    data_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"), data_store, workers=1
+    )
+    attachment_manifest = {}
+    for attachment_id in ["a", "b"]:
+        directory = os.path.join(attachment_store.DPP_FILE_DIRECTORY, attachment_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "file.txt"), "wb") as f:
+            f.write(b"same")
+        attachment_manifest[attachment_id] = {
+            "type": "document",
+            "source": "instance",
+            "source_id": attachment_id,
+            "file_name": "file.txt",
+        }
+    attachment_store.import_attachments(attachment_manifest, in_place=False)
+
+    document_id = sorted(data_store.dpp_store)[0]
+    data_store.add_dpp_event(
+        document_id,
+        {
+            "@id": "urn:test:events:snapshot",
+            "@type": "Test",
+            "prov:atTime": {"@value": "2022-08-01T00:00:00Z"},
+        },
+    )
+    data_store.register_attachment_change(
+        "a", attachment_store.attachments_index["a"], document_id
+    )
+    yield data_store, attachment_store
+    attachment_store.close()
+
+
+def get_state(data_store: InMemoryStore) -> list:
+    statistics = InMemoryStoreStatistics(data_store)
+    return [
+        [data_store.get_dpp_document(document_id, f) for f in CONTENT_FORMATS]
+        + [
+            data_store.get_dpp_events(document_id, event_type="all"),
+            data_store.get_dpp_full_events(document_id, event_type="all"),
+            data_store.get_dpp_version(document_id),
+        ]
+        for document_id in sorted(data_store.dpp_store)
+    ] + [
+        data_store.search_for_dpp(FilterConditions()),
+        data_store.search_for_dpp(FilterConditions(name_contains="osc")),
+        data_store.get_latest_added_dpp_document_ids(100),
+        json.loads(json.dumps(statistics.to_dict(), default=sorted)),
+    ]
+
+
+def test_snapshot_round_trip(tmp_path, stores):
+    data_store, attachment_store = stores
+    path = str(tmp_path / "snapshot" / "store.snapshot")
+    assert write_snapshot(path, data_store, attachment_store) == os.path.getsize(path)
+
+    restored_attachment_store = create_attachment_store(tmp_path)
+    restored_data_store = InMemoryStore(config["identities"], restored_attachment_store)
+    assert load_snapshot(path, restored_data_store, restored_attachment_store)
+    assert get_state(restored_data_store) == get_state(data_store)
+    assert (
+        restored_attachment_store.attachments_index
+        == attachment_store.attachments_index
+    )
+    assert (
+        restored_attachment_store.get_attachment_storage_metrics()
+        == attachment_store.get_attachment_storage_metrics()
+    )
+    assert restored_attachment_store.retrieve_attachment("b").headers["etag"] == (
+        attachment_store.retrieve_attachment("b").headers["etag"]
+    )
+
+    # The restored store keeps working, with its indexes in step.
+    single_ids = [
+        document_id
+        for document_id, dpp in sorted(data_store.dpp_store.items())
+        if not dpp.parent and not dpp.subpassports
+    ][:2]
+    for store in [data_store, restored_data_store]:
+        store.delete_dpp_event(single_ids[0], "urn:test:events:snapshot")
+        store.attach_subpassport_by_id(*single_ids)
+    assert get_state(restored_data_store) == get_state(data_store)
+    restored_attachment_store.close()
+
+
+def test_unusable_snapshots_are_ignored(tmp_path, stores, monkeypatch):
+    data_store, attachment_store = stores
+    path = str(tmp_path / "store.snapshot")
+    empty_store = InMemoryStore(config["identities"], attachment_store)
+    assert not load_snapshot(path, empty_store, attachment_store)
+
+    with open(path, "wb") as f:
+        f.write(b"DPPSNAP")
+    assert not load_snapshot(path, empty_store, attachment_store)
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_FORMAT_VERSION", 0)
+    write_snapshot(path, data_store, attachment_store)
+    monkeypatch.undo()
+    assert not load_snapshot(path, empty_store, attachment_store)
+
+    write_snapshot(path, data_store, attachment_store)
+    os.unlink(attachment_store.attachments_index["a"].path)
+    assert not load_snapshot(path, empty_store, attachment_store)
+    assert not empty_store.dpp_store
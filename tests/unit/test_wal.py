@@ -0,0 +1,102 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.config import config
+from app.datastores.attachments.filesystemattachmentstore import (
+    FileSystemAttachmentStore,
+)
+from app.datastores.data.executorstore import ExecutorDataStore, ReadWriteLock
+from app.datastores.data.inmemorystore import InMemoryStore
+from app.datastores.utils import import_dpp_files
+from app.datastores.wal import WriteAheadLog, read_log_records, replay_write_ahead_log
+
+
+@pytest.fixture(scope="module")
+def attachment_store(tmp_path_factory):
+    attachment_store = FileSystemAttachmentStore(
+        {
+            "path": str(tmp_path_factory.mktemp("attachments")),
+            "renditions": {"workers": 0},
+            "thumbnails": {"path": str(tmp_path_factory.mktemp("thumbnails"))},
+        }
+    )
+    yield attachment_store
+    attachment_store.close()
+
+
+def create_data_store(attachment_store) -> InMemoryStore:
+    data_store = InMemoryStore(config["identities"], attachment_store)
+    import_dpp_files(
+        os.path.join(config["preseeded-data"]["path"], "dpps"), data_store, workers=1
+    )
+    return data_store
+
+
+def create_event(day: int) -> dict:
+    return {"prov:atTime": {"@value": f"2023-01-{day:02d}T00:00:00Z"}}
+
+
+# Timeline and modification time per DPP.
+def get_timelines(data_store: InMemoryStore) -> dict:
+    return {
+        document_id: (
+            data_store.get_dpp_events(document_id, event_type="all"),
+            data_store.get_dpp_last_modified(document_id),
+        )
+        for document_id in sorted(data_store.dpp_store)
+    }
+
+
+def test_concurrent_writes_share_fsyncs(tmp_path, attachment_store):
+    data_store = create_data_store(attachment_store)
+    wal_path = str(tmp_path / "store.wal")
+    write_ahead_log = WriteAheadLog(wal_path, commit_delay=0.01)
+    data_store.mutation_log = write_ahead_log
+    async_data_store = ExecutorDataStore(
+        data_store, ThreadPoolExecutor(4), ReadWriteLock()
+    )
+    document_ids = sorted(data_store.dpp_store)
+
+    async def add_events():
+        await asyncio.gather(
+            *[
+                async_data_store.add_dpp_event(
+                    document_ids[n % len(document_ids)], create_event(1 + n % 28)
+                )
+                for n in range(40)
+            ]
+        )
+
+    asyncio.run(add_events())
+    # Every write returned after its record was durable.
+    assert write_ahead_log.durable_sequence == write_ahead_log.sequence == 40
+    assert write_ahead_log.group_commits < 40
+    async_data_store.close()
+    write_ahead_log.close()
+
+    replayed_data_store = create_data_store(attachment_store)
+    assert replay_write_ahead_log(wal_path, replayed_data_store) == 40
+    assert get_timelines(replayed_data_store) == get_timelines(data_store)
+
+
+def test_operation_is_one_record(tmp_path, attachment_store):
+    data_store = create_data_store(attachment_store)
+    wal_path = str(tmp_path / "store.wal")
+    data_store.mutation_log = WriteAheadLog(wal_path)
+    document_id = sorted(data_store.dpp_store)[0]
+    data_store.add_dpp_events(
+        document_id, [create_event(day) for day in range(1, 6)], None
+    )
+    data_store.mutation_log.close()
+
+    records = list(read_log_records(wal_path))
+    assert [operation for _, _, operation, _, _ in records] == ["apply_mutations"]
+    replayed_data_store = create_data_store(attachment_store)
+    assert replay_write_ahead_log(wal_path, replayed_data_store) == 1
+    assert (
+        get_timelines(replayed_data_store)[document_id]
+        == get_timelines(data_store)[document_id]
+    )